@@ -1,14 +1,30 @@
 import os
 import gzip
+import functools
+import importlib.util
 import numpy as np
 import pandas as pd
 import datetime as dt
 import zipfile as zf
+from fileio import map_files, sort_by_start, concat_presorted
+from colstore import DayCache
+from cleaning import Cleaner
+import intervals
+from catalog import start_from_name
+from timestamps import from_components, from_cadence
+import deployments
 # import pysftp
 # import netrc
 
 datapath_local = '/data/aal-pip/data'
 datapath_remote = '/home/aalpip/data'
+# decoded day cache used by import_subsys(cache=True)
+cache_path = os.path.expanduser('~/.cache/mist/aalpip')
+cache_max_bytes = 20 * 2**30
+# interval tables written by build_intervals
+intervals_path = os.path.expanduser('~/.cache/mist/aalpip_intervals')
+# steps longer than this count as a data gap
+gap_thresholds = {'fg': '10s', 'sc': '1s', 'hskp': '5min'}
 
 # PG0_sys2 = pd.date_range()
 
@@ -41,39 +57,183 @@ lon_ranges = {'SPA': (-180, 180),
               'PG4': (12.23, 12.27),
               'PG5': (5.68, 5.72)}
 
+# Fastest csv parser available for the fluxgate readers
+csv_engine = 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c'
+
+# searchcoil counts to nT
+sc_scale = .0049 / 4.43
+
+# Csv layouts per (subsystem, generation). SYS1 (PEN) files are zipped, SYS2+ files gzipped.
+#   time: timestamp columns in the file (Y, M, D, h, m, s order), never part of the output
+#   rename: file column -> our column name
+#   drop: file columns that are never parsed
+#   columns: our columns to parse by default, None for everything not dropped
+#   dtypes: parse dtypes by our column names, always applied
+schemas = {
+    ('hskp', 'sys1'): {'time': ['Year', 'Month', 'Day', 'Hour', 'Min', 'Sec'],
+                       'rename': {'Sync Age(sec)': 'UTC_sync_age_secs',
+                                  'Time Error(sec)': 'sys_time_error_secs',
+                                  'GPS on for sync(%)': 'GPS_sync',
+                                  'GPS on for heat(%)': 'GPS_heat',
+                                  'Int modem on for comm(%)': 'int_modem_comm',
+                                  'Int modem on for heat(%)': 'int_modem_heat',
+                                  'Int modem is overtemp(%)': 'int_modem_overtemp',
+                                  'Ext modem is on for comm(%)': 'ext_modem_comm',
+                                  'Lat (deg)': 'lat',
+                                  'Long (deg)': 'long',
+                                  'Battery Temp(C) Avg': 'T_batt_1',
+                                  'CPU Board Temp(C) Avg': 'T_router',
+                                  'Battery(V) Avg': 'V_batt_1',
+                                  '3.3 V Avg': '3v3',
+                                  'Int. Modem RF': 'int_modem_signal',
+                                  ' Ext. Modem RF': 'ext_modem_signal'},
+                       'drop': ['Jul92 Date',
+                                'X Axis Null(V) Min', 'X Axis Null(V) Max', 'X Axis Null(V) Avg',
+                                'Z Axis Null(V) Min', 'Z Axis Null(V) Max', 'Z Axis Null(V) Avg',
+                                'Battery Temp(C) Min', 'Battery Temp(C) Max', 'CPU Board Temp(C) Min',
+                                'CPU Board Temp(C) Max', 'Battery(V) Min', 'Battery(V) Max', '3.3 V Min',
+                                '3.3 V Max', 'Spare 1(V) Min', 'Spare 1(V) Max', 'Spare 1(V) Avg',
+                                '  Spare 2', ' Spare 3'],
+                       'columns': None,
+                       'dtypes': {}},
+    ('hskp', 'sys2'): {'time': ['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second'],
+                       'rename': {},
+                       'drop': [],
+                       'columns': None,
+                       'dtypes': {}},
+    ('fg', 'sys1'): {'time': ['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second'],
+                     'rename': {'MagX(nT)': 'Bx', 'MagY(nT)': 'By', 'MagZ(nT)': 'Bz'},
+                     'drop': ['Jul92 Date', 'X Null(V)', 'Z Null(V)'],
+                     'columns': ['Bx', 'By', 'Bz'],
+                     'dtypes': {'Bx': np.float32, 'By': np.float32, 'Bz': np.float32}},
+    ('fg', 'sys2'): {'time': [],
+                     'rename': {},
+                     'drop': ['Calibrating'],
+                     'columns': ['Bx', 'By', 'Bz'],
+                     'dtypes': {'Bx': np.float32, 'By': np.float32, 'Bz': np.float32}},
+}
+
+# Final (skinny) housekeeping dtypes by our column names, applied at read time when skinny. Columns
+# not listed here that parse as float64 end up float32. skinny_drop columns are never parsed
+skinny_dtypes = {'hskp': dict([(column, 'bool') for column in ['CASES_on', 'FG_on', 'Garmin_GPS_on', 'HF_On', 'Htr_On', 'SC_on', 'Modem_on', 'Overcurrent_status_on']] +
+                              [(column, 'int32') for column in ['UTC_sync_age_secs', 'Uptime_secs', 'sys_time_error_secs']] +
+                              [('int_modem_signal', 'int8')] +
+                              [(column, 'float32') for column in ['T_batt_1', 'T_FG_electronics', 'T_FG_sensor', 'T_router', 'V_batt_1',
+                                                                  'I_input', 'P_input', 'lat', 'long', 'CPU_load_1_min']])}
+
+skinny_drop = {'hskp': ['T_batt_2', 'T_batt_3', 'V_batt_2', 'V_batt_3', 'CPU_load_5_min', 'CPU_load_15_min', '3v3']}
+
+
+def locate_sites(lat, lon=None):
+    """Label each row with the site its coordinates fall in (see lat_ranges and lon_ranges)
+
+    Zero coordinates (no GPS fix yet) take the next good fix, or the last one at the end of the
+    record. Labelling is one sorted interval lookup over lat_ranges, so it's cheap for any length.
+
+    Args:
+        lat (array-like): Latitudes
+        lon (array-like, optional): Longitudes. If given, rows must also fall in the site's lon_ranges
+
+    Returns:
+        Categorical: Site per row, NaN where no site matches
+    """
+    lat = pd.Series(np.asarray(lat, dtype=np.float64))
+    lat = lat.mask(lat == 0.0).bfill().ffill().where(lat.notna()).to_numpy()
+    sites = list(lat_ranges)
+    order = sorted(range(len(sites)), key=lambda i: lat_ranges[sites[i]][0])
+    lows = np.array([lat_ranges[sites[i]][0] for i in order])
+    highs = np.array([lat_ranges[sites[i]][1] for i in order])
+    slot = np.searchsorted(lows, lat, side='right') - 1
+    found = (slot >= 0) & (lat <= highs[slot.clip(0)])
+    codes = np.where(found, np.array(order)[slot.clip(0)], -1)
+    if lon is not None:
+        lon = pd.Series(np.asarray(lon, dtype=np.float64))
+        lon = lon.mask(lon == 0.0).bfill().ffill().where(lon.notna()).to_numpy()
+        lon_lows = np.array([min(lon_ranges[site]) for site in sites])
+        lon_highs = np.array([max(lon_ranges[site]) for site in sites])
+        codes = np.where((codes >= 0) & (lon >= lon_lows[codes]) & (lon <= lon_highs[codes]), codes, -1)
+    return pd.Categorical.from_codes(codes, categories=sites)
+
+
+def _site_to_PG(site):
+    """Summarize a site column as the system's deployment label (last known site, BBG is testing)"""
+    site = pd.Series(site).dropna()
+    if site.empty or site.iloc[-1] == 'BBG':
+        return 'TST'
+    return site.iloc[-1]
+
+
+@pd.api.extensions.register_dataframe_accessor('aalpip')
+class AalpipAccessor(object):
+    """AALPIP metadata on any DataFrame, kept in DataFrame.attrs so it survives most pandas operations
+
+    df.aalpip.locate() adds the per-row 'site' column, df.aalpip.PG and df.aalpip.system read
+    the metadata back.
+    """
+
+    def __init__(self, df):
+        self._df = df
+
+    @property
+    def system(self):
+        return self._df.attrs.get('system', 0)
+
+    @property
+    def PG(self):
+        if 'PG' not in self._df.attrs and 'site' in self._df.columns:
+            return _site_to_PG(self._df['site'])
+        return self._df.attrs.get('PG', 'TST')
+
+    def locate(self, system=None, use_lon=False):
+        """Copy of the frame with a categorical 'site' column and system/PG attrs set"""
+        df_out = self._df.copy(deep=False)
+        lon = df_out['long'] if use_lon and 'long' in df_out.columns else None
+        df_out['site'] = locate_sites(df_out['lat'], lon)
+        df_out.attrs['system'] = self.system if system is None else system
+        df_out.attrs['PG'] = _site_to_PG(df_out['site'])
+        return df_out
+
 
 class housekeeping_df(pd.DataFrame):
-    def __init__(self,df,tail_season=None):
-        pd.DataFrame.__init__(self, data=df)
+    # carried over by pandas operations that return a new frame
+    _metadata = ['system', 'PG', '_tail_season']
+
+    def __init__(self, data=None, *args, **kwargs):
+        kwargs.pop('tail_season', None)
+        locate = kwargs.pop('locate', True)
+        pd.DataFrame.__init__(self, data, *args, **kwargs)
         self._tail_season = 'end of season'
         self.system = 0
         self.PG = 'TST'
-        
-        self._locate_system()
-        
+
+        if locate:
+            self._locate_system()
+
+    @property
+    def _constructor(self):
+        # frames derived by pandas operations keep their metadata and aren't relabelled
+        def derived(*args, **kwargs):
+            return housekeeping_df(*args, locate=False, **kwargs)
+        return derived
+
     def tail_season(self):
         # This is a placeholder for seasonal charging demarkation
         return self._tail_season
-    
-    # this is bad and should be catergorical based on each datetime
+
     def _locate_system(self):
-        try:
-            self.lat.replace(0.0, inplace=True, method='bfill')
-            self.lat.replace(0.0, inplace=True, method='ffill')
-            # LAT should be enough to locate a system
-            # self.long.replace(0.0, inplace=True, method='bfill')
-            # self.long.replace(0.0, inplace=True, method='ffill')
-            for coords in lat_ranges:
-                self.loc[self.lat.between(*lat_ranges[coords]),'site'] = coords
-            self.PG = self.site.iloc[-1] if self.site.iloc[-1] is not 'BBG' else 'TST'
-        except Exception as err:
-            pass
+        if 'lat' not in self.columns:
+            return self.PG
+        self['site'] = locate_sites(self['lat'])
+        self.PG = _site_to_PG(self['site'])
         return self.PG
 
 
 def find_reboots(hskp_dataframe):
     """Scan a housekeeping file for negative trends in uptime, indicating a reboot has occured
 
+    For long ranges use intervals.scan (or build_intervals), which gives whole reboot and
+    uptime segment tables.
+
     Args:
         hskp_dataframe (TYPE): Housekeeping dataframe
 
@@ -82,9 +242,10 @@ def find_reboots(hskp_dataframe):
         datetime: A series of reboot datetimes based on the original dataframe
     """
     if 'Uptime_secs' in hskp_dataframe.columns:
-        reboots = hskp_dataframe['Uptime_secs'].diff()[hskp_dataframe['Uptime_secs'].diff() < 0]
-        reboots.where(reboots == 1, 1, inplace=True)
-        datetime = hskp_dataframe['datetime'][reboots.index]
+        drops = np.flatnonzero(np.diff(hskp_dataframe['Uptime_secs'].to_numpy(dtype=np.float64)) < 0) + 1
+        index = hskp_dataframe.index[drops]
+        reboots = pd.Series(1.0, index=index, name='Uptime_secs')
+        datetime = hskp_dataframe['datetime'][index]
     else:
         datetime = pd.Series()
         reboots = pd.Series()
@@ -115,13 +276,55 @@ def _generate_filelist(start, end=None, system=2, subsystem='fg'):
     return filelist
 
 
-def generate_filelist(start, end=None, system=4, subsystem='fg'):
+def catalog_entry(path):
+    """Catalog fields for an AALPIP file (see catalog.Catalog.refresh)
+
+    Args:
+        path (str): Full file path
+
+    Returns:
+        dict: 'station' (system number), 'subsystem' and 'start', or None for files
+        generate_filelist would never return
+    """
+    name = os.path.basename(path)
+    if not ('.csv' in name[-8:] or '.dat' in name[-8:] or '.txt' in name[-8:]):
+        return None
+    parts = path.split(os.sep)
+    systems = [part for part in parts if part.startswith('sys_')]
+    start = start_from_name(name)
+    if not systems or start is None:
+        return None
+    system = systems[-1][4:]
+    # SYS2+ layout is {year}/sys_{n}/{subsystem}/..., SYS1 (and SYS2 before 2012) keeps everything in {year}/sys_{n}/
+    subsystem = parts[parts.index(systems[-1]) + 1] if parts.index(systems[-1]) + 2 < len(parts) else None
+    if subsystem is None:
+        subsystem = 'hskp' if 'HSKP' in name else 'fg' if 'MAG' in name else None
+    elif subsystem not in name:
+        subsystem = None
+    return {'station': system, 'subsystem': subsystem, 'start': start}
+
+
+def refresh_catalog(catalog):
+    """Bring a catalog.Catalog up to date with everything under datapath_local
+
+    Args:
+        catalog (Catalog): Catalog to refresh
+
+    Returns:
+        int: Number of directories that had to be re-listed
+    """
+    return catalog.refresh('aalpip', datapath_local, catalog_entry)
+
+
+def generate_filelist(start, end=None, system=4, subsystem='fg', catalog=None):
     """Search the local and remote datapaths for files in the given date range
 
     Args:
         start (datetime): First day of timespan
         end (datetime, optional): last day of timespan. If None (default) then end = start
         subsystem (str, optional): Instrument data to search for ('sc' or 'fg')
+        catalog (Catalog, optional): Answer from this file catalog instead of walking datapath_local.
+            Keep it current with refresh_catalog
 
     Returns:
         filelist (list): List of string paths to files representing data for the given dates
@@ -131,7 +334,13 @@ def generate_filelist(start, end=None, system=4, subsystem='fg'):
     # assert (type(end) is dt.datetime) or (type(end) is pd.Timestamp)
     assert (start <= end)
     searchlist = pd.date_range(start=start, end=end).to_pydatetime().tolist()
+    if catalog is not None:
+        return catalog.query('aalpip', dt.datetime(start.year, start.month, start.day),
+                             dt.datetime(end.year, end.month, end.day) + dt.timedelta(days=1),
+                             station=system, subsystem=subsystem)
     filelist = []
+    # SYS1 style directories hold a whole year, so only walk each directory once
+    listings = {}
     for date in searchlist:
         year = date.year
         month = date.month
@@ -146,20 +355,124 @@ def generate_filelist(start, end=None, system=4, subsystem='fg'):
             if subsystem == 'hf':
                 file_path_string = '{0}/{1}/sys_{2}/{3}/'.format(datapath_local, year, system, subsystem)
             subsys_string = subsystem
-        for root, dirs, files in os.walk(file_path_string):
-            filelist.extend([root + file for file in files if ((os.stat(root + file).st_size > 0) and
-                                                               ('{}_{:02}_{:02}'.format(year,month,day) in file) and
-                                                               ('.csv' in file[-8:] or '.dat' in file[-8:] or '.txt' in file[-8:]) and 
-                                                               (subsys_string in file))])
+        if file_path_string not in listings:
+            listings[file_path_string] = [(root, file) for root, dirs, files in os.walk(file_path_string) for file in files]
+        # cheap name checks first, only stat the files that match
+        filelist.extend([root + file for root, file in listings[file_path_string] if (('{}_{:02}_{:02}'.format(year,month,day) in file) and
+                                                                                      ('.csv' in file[-8:] or '.dat' in file[-8:] or '.txt' in file[-8:]) and
+                                                                                      (subsys_string in file) and
+                                                                                      (os.stat(root + file).st_size > 0))])
 
     return filelist
 
 
-def read_housekeeping_list(hskp_zip_list=''):
+def _cast_skinny(df_in, subsystem='hskp'):
+    """Cast columns to their skinny dtypes (see skinny_dtypes), filling NaN with 0 first"""
+    targets = skinny_dtypes.get(subsystem, {})
+    casts = {}
+    for column in df_in.columns:
+        target = targets.get(column, 'float32' if df_in[column].dtype == np.float64 else None)
+        if target is not None:
+            casts[column] = target
+    fills = dict((column, 0) for column in casts if df_in[column].hasnans)
+    if fills:
+        df_in = df_in.fillna(fills)
+    casts = dict((column, target) for column, target in casts.items() if df_in[column].dtype != target)
+    if casts:
+        df_in = df_in.astype(casts)
+    return df_in
+
+
+def _read_schema_csv(source, subsystem, generation, columns=None, skinny=False, **kwargs):
+    """Parse one csv through its schema (see schemas)
+
+    Only the time columns and the wanted columns are handed to the parser, already in their
+    parse dtypes, so nothing unused is ever decoded.
+
+    Args:
+        source (str or file): Csv file name or open file
+        subsystem (str): 'hskp' or 'fg'
+        generation (str): 'sys1' or 'sys2'
+        columns (list, optional): Our column names to keep. None for the schema's default columns
+        skinny (bool, optional): Skip skinny_drop columns and cast to skinny_dtypes
+        **kwargs: Passed on to pd.read_csv
+
+    Returns:
+        DataFrame: 'datetime' (if the schema has time columns) then the wanted columns, renamed
+    """
+    schema = schemas[(subsystem, generation)]
+    file_names = dict((ours, theirs) for theirs, ours in schema['rename'].items())
+    wanted = schema['columns'] if columns is None else [column for column in columns if column not in ('datetime', 'site')]
+    dtypes = dict((file_names.get(column, column), dtype) for column, dtype in schema['dtypes'].items())
+    if skinny:
+        dtypes.update((file_names.get(column, column), dtype) for column, dtype in skinny_dtypes.get(subsystem, {}).items() if dtype == 'float32')
+
+    if wanted is None:
+        skip = set(schema['drop'])
+        if skinny:
+            skip.update(file_names.get(column, column) for column in skinny_drop.get(subsystem, []))
+        usecols = lambda name: name not in skip
+    elif kwargs.get('engine') == 'pyarrow':
+        # pyarrow wants a list, so every wanted column has to be in the file
+        usecols = schema['time'] + [file_names.get(column, column) for column in wanted]
+        dtypes = dict((column, dtype) for column, dtype in dtypes.items() if column in usecols)
+    else:
+        keep = set(schema['time']).union(file_names.get(column, column) for column in wanted)
+        usecols = lambda name: name in keep
+    df_in = pd.read_csv(source, usecols=usecols, dtype=dtypes, **kwargs)
+
+    if schema['time']:
+        df_in = df_in.dropna(subset=schema['time'])
+        times = from_components(*[df_in[column] for column in schema['time']])
+        df_in = df_in.drop(columns=schema['time'])
+    df_in = df_in.rename(columns=schema['rename'])
+    if wanted is not None:
+        df_in = df_in[[column for column in wanted if column in df_in.columns]]
+    if skinny:
+        df_in = _cast_skinny(df_in, subsystem)
+    df_in = df_in.reset_index(drop=True)
+    if schema['time']:
+        df_in.insert(0, 'datetime', times)
+    return df_in
+
+
+def _read_hskp_file(zip_file, columns=None, skinny=False):
+    """Read a single SYS2+ gzipped housekeeping csv"""
+    return _read_schema_csv(zip_file, 'hskp', 'sys2', columns, skinny, compression='gzip')
+
+
+def _read_hskp_file_sys1(zip_file, columns=None, skinny=False):
+    """Read a single SYS1 (PEN) zipped housekeeping csv"""
+    with zf.ZipFile(zip_file) as zipped:
+        with zipped.open(zipped.namelist()[0]) as csv:
+            return _read_schema_csv(csv, 'hskp', 'sys1', columns, skinny)
+
+
+def _read_hskp_file_any(zip_file, columns=None, skinny=False):
+    """Read a single housekeeping file, SYS1 .zip or SYS2+ gzip"""
+    if zf.is_zipfile(zip_file):
+        return _read_hskp_file_sys1(zip_file, columns, skinny)
+    return _read_hskp_file(zip_file, columns, skinny)
+
+
+def df_hskp_gen(hskp_zip_list, workers=None, columns=None, skinny=False):
+    """Yield a dataframe per housekeeping file (SYS1 zip or SYS2+ gzip), skipping (and reporting) bad files"""
+    return map_files(functools.partial(_read_hskp_file_any, columns=columns, skinny=skinny), hskp_zip_list, workers)
+
+
+def df_hskp_gen_sys1(hskp_zip_list, workers=None, columns=None, skinny=False):
+    """Yield a dataframe per SYS1 housekeeping file, skipping (and reporting) bad files"""
+    return map_files(functools.partial(_read_hskp_file_sys1, columns=columns, skinny=skinny), hskp_zip_list, workers)
+
+
+def read_housekeeping_list(hskp_zip_list='', workers=None, columns=None, skinny=False):
     """Read in a housekeeping filelist and return a dataframe
 
     Args:
         hskp_zip_list (str, optional): Python list of full file names to read
+        workers (int, optional): Number of processes to read files with. None reads serially
+        columns (list, optional): Only parse these columns ('datetime' always comes along). None reads all
+        skinny (bool, optional): Parse straight to the skinny dtypes, leaving out skinny_drop columns
 
     Returns:
         DataFrame: A pandas dataframe with the following columns:
@@ -171,79 +484,17 @@ def read_housekeeping_list(hskp_zip_list=''):
         'sys_time_error_secs', 'UTC_sync_age_secs', 'Uptime_secs',
         'CPU_load_1_min', 'CPU_load_5_min', 'CPU_load_15_min'
     """
-    def df_hskp_gen(hskp_zip_list):
-        for zip_file in hskp_zip_list:
-            try:
-                with gzip.open(zip_file) as file:
-                    df_in = pd.read_csv(file, sep=',', header=0)
-                    date = df_in[df_in.columns[:6]]
-                    df_in.drop(['Month', 'Day', 'Hour', 'Minute', 'Second'], axis=1, inplace=True)
-                    df_in.rename({'Year': 'datetime'}, axis=1, inplace=True)
-                    df_in['datetime'] = pd.to_datetime(date)
-                    yield df_in
-            except Exception as err:
-                print(zip_file, ' caused an error, ignoring: ', err)
-                pass
-
-
-    def df_hskp_gen_sys1(hskp_zip_list):
-        for zip_file in hskp_zip_list:
-            try:
-                with zf.ZipFile(zip_file) as zipped:
-                    with zipped.open(zipped.namelist()[0]) as csv:
-                        df_in = pd.read_csv(csv)
-                        df_in.rename({'Min':'Minute', 'Sec':'Second'}, axis=1, inplace=True)
-                        date = df_in[df_in.columns[1:7]]
-                        df_in.drop(['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second'], axis=1, inplace=True)
-                        # Dropping things we dont use..
-                        df_in.drop(['X Axis Null(V) Min', 'X Axis Null(V) Max', 'X Axis Null(V) Avg',
-                                    'Z Axis Null(V) Min', 'Z Axis Null(V) Max', 'Z Axis Null(V) Avg',
-                                    'Battery Temp(C) Min', 'Battery Temp(C) Max', 'CPU Board Temp(C) Min',
-                                    'CPU Board Temp(C) Max', 'Battery(V) Min', 'Battery(V) Max', '3.3 V Min',
-                                    '3.3 V Max', 'Spare 1(V) Min', 'Spare 1(V) Max', 'Spare 1(V) Avg',
-                                    '  Spare 2', ' Spare 3'], axis=1, inplace=True)
-                        df_in.rename({'Jul92 Date': 'datetime',
-                                      'Sync Age(sec)': 'UTC_sync_age_secs',
-                                      'Time Error(sec)':'sys_time_error_secs',
-                                      'GPS on for sync(%)':'GPS_sync',
-                                      'GPS on for heat(%)':'GPS_heat',
-                                      'Int modem on for comm(%)':'int_modem_comm',
-                                      'Int modem on for heat(%)':'int_modem_heat',
-                                      'Int modem is overtemp(%)':'int_modem_overtemp',
-                                      'Ext modem is on for comm(%)':'ext_modem_comm',
-                                      'Lat (deg)':'lat',
-                                      'Long (deg)':'long',
-                                      'Battery Temp(C) Avg':'T_batt_1',
-                                      'CPU Board Temp(C) Avg':'T_router',
-                                      'Battery(V) Avg':'V_batt_1',
-                                      '3.3 V Avg':'3v3',
-                                      'Int. Modem RF':'int_modem_signal',
-                                      ' Ext. Modem RF':'ext_modem_signal'}, axis=1, inplace=True)
-                        df_in['datetime'] = pd.to_datetime(date)
-                    yield df_in
-            except pd.errors.EmptyDataError as err:
-                print(zip_file, ' is EMPTY')
-                pass
-            except Exception as err:
-                print(zip_file, ' caused an error: ', err)
-                raise err
-
     try:
         if 'PEN' in hskp_zip_list[0]:
-            old_list = [file for file in hskp_zip_list if 'hskp' not in file]
-            new_list = [file for file in hskp_zip_list if 'hskp' in file]
-            df_out_old = pd.concat(df_hskp_gen_sys1(old_list), ignore_index=True).sort_values(by=['datetime']).reset_index(drop=True)
+            old_list = sort_by_start([file for file in hskp_zip_list if 'hskp' not in file])
+            new_list = sort_by_start([file for file in hskp_zip_list if 'hskp' in file])
+            df_out_old = concat_presorted(df_hskp_gen_sys1(old_list, workers, columns, skinny))
             if (len(new_list) > 0):
-                df_out_new = pd.concat(df_hskp_gen(new_list), ignore_index=True).sort_values(by=['datetime']).reset_index(drop=True)
+                df_out = concat_presorted([df_out_old, concat_presorted(df_hskp_gen(new_list, workers, columns, skinny))])
             else:
-                df_out_new = pd.DataFrame()
-            df_out = pd.concat([df_out_old, df_out_new], ignore_index=True).sort_values(by=['datetime']).reset_index(drop=True)
+                df_out = df_out_old
         else:
-            df_out = pd.concat(df_hskp_gen(hskp_zip_list), ignore_index=True).sort_values(by=['datetime']).reset_index(drop=True)
-        # df_out = pd.concat(df_hskp_gen_sys1(hskp_zip_list), ignore_index=True).sort_values(by=['datetime']).reset_index(drop=True)
-    # except zf.BadZipFile as err:
-        # print('Not .zip files (SYS1), trying gzip (SYS2+)')
-        # df_out = pd.concat(df_hskp_gen(hskp_zip_list), ignore_index=True).sort_values(by=['datetime']).reset_index(drop=True)
+            df_out = concat_presorted(df_hskp_gen(sort_by_start(hskp_zip_list), workers, columns, skinny))
     except IndexError as err:
         print('Empty File List (Data does not exist)')
         return housekeeping_df(pd.DataFrame({'datetime':[],'V_batt_1':[],'T_router':[]}))
@@ -281,56 +532,54 @@ def _read_housekeeping_list(hskp_zip_list=''):
     return df_hskp
 
 
-def read_fluxgate_list(fg_zip_list='', sys_1=False):
-    """Read in a fluxgate filelist and return a dataframe
+def _read_fg_file_gz(zip_file, columns=None):
+    """Read a single SYS2+ gzipped fluxgate csv
 
-    Args:
-        hskp_zip_list (str, optional): Python list of full file names to read
+    Only Bx, By, Bz (or the requested columns) are parsed, straight to float32. Samples are
+    1 s apart from the start time in the file name, so the timestamps are computed rather than parsed.
+    """
+    fg_file_start = dt.datetime.strptime(zip_file[-30:-11], '%Y_%m_%d_%H_%M_%S')
+    df_in = _read_schema_csv(zip_file, 'fg', 'sys2', columns, compression='gzip', engine=csv_engine)
+    df_in.insert(0, 'datetime', from_cadence(fg_file_start, '1s', df_in.shape[0]))
+    return df_in
 
-    Returns:
-        DataFrame: A pandas dataframe with the following columns:
 
-        'datetime', 'Bx', 'By', 'Bz', 'Calibrating'
+def _read_fg_file_sys1(zip_file, columns=None):
+    """Read a single SYS1 zipped fluxgate csv
+
+    Malformed lines are skipped. Only the time columns and the three field components are parsed.
     """
-    def df_fg_gen(fg_zip_list):
-        fg_sample_rate = dt.timedelta(seconds=1)
-        for zip_file in fg_zip_list:
-            fg_file_start = dt.datetime.strptime(zip_file[-30:-11], '%Y_%m_%d_%H_%M_%S')
-            with gzip.open(zip_file) as file:
-                df_in = pd.read_csv(file, sep=',', header=0)
-                fg_in_dates = pd.date_range(fg_file_start, periods=df_in.shape[0], freq=fg_sample_rate)
-                df_in['datetime'] = pd.Series(fg_in_dates)
-                df_in = df_in.reindex(columns=['datetime', 'Bx', 'By', 'Bz', 'Calibrating'])
-            yield df_in[['datetime', 'Bx', 'By', 'Bz']].astype({'datetime': np.dtype('<M8[ns]'), 'Bx': np.float32, 'By': np.float32, 'Bz': np.float32})
+    with zf.ZipFile(zip_file) as zipped:
+        with zipped.open(zipped.namelist()[0]) as csv:
+            return _read_schema_csv(csv, 'fg', 'sys1', columns, on_bad_lines='skip', engine=csv_engine)
 
 
-    def df_fg_gen_sys1(fg_zip_list):
-        for zip_file in fg_zip_list:
-            with zf.ZipFile(zip_file) as zipped:
-                with zipped.open(zipped.namelist()[0]) as csv:
-                    try:
-                        df_in = pd.read_csv(csv, error_bad_lines=False, warn_bad_lines=False)
-                        date = df_in[df_in.columns[1:7]]
-                        df_in.drop(['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second', 'X Null(V)', 'Z Null(V)'], axis=1, inplace=True)
-                        df_in.rename({'Jul92 Date': 'datetime'}, axis=1, inplace=True)
-                        df_in['datetime'] = pd.to_datetime(date)
-                        df_in.rename(index=str, columns={'MagX(nT)':'Bx','MagY(nT)':'By','MagZ(nT)':'Bz'}, inplace=True)
-                    except EmptyDataError as e:
-                        pass
-                    except Exception as e:
-                        print('{} Caused an error'.format(zip_file))
-                        raise e
-                yield df_in[['datetime', 'Bx', 'By', 'Bz']].astype({'datetime': np.dtype('<M8[ns]'), 'Bx': np.float32, 'By': np.float32, 'Bz': np.float32})
+def _read_fg_file(zip_file, columns=None):
+    """Read a single fluxgate file, SYS1 .zip or SYS2+ gzip"""
+    if zf.is_zipfile(zip_file):
+        return _read_fg_file_sys1(zip_file, columns)
+    return _read_fg_file_gz(zip_file, columns)
 
-    try:
-        df_out = pd.concat(df_fg_gen_sys1(fg_zip_list), ignore_index=True).sort_values(by=['datetime']).reset_index(drop=True)
-    except zf.BadZipFile as err:
-        print('Not a .zip file (SYS1), trying gzip (SYS2+)')
-        df_out = pd.concat(df_fg_gen(fg_zip_list), ignore_index=True).sort_values(by=['datetime']).reset_index(drop=True)
-    except Exception as e:
-        raise
 
-    return df_out
+def df_fg_gen(fg_zip_list, workers=None, columns=None):
+    """Yield a dataframe per fluxgate file, skipping (and reporting) bad files"""
+    return map_files(functools.partial(_read_fg_file, columns=columns), fg_zip_list, workers)
+
+
+def read_fluxgate_list(fg_zip_list='', sys_1=False, workers=None, columns=None):
+    """Read in a fluxgate filelist and return a dataframe
+
+    Args:
+        fg_zip_list (str, optional): Python list of full file names to read
+        workers (int, optional): Number of processes to read files with. None reads serially
+        columns (list, optional): Only parse these of 'Bx', 'By', 'Bz' ('datetime' always comes along)
+
+    Returns:
+        DataFrame: A pandas dataframe with the following columns:
+
+        'datetime', 'Bx', 'By', 'Bz'
+    """
+    return concat_presorted(df_fg_gen(sort_by_start(fg_zip_list), workers, columns))
 
 
 def _read_fluxgate_list(fg_zip_list='', sys_1=False):
@@ -358,97 +607,175 @@ def _read_fluxgate_list(fg_zip_list='', sys_1=False):
     return pd.concat(df_fg_gen(fg_zip_list), ignore_index=True).sort_values(by=['datetime']).reset_index(drop=True)
 
 
-def read_searchcoil_list(sc_zip_list=''):
+def _decode_sc_bitstream(raw):
+    """Unpack a raw searchcoil bitstream into dBx, dBy counts
+
+    The bitstream is packed 12 bit two's complement samples, alternating dBx and dBy,
+    so every 3 bytes hold exactly one (dBx, dBy) pair. A truncated file leaves 1 or 2
+    trailing bytes that can't form a full pair; those are dropped.
+
+    Args:
+        raw (bytes): Decompressed searchcoil bitstream
+
+    Returns:
+        ndarray: (n, 2) int16 array of signed dBx, dBy counts
+    """
+    n_pairs = len(raw) // 3
+    packed = np.frombuffer(raw, dtype=np.uint8, count=n_pairs * 3).reshape(n_pairs, 3).astype(np.int16)
+    counts = np.empty((n_pairs, 2), dtype=np.int16)
+    counts[:, 0] = (packed[:, 0] << 4) | (packed[:, 1] >> 4)
+    counts[:, 1] = ((packed[:, 1] & 0x0F) << 8) | packed[:, 2]
+    # sign extend bit 11
+    counts -= (counts & 0x800) << 1
+    return counts
+
+
+def _read_sc_counts(file):
+    """Read a single gzipped searchcoil bitstream as raw counts
+
+    Returns:
+        tuple: (file start datetime, (n, 2) int16 dBx, dBy counts)
+    """
+    file_start = dt.datetime.strptime(file[-26:-7], '%Y_%m_%d_%H_%M_%S')
+    with gzip.open(file, mode='rb') as bitstream:
+        return file_start, _decode_sc_bitstream(bitstream.read())
+
+
+def _read_sc_file(file, columns=None):
+    """Read a single gzipped searchcoil bitstream"""
+    file_start, counts = _read_sc_counts(file)
+    # scale both channels in one pass (float64 first, so values match the old per-sample math)
+    channels = [channel for channel in ('dBx', 'dBy') if columns is None or channel in columns]
+    scaled = (counts[:, [('dBx', 'dBy').index(channel) for channel in channels]] * sc_scale).astype(np.float16)
+    df_in = pd.DataFrame({'datetime': from_cadence(file_start, '100ms', counts.shape[0])})
+    for i, channel in enumerate(channels):
+        df_in[channel] = scaled[:, i]
+    return df_in
+
+
+def df_sc_gen(sc_zip_list, workers=None, columns=None):
+    """Yield a dataframe per searchcoil file, skipping (and reporting) bad files"""
+    return map_files(functools.partial(_read_sc_file, columns=columns), sc_zip_list, workers)
+
+
+def read_searchcoil_list(sc_zip_list='', workers=None, columns=None):
     """Read in a searchcoil filelist and return a dataframe
 
     Args:
         sc_zip_list (str, optional): Python list of full file names to read
+        workers (int, optional): Number of processes to read files with. None reads serially
+        columns (list, optional): Only scale these of 'dBx', 'dBy' ('datetime' always comes along)
 
     Returns:
         DataFrame: A pandas dataframe with the following columns:
 
         'datetime', 'dBx', 'dBy'
     """
-    def df_sc_gen(sc_zip_list):
-        sample_rate = dt.timedelta(microseconds=100000)
-        for file in sc_zip_list:
-            file_start = dt.datetime.strptime(file[-26:-7], '%Y_%m_%d_%H_%M_%S')
-            df_in = pd.DataFrame(columns=['datetime', 'dBx', 'dBy'])
-            with gzip.open(file, mode='rb') as bitstream:
-                in_bits = bitstream.read().hex()
-                samples = [int(in_bits[i:i + 3], 16) for i in range(0, len(in_bits), 3)]
-                samples = [x - 4096 if x > 2047 else x for x in samples]
-                df_in['dBx'] = [samples[x] * (.0049 / 4.43) for x in range(0, len(samples), 2)]
-                df_in['dBy'] = [samples[x] * (.0049 / 4.43) for x in range(1, len(samples), 2)]
-
-                in_dates = pd.date_range(file_start, periods=len(in_bits) // 3, freq=sample_rate)
-                df_in['datetime'] = pd.Series(in_dates)
-            yield df_in.astype({'datetime': np.dtype('<M8[ns]'), 'dBx': np.float16, 'dBy': np.float16})
-
-    return pd.concat(df_sc_gen(sc_zip_list), ignore_index=True)
-
-
-def _clean_df(df_in, subsystem='fg'):
+    return concat_presorted(df_sc_gen(sort_by_start(sc_zip_list), workers, columns))
+
+
+# columns _clean_df scrubs for each subsystem (housekeeping: the analog channels)
+clean_columns = {'fg': ['Bx', 'By', 'Bz'],
+                 'sc': ['dBx', 'dBy'],
+                 'hskp': ['T_batt_1', 'T_batt_2', 'T_batt_3', 'T_FG_electronics', 'T_FG_sensor', 'T_router',
+                          'V_batt_1', 'V_batt_2', 'V_batt_3', 'I_input', 'P_input']}
+
+
+def _cleaner(subsystem='fg', clean=True, **kwargs):
+    """Cleaner for a subsystem. clean is True or 'sigma' for the 3 sigma cut, or 'robust'"""
+    method = 'sigma' if clean is True else clean
+    return Cleaner(clean_columns[subsystem], method=method, **kwargs)
+
+
+def _clean_df(df_in, subsystem='fg', clean=True, cleaner=None):
     """Scrubs errors from input dataframe
 
     Args:
         df_in (dataframe): Input dataframe
-        df_type (str, optional): Description
+        subsystem (str, optional): Which subsystem the frame holds, picks the columns to clean
+        clean (bool or str, optional): True or 'sigma' for the 3 sigma cut, 'robust' for the rolling
+            median/MAD filter (see cleaning.Cleaner)
+        cleaner (Cleaner, optional): Reuse this cleaner, to clean a stream of chunks consistently
 
     Returns:
         Notes: The specific errors handled by this cleaning function include:
                 removal of -1e32 sensor error values
-                removal of duplicate timestamps
-                removal of statistical outliers (>3 standard deviations)
+                removal of statistical outliers (>3 standard deviations, or the robust filter)
+                *removal of duplicate timestamps
                 *removal of South Pole testing periods for individual stations
 
                 *:To be added
     """
-
-    # Remove error values
-    df_clean = df_in.where(df_in.Bx>-1e31)
-    # Remove values outside 3 stdev
-    for column in df_clean.columns[1:]:
-        std = df_clean[column].std()
-        mean = df_clean[column].mean()
-        df_clean[column] = df_clean[column].where(df_clean[column]<(mean+(3*std)))
-        df_clean[column] = df_clean[column].where(df_clean[column]>(mean-(3*std)))
-
-    # return cleaned, non-duplicated, and sorted dataframe
-    return df_clean.dropna().sort_values(by=['datetime']).reset_index(drop=True)
+    cleaner = _cleaner(subsystem, clean) if cleaner is None else cleaner
+    return cleaner.clean(df_in)
 
 
 def _trim_df(df_in, subsystem='hskp'):
-    
+    """Shrink a frame to its skinny columns and dtypes. Readers called with skinny=True already do this"""
     if subsystem == 'hskp':
-        # drop unused columns
-        df_skinny = df_in.drop(columns=['T_batt_2', 'T_batt_3', 'V_batt_2', 'V_batt_3', 'CPU_load_5_min', 'CPU_load_15_min', '3v3'], errors='ignore')
-        # downcast site as a category
-        # df_skinny.site = df_skinny.site.astype('category')
-        # downcast boolean types
-        bin_cols = ['CASES_on', 'FG_on', 'Garmin_GPS_on', 'HF_On', 'Htr_On', 'SC_on', 'Modem_on', 'Overcurrent_status_on']
-        for column in bin_cols:
-            if column in df_skinny.columns:
-                df_skinny[column] = df_skinny[column].fillna(0).astype('bool')
-        # recast ints as int32
-        int_cols = ['UTC_sync_age_secs', 'Uptime_secs', 'sys_time_error_secs']
-        for column in int_cols:
-            if column in df_skinny.columns:
-                df_skinny[column] = df_skinny[column].fillna(0).astype('int32')
-        # signal ranges from 0-5
-        if 'int_modem_signal' in df_skinny.columns:
-            df_skinny.int_modem_signal = df_skinny.int_modem_signal.fillna(0).astype('int8')
-        # recast floats as float32
-        for column in list(df_skinny.select_dtypes('float64').columns):
-            if column in df_skinny.columns:
-                df_skinny[column] = df_skinny[column].fillna(0).astype('float32')
-        # df_skinny = housekeeping_df(df_skinny)
+        # drop unused columns, then downcast flags to bool, counters to small ints and floats to float32
+        df_skinny = _cast_skinny(df_in.drop(columns=skinny_drop['hskp'], errors='ignore'), subsystem)
     else:
         df_skinny = df_in
     return df_skinny
 
 
-def import_subsys(start: dt.datetime, end=None, system=4, subsys='sc', clean=False, skinny=True):
+def _read_options(subsys, columns=None, skinny=False):
+    """Keyword arguments for a subsystem's list reader: the column projection, and skinny for hskp"""
+    options = {'columns': columns}
+    if subsys == 'hskp':
+        options['skinny'] = skinny
+    return options
+
+
+def _import_cached(start, end, system, subsys, skinny, workers, cache, columns=None, catalog=None):
+    """Build the import_subsys frame a day at a time, serving days from the cache where possible
+
+    Days are always cached whole, so a miss decodes every column once and later reads of any
+    columns come straight from the cache. The files are listed once for the whole range.
+    """
+    subsfunc = {
+        'sc': read_searchcoil_list,
+        'fg': read_fluxgate_list,
+        'hskp': read_housekeeping_list
+    }
+    end = start if end is None else end
+    frames = []
+    filelist = generate_filelist(start, end, system=system, subsystem=subsys, catalog=catalog)
+    for date in pd.date_range(start=start, end=end):
+        day = date.strftime('%Y_%m_%d')
+        day_files = [file for file in filelist if day in os.path.basename(file)]
+        if not day_files:
+            continue
+        key = ('sys_{}'.format(system), subsys, date.strftime('%Y_%m_%d'), 'skinny' if skinny else 'full')
+        df_day = cache.get(key, day_files, columns=None if columns is None else ['datetime'] + list(columns))
+        if df_day is None:
+            try:
+                df_day = subsfunc[subsys](day_files, workers=workers, **_read_options(subsys, skinny=skinny))
+            except ValueError:
+                # every file for the day was bad
+                continue
+            if skinny:
+                df_day = _trim_df(df_day, subsystem=subsys)
+            cache.put(key, day_files, df_day)
+        if columns is not None:
+            df_day = df_day[['datetime'] + [column for column in columns if column in df_day.columns and column != 'datetime']]
+        frames.append(df_day)
+    df_out = pd.concat(frames, ignore_index=True)
+    if subsys == 'hskp':
+        # relabel over the whole range so zero lat fixes can fill across day boundaries
+        df_out = housekeeping_df(df_out)
+    return df_out
+
+
+def _attach_site(df_in, system):
+    """Label every row with the system's deployment site from the deployments timeline"""
+    df_in['site'] = deployments.site_at(system, df_in['datetime'].to_numpy())
+    return df_in
+
+
+def import_subsys(start: dt.datetime, end=None, system=4, subsys='sc', clean=False, skinny=True, workers=None, cache=None, site=False, columns=None,
+                  catalog=None):
     """Reads a subset of the year's data and return a dataframe
     
     Args:
@@ -456,8 +783,19 @@ def import_subsys(start: dt.datetime, end=None, system=4, subsys='sc', clean=Fal
         end (dt.datetime, optional): Last date of subset
         system (int, optional): Which system to grab from
         subsys (str, optional): the subsystem to import
-        clean (bool, optional): False by default, clean the data by various methods (see _clean_df doc)
+        clean (bool or str, optional): False by default, clean the data by various methods (see _clean_df doc).
+            True or 'sigma' cuts 3 sigma outliers, 'robust' uses a rolling median/MAD filter
         skinny (bool, optional): True by default, minimize the resultant data frame size in memory
+        workers (int, optional): Number of processes to read files with. None (default) reads serially
+        cache (bool or DayCache, optional): None (default) always reads the source files. True uses a
+            DayCache at cache_path capped at cache_max_bytes, or pass your own DayCache. Each
+            (system, subsys, date) is decoded once and reread from the cache until its source files change
+        site (bool, optional): False by default, add a categorical 'site' column from the deployments
+            timeline. For hskp this replaces the GPS based site label
+        columns (list, optional): Only decode these columns, e.g. ['V_batt_1', 'T_router'] ('datetime' always
+            comes along, and hskp gets its GPS 'site' label whenever 'lat' is included). None reads every column
+        catalog (Catalog, optional): Find files with this file catalog instead of walking datapath_local
+            (see generate_filelist)
     
     Returns:
         DataFrame: A pandas dataframe with subsystem specific columns.
@@ -472,14 +810,197 @@ def import_subsys(start: dt.datetime, end=None, system=4, subsys='sc', clean=Fal
         'hskp': read_housekeeping_list
     }
 
-    # generate a list of all files in a range
-    filelist = generate_filelist(start, end, system=system, subsystem=subsys)
-    # call the appropriate function
-    df_out = subsfunc[subsys](filelist)
+    if cache:
+        cache = DayCache(cache_path, cache_max_bytes) if cache is True else cache
+        df_out = _import_cached(start, end, system, subsys, skinny, workers, cache, columns, catalog)
+    else:
+        # generate a list of all files in a range
+        filelist = generate_filelist(start, end, system=system, subsystem=subsys, catalog=catalog)
+        # call the appropriate function
+        df_out = subsfunc[subsys](filelist, workers=workers, **_read_options(subsys, columns, skinny))
+        # the readers already built it skinny, this only catches the empty file list fallback
+        if skinny:
+            df_out = _trim_df(df_out, subsystem=subsys)
+    # cleaned after the frame has its final rows and columns either way, so a warm cache gives the same answer
     if clean:
-        df_out = _clean_df(df_out, subsystem=subsys)
-    # this is the lazy way to do things. we should trim the DF on construction, not after it's been built
-    if skinny:
-        df_out = _trim_df(df_out, subsystem=subsys)
+        df_out = _clean_df(df_out, subsystem=subsys, clean=clean)
+    if site:
+        df_out = _attach_site(df_out, system)
 
     return df_out
+
+
+def _chunk_frames(frames, freq):
+    """Regroup a stream of time ordered frames into one frame per freq wide time bin"""
+    pending = []
+    current = None
+    for df_in in frames:
+        if df_in.empty:
+            continue
+        bins = df_in['datetime'].dt.floor(freq).to_numpy()
+        edges = np.flatnonzero(bins[1:] != bins[:-1]) + 1
+        for first, last in zip(np.r_[0, edges], np.r_[edges, len(bins)]):
+            if current is not None and bins[first] != current:
+                yield pd.concat(pending, ignore_index=True)
+                pending = []
+            current = bins[first]
+            pending.append(df_in.iloc[first:last])
+    if pending:
+        yield pd.concat(pending, ignore_index=True)
+
+
+def iter_subsys(start: dt.datetime, end=None, system=4, subsys='sc', chunk='1h', clean=False, skinny=True, workers=None, catalog=None, site=False, columns=None):
+    """Reads a subset of the year's data a chunk at a time, for ranges too big to hold in memory
+
+    Only the files feeding the current chunk (plus a few in flight when workers > 1) are held
+    in memory at once.
+
+    Args:
+        start (dt.datetime): First date of subset
+        end (dt.datetime, optional): Last date of subset
+        system (int, optional): Which system to grab from
+        subsys (str, optional): the subsystem to import
+        chunk (str, optional): '1h' (default), '1D' or any other pandas frequency string to yield one
+            frame per time bin, or 'file' to yield one frame per source file
+        clean (bool or str, optional): False by default, clean each chunk (see _clean_df doc). 'robust'
+            gives exactly the import_subsys result, with 'sigma' the bounds use the data seen so far
+        skinny (bool, optional): True by default, minimize each chunk's size in memory
+        workers (int, optional): Number of processes to read files with. None (default) reads serially
+        catalog (Catalog, optional): Find files with this file catalog (see generate_filelist)
+        site (bool, optional): False by default, add the deployment 'site' column (see import_subsys)
+        columns (list, optional): Only decode these columns (see import_subsys)
+
+    Yields:
+        DataFrame: Time ordered chunks with the same columns and dtypes as import_subsys
+    """
+    # subsystem generator dictionary
+    subsgen = {
+        'sc': df_sc_gen,
+        'fg': df_fg_gen,
+        'hskp': df_hskp_gen
+    }
+
+    filelist = generate_filelist(start, end, system=system, subsystem=subsys, catalog=catalog)
+    frames = subsgen[subsys](sort_by_start(filelist), workers, **_read_options(subsys, columns, skinny))
+    cleaner = _cleaner(subsys, clean) if clean else None
+    if chunk != 'file':
+        frames = _chunk_frames(frames, chunk)
+    for df_out in frames:
+        df_out = df_out.reset_index(drop=True)
+        if subsys == 'hskp':
+            df_out = housekeeping_df(df_out)
+        if clean:
+            df_out = _clean_df(df_out, subsystem=subsys, cleaner=cleaner)
+        if skinny:
+            df_out = _trim_df(df_out, subsystem=subsys)
+        if site:
+            df_out = _attach_site(df_out, system)
+        yield df_out
+
+
+def scan_intervals(start: dt.datetime, end=None, system=4, subsys='hskp', gap=None, sync_age_max=3600, workers=None, catalog=None):
+    """Reboot, uptime segment, data gap and sync age interval tables for a range (see intervals.IntervalScanner)
+
+    Only the columns the tables need are decoded, a file at a time.
+
+    Args:
+        start (dt.datetime): First date of the range
+        end (dt.datetime, optional): Last date of the range
+        system (int, optional): Which system to scan
+        subsys (str, optional): 'hskp' (all tables) or 'fg'/'sc' (runs and gaps only)
+        gap (str or timedelta, optional): Gap threshold, gap_thresholds[subsys] by default
+        sync_age_max (float, optional): GPS sync ages (seconds) above this are anomalies
+        workers (int, optional): Number of processes to read files with. None (default) reads serially
+        catalog (Catalog, optional): Find files with this file catalog (see generate_filelist)
+
+    Returns:
+        dict: DataFrame per table name
+    """
+    columns = {'hskp': ['Uptime_secs', 'UTC_sync_age_secs'], 'fg': ['Bx'], 'sc': ['dBx']}[subsys]
+    scanner = intervals.IntervalScanner(gap_thresholds[subsys] if gap is None else gap, sync_age_max)
+    # not skinny, so missing uptimes stay NaN instead of reading as reboots
+    for df_in in iter_subsys(start, end, system=system, subsys=subsys, chunk='file', skinny=False,
+                             workers=workers, catalog=catalog, columns=columns):
+        scanner.update(df_in)
+    return scanner.finish()
+
+
+def _intervals_dir(root, system, subsys, year):
+    return os.path.join(intervals_path if root is None else root, 'sys_{}'.format(system), subsys, str(year))
+
+
+def build_intervals(year, system=4, subsys='hskp', gap=None, workers=None, catalog=None, root=None):
+    """Scan a system-year and persist its interval tables, so availability queries never touch raw data
+
+    Args:
+        year (int): Year to scan
+        system (int, optional): Which system to scan
+        subsys (str, optional): Subsystem to scan (see scan_intervals)
+        gap (str or timedelta, optional): Gap threshold, gap_thresholds[subsys] by default
+        workers (int, optional): Number of processes to read files with
+        catalog (Catalog, optional): Find files with this file catalog
+        root (str, optional): Where to keep the tables, intervals_path by default
+
+    Returns:
+        dict: The tables that were written
+    """
+    gap = gap_thresholds[subsys] if gap is None else gap
+    interval_tables = scan_intervals(dt.datetime(year, 1, 1), dt.datetime(year, 12, 31), system=system, subsys=subsys,
+                                     gap=gap, workers=workers, catalog=catalog)
+    intervals.save_tables(_intervals_dir(root, system, subsys, year), interval_tables, meta={'gap': str(pd.Timedelta(gap))})
+    return interval_tables
+
+
+def load_intervals(start: dt.datetime, end=None, system=4, subsys='hskp', table='runs', root=None):
+    """Persisted interval table rows overlapping [start, end] (see build_intervals)
+
+    Args:
+        start (dt.datetime): Start of the range
+        end (dt.datetime, optional): End of the range, the end of start's day by default
+        system (int, optional): Which system
+        subsys (str, optional): Which subsystem
+        table (str, optional): 'runs', 'gaps', 'segments', 'reboots' or 'sync'
+        root (str, optional): Where the tables are kept, intervals_path by default
+
+    Returns:
+        DataFrame: The table's rows, years without a built table are reported and skipped
+    """
+    start = pd.Timestamp(start)
+    end = start.normalize() + pd.Timedelta(days=1) if end is None else pd.Timestamp(end)
+    frames = []
+    for year in range(start.year, end.year + 1):
+        df_year = intervals.load_table(_intervals_dir(root, system, subsys, year), table)
+        if df_year is None:
+            print('No {} intervals for sys_{} {} {}, run build_intervals'.format(table, system, subsys, year))
+            continue
+        frames.append(df_year)
+    if not frames:
+        return pd.DataFrame()
+    df_out = pd.concat(frames, ignore_index=True)
+    first, last = ('datetime', 'datetime') if table == 'reboots' else ('start', 'end')
+    return df_out[(df_out[last] >= start) & (df_out[first] <= end)].reset_index(drop=True)
+
+
+def availability(start: dt.datetime, end=None, system=4, subsys='fg', freq='1D', root=None):
+    """Fraction of each freq wide bin with data, from the persisted runs tables alone
+
+    Each run counts through one sample period past its last sample (see intervals.coverage).
+
+    Args:
+        start (dt.datetime): Start of the range
+        end (dt.datetime, optional): End of the range (exclusive), one freq after start by default
+        system (int, optional): Which system
+        subsys (str, optional): Which subsystem
+        freq (str, optional): Bin width, any pandas frequency string
+        root (str, optional): Where the tables are kept, intervals_path by default
+
+    Returns:
+        Series: Covered fraction (0 to 1) indexed by bin start
+    """
+    start = pd.Timestamp(start)
+    end = start + pd.tseries.frequencies.to_offset(freq) if end is None else pd.Timestamp(end)
+    edges = pd.date_range(start, end, freq=freq)
+    runs = load_intervals(start, end, system=system, subsys=subsys, table='runs', root=root)
+    if runs.empty:
+        runs = pd.DataFrame({'start': pd.Series(dtype='M8[ns]'), 'end': pd.Series(dtype='M8[ns]')})
+    return pd.Series(intervals.coverage(runs, edges), index=edges[:-1], name='availability')
@@ -2,6 +2,10 @@ import os
 import zipfile
 import numpy as np
 import pandas as pd
+import datetime as dt
+from catalog import start_from_name
+from fileio import map_files, sort_by_start, concat_presorted
+from timestamps import from_strings
 
 datapath_local = '/data/ago'
 # datapath_remote = '/home/aalpip/data/'
@@ -9,66 +13,216 @@ datapath_local = '/data/ago'
 conjugates = {'AGO4': 'kuv',
               'AGO3': 'stf'}
 
+# Timestamp format of the data files as a strptime string. None (default) is ISO 8601, which
+# both parsers handle natively. Files that don't match fall back to letting pandas infer it
+time_format = None
 
-def generate_yearly_masterlist(year=2017, subsystem='sc', local=True):
+# pyarrow parses the searchcoil text (timestamps included) natively if it's available
+try:
+    import pyarrow
+    import pyarrow.csv as arrow_csv
+except ImportError:
+    arrow_csv = None
+
+
+def catalog_entry(path):
+    """Catalog fields for an AGO file (see catalog.Catalog.refresh)
+
+    Args:
+        path (str): Full file path, datapath_local/{subsystem}/{year}/...
+
+    Returns:
+        dict: 'station', 'subsystem' and 'start', or None for files without a date in the name
+    """
+    name = os.path.basename(path)
+    start = start_from_name(name)
+    if start is None:
+        return None
+    station = next((station for station in conjugates if station in path.upper()), None)
+    subsystem = path.split(os.sep)[-3]
+    return {'station': station, 'subsystem': subsystem, 'start': start}
+
+
+def refresh_catalog(catalog):
+    """Bring a catalog.Catalog up to date with everything under datapath_local
+
+    Args:
+        catalog (Catalog): Catalog to refresh
+
+    Returns:
+        int: Number of directories that had to be re-listed
+    """
+    return catalog.refresh('ago', datapath_local, catalog_entry)
+
+
+def generate_yearly_masterlist(year=2017, subsystem='sc', local=True, catalog=None):
     """Generate a python list of available files in a year
 
     Args:
         year (int, optional): Year to discover
         subsystem (str, optional): Subsystem ('sc', 'fg')
         local (bool, optional): Are we checking the local or remote directory
+        catalog (Catalog, optional): Answer from this file catalog instead of walking the data directory
 
     Returns:
         list: long filenames
     """
+    if catalog is not None:
+        return catalog.query('ago', dt.datetime(year, 1, 1), dt.datetime(year + 1, 1, 1), subsystem=subsystem, min_size=0)
     datapath = datapath_local if local else datapath_local
     yearly_masterlist = []
     # scan the year's data folder for all available files
     for root, dirs, files in os.walk(
             '{0}/{1}/{2}'.format(datapath, subsystem, year)):
-        if files != []:
-            for file in files:
-                yearly_masterlist = yearly_masterlist + [root + '/' + file]
+        yearly_masterlist.extend([root + '/' + file for file in files])
     # return full filenames with paths for each file
     return yearly_masterlist
 
 
-def read_fluxgate_list(filelist=''):
+def generate_filelist(start, end=None, station='AGO4', subsystem='sc', catalog=None):
+    """Local files for a station and subsystem in the given date range
+
+    Args:
+        start (datetime): First day of timespan
+        end (datetime, optional): last day of timespan. If None (default) then end = start
+        station (str, optional): Station ('AGO3', 'AGO4')
+        subsystem (str, optional): Subsystem ('sc', 'fg')
+        catalog (Catalog, optional): Answer from this file catalog instead of walking the data directory
+
+    Returns:
+        list: long filenames, in start time order
+    """
+    end = start if end is None else end
+    first = dt.datetime(start.year, start.month, start.day)
+    last = dt.datetime(end.year, end.month, end.day) + dt.timedelta(days=1)
+    if catalog is not None:
+        return catalog.query('ago', first, last, station=station, subsystem=subsystem)
+    filelist = []
+    for year in range(first.year, end.year + 1):
+        for file in generate_yearly_masterlist(year, subsystem=subsystem):
+            file_start = start_from_name(os.path.basename(file))
+            if (station in file.upper() and file_start is not None and first <= file_start < last
+                    and os.path.getsize(file) > 0):
+                filelist.append(file)
+    return sort_by_start(filelist)
+
+
+def _open_text(file):
+    """Open a data file for reading, streaming the text member straight out of zip archives"""
+    if not zipfile.is_zipfile(file):
+        return open(file, 'rb')
+    zipped = zipfile.ZipFile(file)
+    names = zipped.namelist()
+    member = next((name for name in names if name.lower().endswith('.txt')), names[0])
+    # the member keeps its own reference to the archive's file handle
+    stream = zipped.open(member)
+    zipped.close()
+    return stream
+
+
+def _parse_times(strings):
+    """Timestamp strings to datetime64[ns], trying time_format first"""
+    try:
+        return from_strings(np.asarray(strings, dtype=object), time_format)
+    except (ValueError, TypeError):
+        return pd.to_datetime(strings).astype('M8[ns]')
+
+
+def _read_sc_arrow(file):
+    """Searchcoil file through pyarrow, timestamps parsed with time_format. None if they don't match it"""
+    names = ['datetime', 'dBx', 'dBy', 'dBz']
+    types = {'datetime': pyarrow.timestamp('ns'), 'dBx': pyarrow.float32(), 'dBy': pyarrow.float32(), 'dBz': pyarrow.float32()}
+    try:
+        with _open_text(file) as text:
+            table = arrow_csv.read_csv(text,
+                                       read_options=arrow_csv.ReadOptions(column_names=names, skip_rows=1),
+                                       parse_options=arrow_csv.ParseOptions(delimiter='\t'),
+                                       convert_options=arrow_csv.ConvertOptions(column_types=types,
+                                                                                timestamp_parsers=[arrow_csv.ISO8601 if time_format is None else time_format]))
+    except pyarrow.ArrowInvalid:
+        return None
+    return table.to_pandas()
+
+
+def _read_fg_file(file):
+    """Read a single fluxgate file (plain or zipped text)"""
+    with _open_text(file) as text:
+        df_in = pd.read_csv(text, sep=' ', header=None, usecols=[0, 2, 3, 4], names=['datetime', 'Bx', 'By', 'Bz'],
+                            dtype={'datetime': str, 'Bx': np.float32, 'By': np.float32, 'Bz': np.float32})
+    df_in['datetime'] = _parse_times(df_in['datetime'])
+    return df_in
+
+
+def df_fg_gen(filelist, workers=None):
+    """Yield a dataframe per fluxgate file in start time order, skipping (and reporting) bad files"""
+    return map_files(_read_fg_file, sort_by_start(filelist), workers)
+
+
+def read_fluxgate_list(filelist='', workers=None):
     """Read in a fluxgate filelist and return a dataframe
 
     Args:
         filelist (str, optional): Python list of full file names to read
+        workers (int, optional): Number of processes to read files with. None reads serially
 
     Returns:
         DataFrame: A pandas dataframe with the following columns:
 
         'datetime', 'Bx', 'By', 'Bz'
     """
-    df_fg = pd.DataFrame()
-    for zip_file in filelist:
-        with open(zip_file) as file:
-            df_in = pd.read_csv(file, sep=' ', header=None, usecols=[0, 2, 3, 4], names=['datetime', 'Bx', 'By', 'Bz'], dtype={'datetime': np.str, 'Bx': np.float32, 'By': np.float32, 'Bz': np.float32})
-            df_fg = df_fg.append(df_in, ignore_index=True)
-    df_fg['datetime'] = pd.to_datetime(df_fg['datetime'])
-    return df_fg
+    return concat_presorted(df_fg_gen(filelist, workers))
 
 
-def read_searchcoil_list(filelist=['']):
-    """Read in a fluxgate filelist and return a dataframe
+def _read_sc_file(file):
+    """Read a single searchcoil zip, streaming the txt member without extracting it"""
+    if arrow_csv is not None:
+        df_in = _read_sc_arrow(file)
+        if df_in is not None:
+            return df_in
+    with _open_text(file) as text:
+        df_in = pd.read_csv(text, sep='\t', header=0, names=['datetime', 'dBx', 'dBy', 'dBz'],
+                            dtype={'datetime': str, 'dBx': np.float32, 'dBy': np.float32, 'dBz': np.float32})
+    df_in['datetime'] = _parse_times(df_in['datetime'])
+    return df_in
+
+
+def df_sc_gen(filelist, workers=None):
+    """Yield a dataframe per searchcoil file in start time order, skipping (and reporting) bad files"""
+    return map_files(_read_sc_file, sort_by_start(filelist), workers)
+
+
+def read_searchcoil_list(filelist=[''], workers=None):
+    """Read in a searchcoil filelist and return a dataframe
 
     Args:
         filelist (str, optional): Python list of full file names to read
+        workers (int, optional): Number of processes to read files with. None reads serially
 
     Returns:
         DataFrame: A pandas dataframe with the following columns:
 
-        'datetime', 'Bx', 'By', 'Bz'
+        'datetime', 'dBx', 'dBy', 'dBz'
+    """
+    return concat_presorted(df_sc_gen(filelist, workers))
+
+
+def import_subsys(start, end=None, station='AGO4', subsys='sc', workers=None, catalog=None):
+    """Reads a station's data for a date range and returns a dataframe
+
+    Args:
+        start (datetime): First date of subset
+        end (datetime, optional): Last date of subset
+        station (str, optional): Which station to grab from ('AGO3', 'AGO4')
+        subsys (str, optional): the subsystem to import ('sc', 'fg')
+        workers (int, optional): Number of processes to read files with. None (default) reads serially
+        catalog (Catalog, optional): Find files with this file catalog
+
+    Returns:
+        DataFrame: A pandas dataframe with subsystem specific columns.
     """
-    df_sc = pd.DataFrame()
-    for zip_file in filelist:
-        with zipfile.ZipFile(zip_file) as zippy:
-            with zippy.open('{}txt'.format(zip_file.split('/')[-1][:-3])) as file:
-                df_in = pd.read_table(file, header=0, names=['datetime', 'dBx', 'dBy', 'dBz'], dtype={'datetime': np.str, 'dBx': np.float32, 'dBy': np.float32, 'dBz': np.float32})
-                df_sc = df_sc.append(df_in, ignore_index=True)
-    df_sc['datetime'] = pd.to_datetime(df_sc['datetime'])
-    return df_sc.astype({'datetime': np.dtype('<M8[ns]'), 'dBx': np.float32, 'dBy': np.float32, 'dBz': np.float32}, copy=True)
+    subsfunc = {
+        'sc': read_searchcoil_list,
+        'fg': read_fluxgate_list
+    }
+    filelist = generate_filelist(start, end, station=station, subsystem=subsys, catalog=catalog)
+    return subsfunc[subsys](filelist, workers=workers)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Rough throughput benchmarks for the dataset readers
+
+Run directly (python benchmark.py) from the utils directory. Everything runs on synthetic
+data, so no access to /data is needed.
+"""
+import os
+import gzip
+import time
+import shutil
+import tempfile
+import zipfile
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+import aalpip
+import timestamps
+
+
+def _timeit(func, *args, repeat=3):
+    """Best wall time of a few calls, in seconds"""
+    best = np.inf
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - tic)
+    return best
+
+
+def _legacy_sc_decode(raw):
+    """The original hex-string searchcoil decode from aalpip.read_searchcoil_list"""
+    in_bits = raw.hex()
+    samples = [int(in_bits[i:i + 3], 16) for i in range(0, len(in_bits), 3)]
+    samples = [x - 4096 if x > 2047 else x for x in samples]
+    dBx = [samples[x] * (.0049 / 4.43) for x in range(0, len(samples), 2)]
+    dBy = [samples[x] * (.0049 / 4.43) for x in range(1, len(samples), 2)]
+    return np.array(dBx, dtype=np.float16), np.array(dBy, dtype=np.float16)
+
+
+def _vector_sc_decode(raw):
+    scaled = (aalpip._decode_sc_bitstream(raw) * aalpip.sc_scale).astype(np.float16)
+    return scaled[:, 0], scaled[:, 1]
+
+
+def bench_sc_decode(n_pairs=36000):
+    """Searchcoil bitstream decode, old vs new. n_pairs=36000 is one hour at 10 Hz
+
+    Returns:
+        dict: samples per second for the 'legacy' and 'vectorized' decoders
+    """
+    raw = np.random.default_rng(0).integers(0, 256, n_pairs * 3, dtype=np.uint8).tobytes()
+    legacy = _legacy_sc_decode(raw)
+    vector = _vector_sc_decode(raw)
+    assert all(np.array_equal(old, new) for old, new in zip(legacy, vector))
+    n_samples = 2 * n_pairs
+    return {'legacy': n_samples / _timeit(_legacy_sc_decode, raw),
+            'vectorized': n_samples / _timeit(_vector_sc_decode, raw)}
+
+
+def _legacy_fg_gz(zip_file):
+    """The original SYS2+ fluxgate parse from aalpip.read_fluxgate_list"""
+    fg_file_start = dt.datetime.strptime(zip_file[-30:-11], '%Y_%m_%d_%H_%M_%S')
+    with gzip.open(zip_file) as file:
+        df_in = pd.read_csv(file, sep=',', header=0)
+        fg_in_dates = pd.date_range(fg_file_start, periods=df_in.shape[0], freq=dt.timedelta(seconds=1))
+        df_in['datetime'] = pd.Series(fg_in_dates)
+        df_in = df_in.reindex(columns=['datetime', 'Bx', 'By', 'Bz', 'Calibrating'])
+    return df_in[['datetime', 'Bx', 'By', 'Bz']].astype({'datetime': np.dtype('<M8[ns]'), 'Bx': np.float32, 'By': np.float32, 'Bz': np.float32})
+
+
+def _legacy_fg_sys1(zip_file):
+    """The original SYS1 fluxgate parse (error_bad_lines swapped for its on_bad_lines replacement)"""
+    with zipfile.ZipFile(zip_file) as zipped:
+        with zipped.open(zipped.namelist()[0]) as csv:
+            df_in = pd.read_csv(csv, on_bad_lines='skip')
+            date = df_in[df_in.columns[1:7]]
+            df_in.drop(['Year', 'Month', 'Day', 'Hour', 'Minute', 'Second', 'X Null(V)', 'Z Null(V)'], axis=1, inplace=True)
+            df_in.rename({'Jul92 Date': 'datetime'}, axis=1, inplace=True)
+            df_in['datetime'] = pd.to_datetime(date)
+            df_in.rename(index=str, columns={'MagX(nT)': 'Bx', 'MagY(nT)': 'By', 'MagZ(nT)': 'Bz'}, inplace=True)
+    return df_in[['datetime', 'Bx', 'By', 'Bz']].astype({'datetime': np.dtype('<M8[ns]'), 'Bx': np.float32, 'By': np.float32, 'Bz': np.float32})
+
+
+def _fake_fg_files(folder, n_rows):
+    """Write one synthetic SYS2+ gzip and one SYS1 zip fluxgate file"""
+    rng = np.random.default_rng(0)
+    field = rng.normal(0, 5e4, (n_rows, 3)).round(2)
+    gz_file = os.path.join(folder, 'sys_4_fg_2016_01_02_00_00_00_mag.csv.gz')
+    with gzip.open(gz_file, 'wt') as file:
+        pd.DataFrame({'Bx': field[:, 0], 'By': field[:, 1], 'Bz': field[:, 2], 'Calibrating': 0}).to_csv(file, index=False)
+    times = pd.date_range('2007-01-02', periods=n_rows, freq='1s')
+    df_sys1 = pd.DataFrame({'Jul92 Date': 0.0, 'Year': times.year, 'Month': times.month, 'Day': times.day,
+                            'Hour': times.hour, 'Minute': times.minute, 'Second': times.second,
+                            'MagX(nT)': field[:, 0], 'MagY(nT)': field[:, 1], 'MagZ(nT)': field[:, 2],
+                            'X Null(V)': 0.0, 'Z Null(V)': 0.0})
+    zip_file = os.path.join(folder, 'PEN_MAG_2007_01_02.csv.zip')
+    with zipfile.ZipFile(zip_file, 'w', compression=zipfile.ZIP_DEFLATED) as zipped:
+        zipped.writestr('PEN_MAG_2007_01_02.csv', df_sys1.to_csv(index=False))
+    return gz_file, zip_file
+
+
+def bench_fg_parse(n_rows=86400):
+    """Fluxgate file parse, old vs new, for SYS2+ gzip and SYS1 zip inputs (one day at 1 Hz)
+
+    Returns:
+        dict: rows per second for each reader
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        gz_file, zip_file = _fake_fg_files(folder, n_rows)
+        for old, new, file in ((_legacy_fg_gz, aalpip._read_fg_file_gz, gz_file),
+                               (_legacy_fg_sys1, aalpip._read_fg_file_sys1, zip_file)):
+            pd.testing.assert_frame_equal(old(file).reset_index(drop=True), new(file))
+        return {'gzip legacy': n_rows / _timeit(_legacy_fg_gz, gz_file),
+                'gzip new': n_rows / _timeit(aalpip._read_fg_file_gz, gz_file),
+                'zip legacy': n_rows / _timeit(_legacy_fg_sys1, zip_file),
+                'zip new': n_rows / _timeit(aalpip._read_fg_file_sys1, zip_file)}
+    finally:
+        shutil.rmtree(folder)
+
+
+def bench_timestamps(n=86400 * 10):
+    """Timestamp construction, pandas vs the timestamps module, for each way readers build time
+
+    Returns:
+        dict: timestamps per second for each path, legacy and new
+    """
+    times = pd.date_range('2016-01-02', periods=n, freq='100ms')
+    components = pd.DataFrame({'year': times.year, 'month': times.month, 'day': times.day,
+                               'hour': times.hour, 'minute': times.minute, 'second': times.second + times.microsecond / 1e6})
+    strings = np.asarray(times.strftime('%Y-%m-%dT%H:%M:%S'), dtype=object)
+    unix = (times - pd.Timestamp('1970-01-01')).total_seconds().to_numpy()
+    mjd = unix / 86400 + 40587
+
+    paths = {'components': (lambda: pd.to_datetime(components), lambda: timestamps.from_components(*components.T.to_numpy())),
+             'strings': (lambda: pd.to_datetime(strings), lambda: timestamps.from_strings(strings)),
+             'unix': (lambda: pd.to_datetime(unix, unit='s'), lambda: timestamps.from_epoch(unix, 'unix', 's')),
+             'mjd': (lambda: pd.to_datetime(mjd, unit='D', origin=pd.Timestamp('1858-11-17')), lambda: timestamps.from_epoch(mjd, 'mjd', 'D')),
+             'cadence': (lambda: pd.date_range(times[0], periods=n, freq='100ms'), lambda: timestamps.from_cadence(times[0], '100ms', n))}
+    rates = {}
+    for path, (old, new) in paths.items():
+        # float epochs only agree to within float64 resolution
+        assert np.abs(np.asarray(old(), dtype='M8[ns]') - new()).max() <= np.timedelta64(1, 'us')
+        rates[path + ' legacy'] = n / _timeit(old)
+        rates[path + ' new'] = n / _timeit(new)
+    return rates
+
+
+def _report(name, rates):
+    print(name)
+    for key, rate in rates.items():
+        print('    {:<18} {:>14,.0f} /s'.format(key, rate))
+
+
+if __name__ == '__main__':
+    _report('searchcoil decode (samples)', bench_sc_decode())
+    _report('fluxgate parse (rows, csv engine: {})'.format(aalpip.csv_engine), bench_fg_parse())
+    _report('timestamps', bench_timestamps())
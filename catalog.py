@@ -0,0 +1,180 @@
+import os
+import re
+import sqlite3
+import datetime as dt
+import pandas as pd
+
+# Default catalog location, shared by every dataset module
+catalog_path = os.path.expanduser('~/.cache/mist/catalog.sqlite')
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    station TEXT,
+    subsystem TEXT,
+    start INTEGER,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_lookup ON files (dataset, station, subsystem, start);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    dataset TEXT NOT NULL,
+    mtime INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+'''
+
+_ymd_underscore = re.compile(r'(\d{4})_(\d{2})_(\d{2})(?:_(\d{2})_(\d{2})_(\d{2}))?')
+_ymd_packed = re.compile(r'(?<!\d)(\d{4})(\d{2})(\d{2})(?!\d)')
+_ymd_dashed = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+
+
+def start_from_name(name):
+    """Best guess at a file's start time from the date (and time) in its name
+
+    Understands YYYY_MM_DD[_HH_MM_SS], YYYY-MM-DD and YYYYMMDD.
+
+    Args:
+        name (str): File name
+
+    Returns:
+        datetime: Start time, or None if the name doesn't carry a date
+    """
+    for pattern in (_ymd_underscore, _ymd_dashed, _ymd_packed):
+        match = pattern.search(name)
+        if match is None:
+            continue
+        try:
+            return dt.datetime(*[int(x) for x in match.groups() if x is not None])
+        except ValueError:
+            continue
+    return None
+
+
+def _epoch(datetime):
+    return int((pd.Timestamp(datetime) - pd.Timestamp(0)) // pd.Timedelta(seconds=1))
+
+
+class Catalog(object):
+    """SQLite index of data files: path, dataset, station/system, subsystem, start time, size and mtime
+
+    The catalog is filled by refresh(), which walks a dataset's directory tree once and after
+    that only re-lists directories whose mtime changed. Filelists are then answered with a
+    single indexed query instead of walking and stat-ing the data directories.
+
+    Note that a file rewritten in place doesn't change its directory's mtime. Use
+    refresh(full=True) to restat everything if that happens.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = catalog_path if db_path is None else db_path
+        if os.path.dirname(self.db_path):
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.executescript(_schema)
+
+    def close(self):
+        self.db.close()
+
+    def refresh(self, dataset, root, parser, full=False):
+        """Bring the catalog's view of a dataset's directory tree up to date
+
+        Args:
+            dataset (str): Dataset name ('aalpip', 'dtu', ...)
+            root (str): Top of the dataset's directory tree
+            parser (function): Takes a file path and returns a dict with 'station', 'subsystem' and
+                'start' (datetime) keys, or None if the file isn't a data file
+            full (bool, optional): Re-list every directory, even ones whose mtime hasn't changed
+
+        Returns:
+            int: Number of directories that were re-listed
+        """
+        root = os.path.normpath(root)
+        relisted = 0
+        stack = [(root, None)]
+        with self.db:
+            while stack:
+                path, parent = stack.pop()
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    self._forget_dir(path)
+                    continue
+                known = self.db.execute('SELECT mtime FROM dirs WHERE path = ?', (path,)).fetchone()
+                if not full and known is not None and known[0] == mtime:
+                    children = self.db.execute('SELECT path FROM dirs WHERE parent = ?', (path,)).fetchall()
+                    stack.extend((child, path) for child, in children)
+                    continue
+
+                relisted += 1
+                subdirs = []
+                rows = []
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            subdirs.append(entry.path)
+                            continue
+                        fields = parser(entry.path)
+                        if fields is None:
+                            continue
+                        stat = entry.stat()
+                        start = None if fields.get('start') is None else _epoch(fields['start'])
+                        rows.append((entry.path, path, dataset, fields.get('station'), fields.get('subsystem'),
+                                     start, stat.st_size, stat.st_mtime_ns))
+                self.db.execute('DELETE FROM files WHERE dir = ?', (path,))
+                self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                # forget subdirectories that have gone away
+                known_subdirs = self.db.execute('SELECT path FROM dirs WHERE parent = ?', (path,)).fetchall()
+                for subdir, in known_subdirs:
+                    if subdir not in subdirs:
+                        self._forget_dir(subdir)
+                self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)', (path, parent, dataset, mtime))
+                stack.extend((subdir, path) for subdir in subdirs)
+        return relisted
+
+    def _forget_dir(self, path):
+        like = path.replace('%', r'\%').replace('_', r'\_') + os.sep + '%'
+        self.db.execute('DELETE FROM files WHERE dir = ? OR dir LIKE ? ESCAPE ?', (path, like, '\\'))
+        self.db.execute('DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE ?', (path, like, '\\'))
+
+    def query(self, dataset, start=None, end=None, station=None, subsystem=None, min_size=1):
+        """Paths of cataloged files starting in [start, end), ordered by start time
+
+        Args:
+            dataset (str): Dataset name
+            start (datetime, optional): Earliest file start time. None for no lower bound
+            end (datetime, optional): File start times must be before this. None for no upper bound
+            station (str, optional): Station/system to match. None matches all
+            subsystem (str, optional): Subsystem to match. None matches all
+            min_size (int, optional): Skip files smaller than this many bytes (1 skips empty files)
+
+        Returns:
+            list: Full file paths
+        """
+        sql = 'SELECT path FROM files WHERE dataset = ? AND size >= ?'
+        args = [dataset, min_size]
+        if station is not None:
+            sql += ' AND station = ?'
+            args.append(str(station))
+        if subsystem is not None:
+            sql += ' AND subsystem = ?'
+            args.append(subsystem)
+        if start is not None:
+            sql += ' AND start >= ?'
+            args.append(_epoch(start))
+        if end is not None:
+            sql += ' AND start < ?'
+            args.append(_epoch(end))
+        sql += ' ORDER BY start, path'
+        return [path for path, in self.db.execute(sql, args)]
+
+    def files(self, dataset):
+        """Every cataloged file for a dataset as a dataframe"""
+        df = pd.read_sql_query('SELECT * FROM files WHERE dataset = ? ORDER BY start, path', self.db, params=(dataset,))
+        df['start'] = pd.to_datetime(df['start'], unit='s')
+        return df
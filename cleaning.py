@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+# Sensor error fill value. Anything at or below this is treated as missing
+error_value = -1e31
+
+# scales a MAD up to a standard deviation for normally distributed data
+mad_scale = 1.4826
+
+
+class RunningStats(object):
+    """Per-column count, mean and variance, merged block by block (Chan et al. parallel Welford)
+
+    Blocks can come in any size and order and the result matches the stats of all of them
+    concatenated. NaNs are skipped.
+    """
+
+    def __init__(self, n_columns):
+        self.count = np.zeros(n_columns)
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+
+    def update(self, values):
+        """Fold an (n, n_columns) block of values into the running stats"""
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0)
+        if not count.any():
+            return self
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, np.where(valid, values, 0).sum(axis=0) / count, 0)
+            fraction = np.where(total > 0, count / total, 0)
+        m2 = (np.where(valid, values - mean, 0) ** 2).sum(axis=0)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * fraction
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * fraction
+        self.count = total
+        return self
+
+    @property
+    def std(self):
+        """Sample standard deviation (ddof=1, like pandas), NaN with fewer than two values"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+
+
+class Cleaner(object):
+    """Fused outlier/error cleaning for time ordered frames, fed whole or chunk by chunk
+
+    Two methods are available:
+        'sigma': drop rows more than n_sigma standard deviations from the mean. The stats are
+            accumulated in one streaming pass, so fed chunk by chunk the bounds come from all the
+            data seen so far (the same as a whole range once the last chunk is in).
+        'robust': rolling Hampel style filter. A sample is dropped if it sits more than n_mad
+            scaled MADs from the trailing median of the last window samples (or time, for an
+            offset string like '10min'). The MAD is the trailing median of each sample's
+            deviation from its own trailing median, so both are plain rolling medians. Just
+            enough raw history is carried between chunks that chunked output is identical to
+            cleaning the whole range at once.
+
+    Either way, rows with error values (<= error_value) or NaN in any cleaned column are dropped,
+    every test is folded into one row mask and the frame is only copied once.
+
+    Args:
+        columns (list): Columns to clean, anything missing from a frame is ignored
+        method (str, optional): 'sigma' (default) or 'robust'
+        n_sigma (float, optional): Bound for 'sigma', in standard deviations
+        window (int or str, optional): Trailing window for 'robust', a sample count or pandas offset
+        n_mad (float, optional): Bound for 'robust', in scaled MADs
+        min_periods (int, optional): Samples a 'robust' window needs before it flags anything.
+            Defaults to pandas' rolling default (the full window for counts, 1 for offsets)
+    """
+
+    def __init__(self, columns, method='sigma', n_sigma=3, window=600, n_mad=5, min_periods=None):
+        if method not in ('sigma', 'robust'):
+            raise ValueError('Unknown cleaning method: {}'.format(method))
+        self.columns = list(columns)
+        self.method = method
+        self.n_sigma = n_sigma
+        self.window = window
+        self.n_mad = n_mad
+        self.min_periods = min_periods
+        self.stats = None
+        self._context = None
+
+    def _values(self, df_in, columns):
+        values = df_in[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        return np.where(values <= error_value, np.nan, values)
+
+    def _sigma_bad(self, values):
+        if self.stats is None:
+            self.stats = RunningStats(values.shape[1])
+        self.stats.update(values)
+        with np.errstate(invalid='ignore'):
+            return (np.abs(values - self.stats.mean) >= self.n_sigma * self.stats.std).any(axis=1)
+
+    def _robust_bad(self, df_in, values, columns):
+        times = df_in['datetime'].to_numpy(dtype='M8[ns]')
+        n_context = 0 if self._context is None else len(self._context[0])
+        if n_context:
+            times = np.concatenate([self._context[0], times])
+            values = np.concatenate([self._context[1], values])
+        frame = pd.DataFrame(values, columns=columns)
+        if not isinstance(self.window, (int, np.integer)):
+            frame.index = pd.DatetimeIndex(times)
+        median = frame.rolling(self.window, min_periods=self.min_periods).median()
+        deviation = (frame - median).abs()
+        mad = deviation.rolling(self.window, min_periods=self.min_periods).median()
+        with np.errstate(invalid='ignore'):
+            bad = (deviation.to_numpy() > self.n_mad * mad_scale * mad.to_numpy()).any(axis=1)
+
+        # keep the raw history the next chunk's first median and MAD reach back over
+        if isinstance(self.window, (int, np.integer)):
+            keep = slice(max(0, len(times) - 2 * (self.window - 1)), None)
+        else:
+            keep = slice(np.searchsorted(times, times[-1] - 2 * pd.Timedelta(self.window).to_timedelta64(), side='right'), None)
+        self._context = (times[keep], values[keep])
+        return bad[n_context:]
+
+    def clean(self, df_in):
+        """Clean one frame (or the next chunk of a time ordered stream)
+
+        Args:
+            df_in (DataFrame): Frame with a 'datetime' column and some of the cleaning columns
+
+        Returns:
+            DataFrame: The rows that passed, with a fresh RangeIndex
+        """
+        columns = [column for column in self.columns if column in df_in.columns]
+        if df_in.empty or not columns:
+            return df_in.reset_index(drop=True)
+        values = self._values(df_in, columns)
+        bad = np.isnan(values).any(axis=1)
+        if self.method == 'sigma':
+            bad |= self._sigma_bad(values)
+        else:
+            bad |= self._robust_bad(df_in, values, columns)
+        return df_in[~bad].reset_index(drop=True)
@@ -0,0 +1,165 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Column store layout: one directory per frame, holding one .npy file per column and a
+# meta.json describing the columns and the source files the frame was built from.
+# .npy columns load at disk speed (optionally memory mapped) with no parsing at all.
+
+
+def _column_file(path, column):
+    return os.path.join(path, '{}.npy'.format(column))
+
+
+def source_signature(filelist):
+    """(path, size, mtime) for every source file, used to spot stale entries
+
+    Args:
+        filelist (list): Python list of full file names
+
+    Returns:
+        list: [path, size, mtime_ns] per file
+    """
+    signature = []
+    for file in filelist:
+        stat = os.stat(file)
+        signature.append([file, stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def write_frame(path, df, meta=None):
+    """Write a dataframe to a column store directory, replacing any existing one atomically
+
+    Args:
+        path (str): Directory to write
+        df (DataFrame): Frame to store. Numeric, bool and datetime64 columns are stored as is,
+            object and category columns are stored as category codes
+        meta (dict, optional): Extra json-able metadata to keep alongside the columns
+
+    Returns:
+        int: Bytes written
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+    columns = []
+    nbytes = 0
+    try:
+        for i, column in enumerate(df.columns):
+            values = df[column]
+            entry = {'name': column, 'file': 'c{}'.format(i)}
+            if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+                entry['kind'] = 'category' if isinstance(values.dtype, pd.CategoricalDtype) else 'object'
+                values = values.astype('category')
+                entry['categories'] = values.cat.categories.tolist()
+                array = values.cat.codes.to_numpy()
+            else:
+                entry['kind'] = 'array'
+                array = values.to_numpy()
+            np.save(_column_file(tmp, entry['file']), array, allow_pickle=False)
+            nbytes += array.nbytes
+            columns.append(entry)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as file:
+            json.dump({'columns': columns, 'nbytes': nbytes, 'meta': meta or {}}, file)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return nbytes
+
+
+def read_meta(path):
+    """Read the meta.json of a column store directory, None if it doesn't exist"""
+    try:
+        with open(os.path.join(path, 'meta.json')) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def read_frame(path, columns=None, mmap=False):
+    """Read a column store directory back into a dataframe
+
+    Args:
+        path (str): Directory written by write_frame
+        columns (list, optional): Only load these columns. None loads all of them
+        mmap (bool, optional): Memory map the column files instead of reading them in
+
+    Returns:
+        DataFrame: The stored frame (or the requested columns of it)
+    """
+    stored = read_meta(path)
+    if stored is None:
+        raise FileNotFoundError('No column store at {}'.format(path))
+    data = {}
+    for entry in stored['columns']:
+        if columns is not None and entry['name'] not in columns:
+            continue
+        array = np.load(_column_file(path, entry['file']), mmap_mode='r' if mmap else None, allow_pickle=False)
+        if entry['kind'] == 'array':
+            data[entry['name']] = array
+        else:
+            values = pd.Categorical.from_codes(array, categories=entry['categories'])
+            data[entry['name']] = values if entry['kind'] == 'category' else np.asarray(values, dtype=object)
+    return pd.DataFrame(data, copy=False)
+
+
+class DayCache(object):
+    """On-disk LRU cache of decoded frames, one entry per key (e.g. system, subsystem, date)
+
+    An entry remembers the size and mtime of every source file it was built from and is
+    treated as missing as soon as any of them change (or the filelist itself changes).
+    Total size is capped at max_bytes, evicting the least recently used entries first.
+    """
+
+    def __init__(self, root, max_bytes=20 * 2**30):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.root, *[str(part) for part in key])
+
+    def get(self, key, filelist, columns=None):
+        """Cached frame for key, or None if missing or built from different source files"""
+        path = self.path(key)
+        stored = read_meta(path)
+        if stored is None or stored['meta'].get('sources') != source_signature(filelist):
+            return None
+        # touch the entry so eviction sees it as recently used
+        os.utime(path)
+        return read_frame(path, columns=columns)
+
+    def put(self, key, filelist, df):
+        """Store a frame built from filelist under key, then evict down to max_bytes"""
+        write_frame(self.path(key), df, meta={'sources': source_signature(filelist)})
+        self.evict()
+
+    def entries(self):
+        """(last used, bytes, path) of every entry in the cache"""
+        found = []
+        for root, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not d.startswith('.tmp_')]
+            if 'meta.json' in files:
+                stored = read_meta(root)
+                if stored is not None:
+                    found.append((os.stat(root).st_mtime, stored['nbytes'], root))
+                dirs[:] = []
+        return found
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        found = sorted(self.entries())
+        total = sum(nbytes for _, nbytes, _ in found)
+        for _, nbytes, path in found:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= nbytes
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
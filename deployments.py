@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import sys
+import numpy as np
+import pandas as pd
+
+# AALPIP system deployments (formerly the sys_loc shell script)
+#
+# These dates are verified by HSKP data, only after the Garmin GPS acquires a sync. There may
+# be data recorded prior to sync. Dont trust that data.
+#
+# Each row is (system, site, first day, last day, verified by). Days are inclusive and None
+# means open ended. Where rows for a system overlap the earlier row wins, as it did in sys_loc.
+_timeline = [
+    (1, 'PG1', None, None, None),
+
+    (2, 'PG2', '2009-01-08', '2010-12-28', None),
+    (2, 'SP', '2011-12-30', '2011-12-31', None),
+    (2, 'MCH', '2013-07-19', '2013-07-19', None),
+    (2, 'SP', '2013-12-31', '2014-12-11', None),
+    (2, 'PG0', '2014-12-28', None, None),
+
+    (3, 'SP', '2011-02-14', '2011-12-20', 'HSKP (SEC)'),
+    (3, 'PG2', '2012-01-09', '2012-04-30', 'HSKP (SEC)'),
+    (3, 'MCH', '2013-07-12', '2013-07-19', 'HSKP (SEC)'),
+    (3, 'SP', '2013-12-29', '2014-06-07', 'HSKP (SEC)'),
+    (3, 'MCH', '2014-09-30', '2014-10-06', 'HSKP (SEC)'),
+    (3, 'SP', '2014-10-24', '2015-12-22', 'HSKP (SEC)'),
+    (3, 'PG5', '2016-01-06', None, 'HSKP (SEC)'),
+
+    (4, 'SP', '2011-02-14', '2012-12-26', 'HSKP (SEC)'),
+    (4, 'PG2', '2012-12-27', None, 'HSKP (SEC)'),
+
+    (5, 'VT', '2011-05-09', '2011-07-04', 'HSKP (SEC)'),
+    (5, 'MCH', '2011-08-08', '2012-08-09', 'HSKP (SEC)'),
+    (5, 'VT', '2011-09-07', '2011-09-07', 'HSKP (SEC)'),
+    (5, 'SP', '2011-12-26', '2012-12-21', 'HSKP (SEC)'),
+    (5, 'PG3', '2013-01-03', None, 'HSKP (SEC)'),
+
+    (6, 'MCH', '2011-02-11', '2011-07-12', 'HSKP (SEC)'),
+    (6, 'SP', '2011-12-28', '2013-12-28', 'HSKP (SEC)'),
+    (6, 'PG4', '2014-01-05', '2017-12-27', 'HSKP (SEC)'),
+    (6, 'VT', '2018-05-12', '2018-09-10', 'HSKP (SEC)'),
+    (6, 'PG4', '2019-01-10', None, 'HSKP (SEC)'),
+
+    (8, 'SP', '2017-12-01', '2017-12-27', None),
+    (8, 'PG4', '2017-12-28', '2019-01-08', None),
+]
+
+sites = ['PG0', 'PG1', 'PG2', 'PG3', 'PG4', 'PG5', 'SP', 'MCH', 'VT']
+
+gps_sync_caveat = 'Dates start at GPS sync; data recorded before the sync may exist and should not be trusted'
+
+
+def _build_table():
+    rows = []
+    for system, site, first, last, verified in _timeline:
+        rows.append({'system': system,
+                     'site': site,
+                     'start': pd.NaT if first is None else pd.Timestamp(first),
+                     # half open [start, end) so any time on the last day still matches
+                     'end': pd.NaT if last is None else pd.Timestamp(last) + pd.Timedelta(days=1),
+                     'verified': verified,
+                     'caveat': gps_sync_caveat})
+    table = pd.DataFrame(rows)
+    table['start'] = table['start'].astype('M8[ns]')
+    table['end'] = table['end'].astype('M8[ns]')
+    return table
+
+
+# One row per recorded deployment interval, in sys_loc's order of precedence
+deployments = _build_table()
+
+
+def _system_index(system):
+    """Non overlapping (edges, row per segment) for one system, resolving overlaps first row wins"""
+    rows = deployments[deployments['system'] == system]
+    starts = rows['start'].to_numpy()
+    ends = rows['end'].to_numpy()
+    edges = np.unique(np.concatenate([starts[~np.isnat(starts)], ends[~np.isnat(ends)]]))
+    # segment i covers [edges[i - 1], edges[i]), the first and last run out to +-infinity
+    probes = np.concatenate([[edges[0] - np.timedelta64(1, 'ns')] if len(edges) else [np.datetime64(0, 'ns')], edges])
+    seg_rows = np.full(len(probes), -1)
+    for row in range(len(rows))[::-1]:
+        inside = (np.isnat(starts[row]) | (probes >= starts[row])) & (np.isnat(ends[row]) | (probes < ends[row]))
+        seg_rows[inside] = rows.index[row]
+    return edges, seg_rows
+
+
+_indexes = {system: _system_index(system) for system in deployments['system'].unique()}
+
+
+def _rows_at(system, times):
+    times = np.asarray(pd.to_datetime(np.atleast_1d(times)), dtype='M8[ns]')
+    if system not in _indexes:
+        return np.full(times.shape, -1)
+    edges, seg_rows = _indexes[system]
+    return seg_rows[np.searchsorted(edges, times, side='right')]
+
+
+def site_at(system, times):
+    """Where a system was deployed at each time
+
+    Args:
+        system (int): AALPIP system number
+        times (datetime or array-like): One time or an array of them (any datetime-like)
+
+    Returns:
+        Categorical of sites (NaN where the system wasn't deployed), or a single site string
+        (None if not deployed) when times is a scalar
+    """
+    rows = _rows_at(system, times)
+    codes = np.where(rows >= 0, pd.Categorical(deployments['site'].to_numpy()[rows.clip(0)], categories=sites).codes, -1)
+    labels = pd.Categorical.from_codes(codes, categories=sites)
+    if np.ndim(times) == 0:
+        return None if codes[0] < 0 else labels[0]
+    return labels
+
+
+def deployment_ranges(system, site):
+    """Time ranges a system spent at a site
+
+    Args:
+        system (int): AALPIP system number
+        site (str): Site label (PG0-PG5, SP, MCH, VT)
+
+    Returns:
+        DataFrame: 'start', 'end' ([start, end), NaT for open ended), 'verified', 'caveat'
+    """
+    edges, seg_rows = _indexes.get(system, (np.array([], dtype='M8[ns]'), np.array([-1])))
+    bounds = np.concatenate([[np.datetime64('NaT', 'ns')], edges, [np.datetime64('NaT', 'ns')]])
+    ranges = []
+    for segment, row in enumerate(seg_rows):
+        if row < 0 or deployments.at[row, 'site'] != site:
+            continue
+        if ranges and ranges[-1]['row'] == row and ranges[-1]['end'] == bounds[segment]:
+            ranges[-1]['end'] = bounds[segment + 1]
+            continue
+        ranges.append({'row': row, 'start': bounds[segment], 'end': bounds[segment + 1]})
+    df_out = pd.DataFrame(ranges, columns=['row', 'start', 'end'])
+    for column in ('verified', 'caveat'):
+        df_out[column] = deployments.loc[df_out['row'], column].to_numpy()
+    return df_out.drop(columns='row')
+
+
+def _usage():
+    print('Usage: sys_loc [system number {0-6,8}] [YYYYMMDD]')
+    print('Output: Site [PG0-PG5, SP, VT, MCH]')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or not sys.argv[1].isdigit() or int(sys.argv[1]) not in _indexes:
+        _usage()
+    else:
+        site = site_at(int(sys.argv[1]), pd.Timestamp(sys.argv[2]))
+        print('NA' if site is None else site)
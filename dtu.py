@@ -2,12 +2,19 @@ import os
 import numpy as np
 import pandas as pd
 import datetime as dt
+import functools
 import scipy.io as io
-from astropy.time import Time
 from spacepy import pycdf
+from catalog import start_from_name
+from cleaning import error_value
+from colstore import write_frame, read_frame, read_meta, source_signature
+from fileio import map_files, sort_by_start, concat_presorted
+from timestamps import from_epoch
 
 
 datapath_local = '/data/dtu/'
+# Transcoded column store (see transcode), read in preference to the .sav files
+store_path = '/data/dtu_store/'
 # datapath_remote = 'S:/Space/Datasets/dtu'
 # Magnetic Conjugates Station ID
 conjugates = {'upn': 'PG0',
@@ -17,85 +24,143 @@ conjugates = {'upn': 'PG0',
               'skt': 'PG4',
               'ghb': 'PG5'}
 
-# TODO: Fix empty filelist concatenation (EX: UPN-2017/3/22)
 
+def catalog_entry(path):
+    """Catalog fields for a DTU file (see catalog.Catalog.refresh)
 
-def generate_yearly_masterlist(year=2017, station='ghb', local=True):
+    Args:
+        path (str): Full file path
+
+    Returns:
+        dict: 'station', 'subsystem' (the coordinate format, e.g. 'XYZ') and 'start', or None
+        for files that aren't station-day files
+    """
+    name = os.path.basename(path)
+    if name == 'SHA1SUM':
+        return None
+    station = next((station for station in conjugates if station.upper() in name), None)
+    start = start_from_name(name)
+    if station is None or start is None:
+        return None
+    coord_format = next((coord for coord in ('XYZ', 'HDZ') if coord in name.upper()), None)
+    return {'station': station, 'subsystem': coord_format, 'start': start}
+
+
+def refresh_catalog(catalog):
+    """Bring a catalog.Catalog up to date with everything under datapath_local
+
+    Args:
+        catalog (Catalog): Catalog to refresh
+
+    Returns:
+        int: Number of directories that had to be re-listed
+    """
+    return catalog.refresh('dtu', datapath_local, catalog_entry)
+
+
+def generate_yearly_masterlist(year=2017, station='ghb', local=True, catalog=None):
     """Generate a python list of available files in a year
 
     Args:
         year (int, optional): Year to discover
         station (int, optional): Station ID
         local (bool, optional): Are we checking the local or remote directory
+        catalog (Catalog, optional): Answer from this file catalog instead of walking the data directory
 
     Returns:
         list: long filenames
     """
+    if catalog is not None:
+        return catalog.query('dtu', dt.datetime(year, 1, 1), dt.datetime(year + 1, 1, 1), station=station, min_size=0)
     datapath = datapath_local if local else datapath_remote
     yearly_masterlist = []
     # scan the year's data folder for all available files
     for root, dirs, files in os.walk(
             '{0}/{1}/{2}/'.format(datapath, station, year)):
-        if files != []:
-            for file in files:
-                yearly_masterlist = yearly_masterlist + [root + file] if file != 'SHA1SUM' else yearly_masterlist
+        yearly_masterlist.extend([root + file for file in files if file != 'SHA1SUM'])
     # return full filenames with paths for each file
     return yearly_masterlist
 
 
-def generate_filelist(start, end=None, station='ghb', coord_format='XYZ'):
+def generate_filelist(start, end=None, station='ghb', coord_format='XYZ', catalog=None):
     """Search the local and remote datapaths for files in the given date range
 
     Args:
         start (datetime): First day of timespan
         end (datetime, optional): last day of timespan. If None (default) then end = start
-        subsystem (str, optional): Instrument data to search for ('sc' or 'fg')
+        station (str, optional): Station ID
+        coord_format (str, optional): Coordinate system of the files ('XYZ' or 'HDZ')
+        catalog (Catalog, optional): Answer from this file catalog instead of walking datapath_local.
+            Keep it current with refresh_catalog
 
     Returns:
         filelist (list): List of string paths to files representing data for the given dates
     """
     end = start if end is None else end
+    filelist = []
     if (type(start) is dt.datetime) and (type(end) is dt.datetime) and (start <= end):
         searchlist = pd.date_range(start=start, end=end).to_pydatetime().tolist()
-        filelist = []
+        if catalog is not None:
+            return catalog.query('dtu', dt.datetime(start.year, start.month, start.day),
+                                 dt.datetime(end.year, end.month, end.day) + dt.timedelta(days=1),
+                                 station=station, subsystem=coord_format.upper())
+        # walk each month folder once, not once per day
+        listings = {}
         for date in searchlist:
             year = date.year
             month = date.month
             day = date.day
-            for root, dirs, files in os.walk('{0}/{1}/{2:02}/'.format(datapath_local, year, month)):
-                filelist.extend([root + file for file in files if ((os.stat(root + file).st_size > 0) and
-                                                                   (station.upper() in file) and
-                                                                   ('{}{:02}{:02}'.format(year,month,day) in file) and
-                                                                   (coord_format.upper() in file))])
+            month_path = '{0}/{1}/{2:02}/'.format(datapath_local, year, month)
+            if month_path not in listings:
+                listings[month_path] = [(root, file) for root, dirs, files in os.walk(month_path) for file in files
+                                        if (station.upper() in file) and (coord_format.upper() in file)]
+            filelist.extend([root + file for root, file in listings[month_path] if (('{}{:02}{:02}'.format(year,month,day) in file) and
+                                                                                    (os.stat(root + file).st_size > 0))])
 
     return sorted(filelist)
 
 
-def read_fluxgate_list(fg_zip_list='', station='ghb'):
+def _read_fg_file(file):
+    """Read a single IDL save file of fluxgate data
+
+    mdata comes out of readsav as big-endian (3, n) rows. Each row is converted straight into a
+    native float32 column in one pass, and mjdtime becomes datetime64[ns] arithmetically (to the
+    microsecond, below that a float64 MJD is noise).
+    """
+    idlsav = io.readsav(file)
+    mdata = idlsav['mdata']
+    df_in = pd.DataFrame({'datetime': from_epoch(idlsav['mjdtime'], 'mjd', 'D', resolution='us')})
+    for i, column in enumerate(['Bx', 'By', 'Bz']):
+        df_in[column] = mdata[i].astype(np.float32)
+    return df_in
+
+
+def read_fluxgate_list(fg_zip_list='', station='ghb', workers=None):
     """Read in a fluxgate filelist and return a dataframe
 
     Args:
-        hskp_zip_list (str, optional): Python list of full file names to read
+        fg_zip_list (list, optional): Python list of full file names to read
+        station (str, optional): Station ID (unused, the files carry their own)
+        workers (int, optional): Number of processes to read files with. None reads serially
 
     Returns:
         DataFrame: A pandas dataframe with the following columns:
 
-        'datetime', 'Bx', 'By', 'Bz', 'Calibrating'
+        'datetime', 'Bx', 'By', 'Bz'
+
+        Files that could not be read are listed in df.attrs['failed_files'] ({'file', 'error'} dicts)
     """
-    def df_fg_gen(fg_zip_list):
-        for file in fg_zip_list:
-            try:
-                idlsav = io.readsav(file)
-                df_in = pd.DataFrame(idlsav['mdata'].byteswap().newbyteorder().T)
-                df_in['datetime'] = Time(idlsav['mjdtime'], format='mjd').datetime
-                df_in.rename(index=str, columns={0: 'Bx', 1: 'By', 2: 'Bz'}, inplace=True)
-                yield df_in[['datetime', 'Bx', 'By', 'Bz']]
-            except Exception as e:
-                print(file, ' CAUSED AN ERROR: ' ,e)
-
-    df_out = pd.concat(df_fg_gen(fg_zip_list), ignore_index=True)
-    df_clean = _clean_df(df_out)
-    return df_clean
+    failed = []
+    frames = list(map_files(_read_fg_file, sort_by_start(fg_zip_list), workers, errors=failed))
+    if frames:
+        df_out = _clean_df(concat_presorted(frames))
+    else:
+        df_out = pd.DataFrame({'datetime': np.array([], dtype='M8[ns]'),
+                               'Bx': np.array([], dtype=np.float32),
+                               'By': np.array([], dtype=np.float32),
+                               'Bz': np.array([], dtype=np.float32)})
+    df_out.attrs['failed_files'] = failed
+    return df_out
 
 
 def _read_fluxgate_list(fg_zip_list='', station='ghb'):
@@ -120,14 +185,90 @@ def _read_fluxgate_list(fg_zip_list='', station='ghb'):
     return df_fg[['datetime', 'Bx', 'By', 'Bz']].astype({'datetime': np.dtype('<M8[ns]'), 'Bx': np.float32, 'By': np.float32, 'Bz': np.float32}, copy=True)
 
 
-def import_subsys(start, end=None, station='ghb', subsys='fg'):
+def _store_day_path(store, station, coord_format, date):
+    """Column store directory holding one station-day"""
+    return os.path.join(store, station.lower(), coord_format.upper(), '{:%Y}'.format(date), '{:%Y%m%d}'.format(date))
+
+
+def _read_store_day(path, wanted):
+    """Read one transcoded station-day, loading only the wanted field columns"""
+    df_store = read_frame(path, columns=['epoch'] + wanted)
+    df_in = pd.DataFrame({'datetime': df_store['epoch'].to_numpy().view('M8[ns]')})
+    for column in wanted:
+        df_in[column] = df_store[column].to_numpy()
+    return df_in
+
+
+def _transcode_day(job, store):
+    """Transcode the .sav file(s) of one station-day, unless the store already holds them unchanged
+
+    Returns:
+        bool: True if the day was (re)written, False if it was already current
+    """
+    (station, coord_format, date), files = job
+    path = _store_day_path(store, station, coord_format, date)
+    sources = source_signature(files)
+    stored = read_meta(path)
+    if stored is not None and stored['meta'].get('sources') == sources:
+        return False
+    df_in = concat_presorted([_read_fg_file(file) for file in files])
+    df_out = pd.DataFrame({'epoch': df_in['datetime'].to_numpy(dtype='M8[ns]').view(np.int64)})
+    for column in ['Bx', 'By', 'Bz']:
+        df_out[column] = df_in[column].to_numpy(dtype=np.float32)
+    write_frame(path, df_out, meta={'sources': sources})
+    return True
+
+
+def transcode(root=None, store=None, workers=None, station=None):
+    """Convert the DTU .sav archive to a column store, one directory per station-day
+
+    Each day holds int64 'epoch' (ns since 1970) and float32 'Bx', 'By', 'Bz', written atomically.
+    Days whose source files haven't changed (size and mtime) since they were transcoded are
+    skipped, so an interrupted run just picks up where it left off.
+
+    Args:
+        root (str, optional): Archive to walk, datapath_local by default
+        store (str, optional): Column store root, store_path by default
+        workers (int, optional): Number of processes to transcode with. None runs serially
+        station (str, optional): Only transcode this station
+
+    Returns:
+        dict: Number of days 'written' and 'skipped', and the 'failed' ones ({'file', 'error'} dicts)
+    """
+    root = datapath_local if root is None else root
+    store = store_path if store is None else store
+    days = {}
+    for folder, dirs, files in os.walk(root):
+        for file in sorted(files):
+            entry = catalog_entry(os.path.join(folder, file))
+            if entry is None or entry['subsystem'] is None or (station is not None and entry['station'] != station.lower()):
+                continue
+            key = (entry['station'], entry['subsystem'], entry['start'].date())
+            days.setdefault(key, []).append(os.path.join(folder, file))
+
+    errors = []
+    written = list(map_files(functools.partial(_transcode_day, store=store), sorted(days.items()), workers, errors=errors))
+    # errors name the whole (day, files) job, report the files
+    failed = [{'file': file, 'error': error['error']} for error in errors for file in error['file'][1]]
+    return {'written': sum(written), 'skipped': len(written) - sum(written), 'failed': failed}
+
+
+def import_subsys(start, end=None, station='ghb', subsys='fg', workers=None, columns=None, coord_format='XYZ', store=None, catalog=None):
     """Reads a subset of the year's data and return a dataframe
 
+    Days that have been transcoded (see transcode) are read from the column store, only loading
+    the requested columns. Any other days are read from the .sav files.
+
     Args:
         start (str, optional): First date of subset
         end (str, optional): Last date of subset
         station (int, optional): Which station to grab from
         subsystem (str, optional): Which instrument subsystem
+        workers (int, optional): Number of processes to read files with. None reads serially
+        columns (list, optional): Only return these of 'Bx', 'By', 'Bz' ('datetime' always comes along)
+        coord_format (str, optional): Coordinate system of the files ('XYZ' or 'HDZ')
+        store (str, optional): Column store root, store_path by default
+        catalog (Catalog, optional): Find .sav files with this file catalog instead of walking datapath_local
 
     Returns:
         DataFrame: A pandas dataframe with subsystem specific columns.
@@ -138,11 +279,33 @@ def import_subsys(start, end=None, station='ghb', subsys='fg'):
     }
     # fix an empty end
     end = start if end is None else end
-
-    # generate a list of all files in a range
-    filelist = generate_filelist(start, end, station=station)
-
-    return subsfunc[subsys](filelist)
+    store = store_path if store is None else store
+    wanted = ['Bx', 'By', 'Bz'] if columns is None else [column for column in columns if column != 'datetime']
+    # Bx carries the error fill value, so it's always loaded for cleaning
+    load = wanted if 'Bx' in wanted else ['Bx'] + wanted
+
+    frames = []
+    missing = []
+    for date in pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()):
+        path = _store_day_path(store, station, coord_format, date)
+        if read_meta(path) is not None:
+            frames.append(_read_store_day(path, load))
+        else:
+            missing.append(date.to_pydatetime())
+    failed = []
+    if missing:
+        # generate a list of all files in the days the store doesn't have
+        filelist = generate_filelist(missing[0], missing[-1], station=station, coord_format=coord_format, catalog=catalog)
+        if len(missing) < len(frames) + len(missing):
+            days = set('{:%Y%m%d}'.format(date) for date in missing)
+            filelist = [file for file in filelist if any(day in os.path.basename(file) for day in days)]
+        df_files = subsfunc[subsys](filelist, station, workers)
+        failed = df_files.attrs['failed_files']
+        frames.append(df_files[['datetime'] + load])
+
+    df_out = _clean_df(concat_presorted(frames) if frames else read_fluxgate_list([]))[['datetime'] + wanted]
+    df_out.attrs['failed_files'] = failed
+    return df_out
 
 
 def _clean_df(df_in):
@@ -154,12 +317,11 @@ def _clean_df(df_in):
     Returns:
         dataframe: Clean ("error free") dataframe
 
-    Notes: The specific errors handled by this cleaning function include the removal of -1e32 values
+    Notes: The specific errors handled by this cleaning function include the removal of -1e32 values.
+    Rows keep their order, so a time ordered input stays time ordered
     """
-
-    df_clean = df_in.where(df_in.Bx>-1e31).dropna().sort_values(by=['datetime']).reset_index(drop=True)
-
-    return df_clean
+    keep = (df_in['Bx'].to_numpy() > error_value) & df_in.notna().all(axis=1).to_numpy()
+    return df_in[keep].reset_index(drop=True)
 
 
 def import_subsys_old(start='2017_01_01', end='2017_01_01', station='ghb', subsys='fg'):
@@ -199,3 +361,14 @@ def import_subsys_old(start='2017_01_01', end='2017_01_01', station='ghb', subsy
             break
     return subsfunc[subsys](yearly_masterlist[start_ind:end_ind], station)
 
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Transcode the DTU .sav archive into a column store')
+    parser.add_argument('--root', default=datapath_local, help='archive to walk')
+    parser.add_argument('--store', default=store_path, help='column store root')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes to transcode with')
+    parser.add_argument('--station', default=None, help='only this station')
+    args = parser.parse_args()
+    result = transcode(args.root, args.store, args.workers, args.station)
+    print('{} days written, {} already current, {} files failed'.format(result['written'], result['skipped'], len(result['failed'])))
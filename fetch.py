@@ -0,0 +1,155 @@
+import os
+import tempfile
+import threading
+import email.utils
+import concurrent.futures as cf
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared connection pool settings for every remote getter
+pool_size = 16
+retries = 3
+backoff = 0.5
+timeout = 60
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def make_session(pool=None, total=None, backoff_factor=None):
+    """A requests Session with pooled keep-alive connections and retries with exponential backoff
+
+    Connection errors and 429/5xx responses to GET/HEAD are retried.
+
+    Args:
+        pool (int, optional): Connections kept per host, pool_size by default
+        total (int, optional): Retries per request, retries by default
+        backoff_factor (float, optional): Backoff between retries in seconds, backoff by default
+
+    Returns:
+        requests.Session
+    """
+    retry = Retry(total=retries if total is None else total,
+                  backoff_factor=backoff if backoff_factor is None else backoff_factor,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET', 'HEAD'))
+    adapter = HTTPAdapter(pool_connections=pool_size if pool is None else pool,
+                          pool_maxsize=pool_size if pool is None else pool,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def session():
+    """The module wide shared Session (created on first use)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+    return _session
+
+
+def _stamp(response):
+    """Server Last-Modified as a Unix time, None if it didn't send one"""
+    modified = response.headers.get('Last-Modified')
+    return None if modified is None else email.utils.parsedate_to_datetime(modified).timestamp()
+
+
+def fetch(url, path, http=None, conditional=True, chunk_size=2**20, resume=False):
+    """Download url to path, streaming to a temporary file that is renamed into place
+
+    If path already exists and conditional is set, the request carries If-Modified-Since (the
+    local file's mtime), and a 304 leaves the local copy alone. The local file's mtime is set
+    to the server's Last-Modified, so later conditional requests compare like with like. A
+    partial or failed download never replaces or leaves behind a file at path.
+
+    With resume set, the download goes to path + '.part' instead, which an interrupted transfer
+    leaves behind (stamped with the server's Last-Modified). The next call asks for just the
+    rest of it with Range/If-Range, and starts over if the server's copy has changed since.
+
+    Args:
+        url (str): Remote file
+        path (str): Local file
+        http (Session, optional): Session to use, the shared session() by default
+        conditional (bool, optional): Skip the download if the local copy is current
+        chunk_size (int, optional): Bytes per streamed write
+        resume (bool, optional): Keep interrupted downloads and continue them next time
+
+    Returns:
+        bool: True if path now holds a current copy (downloaded or already up to date). False if the
+        download or writing it locally failed
+    """
+    http = session() if http is None else http
+    folder = os.path.dirname(path) or '.'
+    headers = {}
+    if conditional and os.path.exists(path):
+        headers['If-Modified-Since'] = email.utils.formatdate(os.path.getmtime(path), usegmt=True)
+    partial = path + '.part'
+    offset = os.path.getsize(partial) if resume and os.path.exists(partial) else 0
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+        headers['If-Range'] = email.utils.formatdate(os.path.getmtime(partial), usegmt=True)
+    try:
+        with http.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == requests.codes.not_modified:
+                return True
+            if response.status_code == requests.codes.requested_range_not_satisfiable and offset:
+                # the partial file doesn't fit the remote one any more
+                os.remove(partial)
+                return fetch(url, path, http, conditional, chunk_size, resume)
+            if response.status_code not in (requests.codes.ok, requests.codes.partial_content):
+                return False
+            appending = response.status_code == requests.codes.partial_content and \
+                response.headers.get('Content-Range', '').startswith('bytes {}-'.format(offset))
+            if response.status_code == requests.codes.partial_content and not appending:
+                return False
+            stamp = _stamp(response)
+            os.makedirs(folder, exist_ok=True)
+            if resume:
+                temp_path = partial
+                local_file = open(partial, 'ab' if appending else 'wb')
+            else:
+                handle, temp_path = tempfile.mkstemp(dir=folder, prefix='.' + os.path.basename(path), suffix='.part')
+                local_file = os.fdopen(handle, 'wb')
+            try:
+                with local_file:
+                    for chunk in response.iter_content(chunk_size):
+                        local_file.write(chunk)
+                if stamp is not None:
+                    os.utime(temp_path, (stamp, stamp))
+                os.replace(temp_path, path)
+            except BaseException:
+                if resume and stamp is not None:
+                    # If-Range needs the version the partial file came from
+                    os.utime(temp_path, (stamp, stamp))
+                else:
+                    os.remove(temp_path)
+                raise
+    except (requests.RequestException, OSError) as err:
+        # local disk errors (full, permissions, NFS) fail this file only, like a failed download
+        print(url, ' could not be fetched: ', err)
+        return False
+    return True
+
+
+def fetch_many(jobs, workers=8, http=None, conditional=True, resume=False):
+    """Download many (url, path) pairs concurrently over one pooled session
+
+    Args:
+        jobs (list): (url, path) tuples
+        workers (int, optional): Downloads in flight at once
+        http (Session, optional): Session to use, the shared session() by default
+        conditional (bool, optional): Skip files whose local copy is current (see fetch)
+        resume (bool, optional): Keep interrupted downloads and continue them next time (see fetch)
+
+    Returns:
+        list: fetch's result for each job, in job order
+    """
+    http = session() if http is None else http
+    if not jobs:
+        return []
+    with cf.ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda job: fetch(job[0], job[1], http, conditional, resume=resume), jobs))
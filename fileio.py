@@ -0,0 +1,115 @@
+import os
+import collections
+import datetime as dt
+import pandas as pd
+import concurrent.futures as cf
+from catalog import start_from_name
+
+
+def _read_or_skip(reader, file):
+    """Run reader on one file, handing any error back instead of raising it"""
+    try:
+        return reader(file), None
+    except Exception as err:
+        return None, err
+
+
+def _report_error(file, err, errors):
+    print(file, ' caused an error, ignoring: ', err)
+    if errors is not None:
+        errors.append({'file': file, 'error': '{}: {}'.format(type(err).__name__, err)})
+
+
+def map_files(reader, filelist, workers=None, errors=None):
+    """Apply a per-file reader across a filelist, yielding the results in filelist order
+
+    Files that raise are reported and skipped, so one bad file never kills the whole read.
+    With workers > 1 the files are decompressed and parsed in a process pool and only the
+    parsed results come back to the parent. At most 2 * workers files are in flight at once,
+    so a slow consumer doesn't pile every parsed file up in memory.
+
+    Args:
+        reader (function): Module level function taking a single file path (must be picklable)
+        filelist (list): Python list of full file names to read
+        workers (int, optional): Number of worker processes. None or 1 reads serially
+        errors (list, optional): Failed files are appended here as {'file', 'error'} dicts
+
+    Yields:
+        Whatever reader returns, for every file that read without error
+    """
+    if workers is None or workers <= 1:
+        results = (_read_or_skip(reader, file) for file in filelist)
+        for file, (result, err) in zip(filelist, results):
+            if err is not None:
+                _report_error(file, err, errors)
+                continue
+            yield result
+        return
+
+    with cf.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        files = iter(filelist)
+        for file in files:
+            pending.append((file, pool.submit(_read_or_skip, reader, file)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            file, future = pending.popleft()
+            result, err = future.result()
+            # keep the pool topped up before handing the result over
+            for next_file in files:
+                pending.append((next_file, pool.submit(_read_or_skip, reader, next_file)))
+                break
+            if err is not None:
+                _report_error(file, err, errors)
+                continue
+            yield result
+
+
+def sort_by_start(filelist, start=None):
+    """Order a filelist by the start time each file name carries
+
+    Args:
+        filelist (list): Python list of full file names
+        start (function, optional): Maps a file name to its start datetime (None if unknown).
+            start_from_name by default
+
+    Returns:
+        list: The files, earliest start first. Names without a start time go first, in name order
+    """
+    start = start_from_name if start is None else start
+    return sorted(filelist, key=lambda file: (start(os.path.basename(file)) or dt.datetime.min, file))
+
+
+def concat_presorted(frames, by='datetime'):
+    """Concatenate frames that are each time ordered into one time ordered frame
+
+    Frames are expected in start time order (see sort_by_start). If no frame starts before the
+    previous ones have ended, a plain concat is already ordered and no sort is done at all. Only
+    when ranges really overlap are the runs merged, with a stable sort that keeps ties in frame
+    order (timsort finds the sorted runs, so this works out as a k-way merge of the frames).
+
+    Args:
+        frames (iterable): DataFrames, each sorted by the by column
+        by (str, optional): Time column to order on
+
+    Returns:
+        DataFrame: All rows, ordered by the by column, with a fresh RangeIndex
+    """
+    frames = list(frames)
+    ordered = True
+    latest = None
+    for i, frame in enumerate(frames):
+        if frame.empty:
+            continue
+        times = frame[by]
+        if not times.is_monotonic_increasing:
+            frames[i] = frame.sort_values(by, kind='stable')
+            times = frames[i][by]
+        if latest is not None and times.iloc[0] < latest:
+            ordered = False
+        latest = times.iloc[-1] if latest is None else max(latest, times.iloc[-1])
+    df_out = pd.concat(frames, ignore_index=True)
+    if not ordered:
+        df_out = df_out.sort_values(by, kind='stable', ignore_index=True)
+    return df_out
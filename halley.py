@@ -1,148 +1,229 @@
 import os
-import requests
+import re
 import numpy as np
 import pandas as pd
 import datetime as dt
+from fetch import fetch, fetch_many
+from fileio import map_files, sort_by_start, concat_presorted
+from timestamps import from_strings, from_cadence
 
 datapath_local = '/data/halley'
 datapath_remote = 'http://psddb.nerc-bas.ac.uk/data/psddata/atmos/space/'
 
 
-def fetch_remote(datetime, subsystem='sc'):
+def _local_path(datetime, subsystem='sc'):
+    """Local copy of a day's file, datapath_local/{subsystem}/{year}/{doy}{year}.TXT"""
+    year = datetime.year
+    doy = '{:03}'.format(datetime.timetuple().tm_yday)
+    return '{0}/{3}/{1}/{2}{1}.TXT'.format(datapath_local, year, doy, subsystem)
+
+
+def _remote_url(datetime, subsystem='sc', base_url=None):
+    """URL of a day's file on the UK Polar Data Centre server (or base_url, e.g. a local test server)"""
+    year = datetime.year
+    doy = '{:03}'.format(datetime.timetuple().tm_yday)
+    month = '{:02}'.format(datetime.month)
+    date = '{:02}'.format(datetime.day)
+    URL = {'sc': '{base_url}/scm/halley//{year}/data/ascii/{doy}{year}.TXT',
+           'fg': '{base_url}/fluxgate/halley//{year}/data/00001/ZFM{year}{month}{date}.dat'}
+    return URL[subsystem].format(base_url=datapath_remote if base_url is None else base_url, year=year, doy=doy, month=month, date=date)
+
+
+def fetch_remote(datetime, subsystem='sc', base_url=None, conditional=True):
     """Grabs mag data from UK Polar Data Centre, NERC and saves a local copy to datapath_local/{instrument}/{year}/{file}
 
     Args:
         datetime (datetime): python datetime object
         subsystem (str, optional): Instrument string ('sc' or 'fg')
+        base_url (str, optional): Server to fetch from, datapath_remote by default
+        conditional (bool, optional): Don't download again if the local copy is current
 
     Returns:
-        available (bool): True if file is downloaded from remote server
+        available (bool): True if file is downloaded from remote server (or the local copy is current)
     """
-    year = datetime.year
-    doy = '{:03}'.format(datetime.timetuple().tm_yday)
-    month = '{:02}'.format(datetime.month)
-    date = '{:02}'.format(datetime.day)
-    URL = {'sc': '{base_url}/scm/halley//{year}/data/ascii/{doy}{year}.TXT'.format(base_url=datapath_remote, year=year, doy=doy),
-           'fg': '{base_url}/fluxgate/halley//{year}/data/00001/ZFM{year}{month}{date}.dat'.format(base_url=datapath_remote, year=year, doy=doy, month=month, date=date)}
-    r = requests.get(URL[subsystem])
-
-    available = r.status_code == requests.codes.ok
-    if available:
-        try:
-            with open('{0}/{3}/{1}/{2}{1}.txt'.format(datapath_local, year, doy, subsystem), 'w+') as local_file:
-                local_file.write(r.text)
-        except FileNotFoundError:
-            try:
-                os.makedirs('{0}/{1}/{2}'.format(datapath_local, subsystem, year))
-                with open('{0}/{3}/{1}/{2}{1}.txt'.format(datapath_local, year, doy, subsystem), 'x+') as local_file:
-                    local_file.write(r.text)
-            except OSError:
-                pass
-            pass
-    return available
-
-
-def generate_filelist(start, end=None, subsystem='sc'):
+    return fetch(_remote_url(datetime, subsystem, base_url), _local_path(datetime, subsystem), conditional=conditional)
+
+
+def fetch_remote_list(dates, subsystem='sc', workers=8, base_url=None, conditional=True):
+    """Fetch many days concurrently over the shared connection pool (see fetch.fetch_many)
+
+    Args:
+        dates (list): Python datetimes to fetch
+        subsystem (str, optional): Instrument string ('sc' or 'fg')
+        workers (int, optional): Downloads in flight at once
+        base_url (str, optional): Server to fetch from, datapath_remote by default
+        conditional (bool, optional): Don't download again if the local copy is current
+
+    Returns:
+        list: The dates that are now available locally
+    """
+    jobs = [(_remote_url(date, subsystem, base_url), _local_path(date, subsystem)) for date in dates]
+    return [date for date, available in zip(dates, fetch_many(jobs, workers=workers, conditional=conditional)) if available]
+
+
+def _start_from_doy(name):
+    """Start of a {doy}{year}.TXT day file"""
+    match = re.search(r'(\d{3})(\d{4})\.txt$', name, flags=re.IGNORECASE)
+    if match is None:
+        return None
+    return dt.datetime(int(match.group(2)), 1, 1) + dt.timedelta(days=int(match.group(1)) - 1)
+
+
+def catalog_entry(path):
+    """Catalog fields for a Halley file (see catalog.Catalog.refresh)
+
+    Args:
+        path (str): Full file path, datapath_local/{subsystem}/{year}/{doy}{year}.TXT
+
+    Returns:
+        dict: 'station', 'subsystem' and 'start', or None for anything else
+    """
+    start = _start_from_doy(path)
+    if start is None:
+        return None
+    return {'station': 'halley', 'subsystem': path.split(os.sep)[-3], 'start': start}
+
+
+def refresh_catalog(catalog):
+    """Bring a catalog.Catalog up to date with everything under datapath_local
+
+    Args:
+        catalog (Catalog): Catalog to refresh
+
+    Returns:
+        int: Number of directories that had to be re-listed
+    """
+    return catalog.refresh('halley', datapath_local, catalog_entry)
+
+
+def generate_filelist(start, end=None, subsystem='sc', catalog=None, workers=8, refresh=False, base_url=None):
     """Search the local and remote datapaths for files in the given date range
 
+    Days missing locally are fetched concurrently (see fetch_remote_list).
+
     Args:
         start (datetime): First day of timespan
         end (datetime, optional): last day of timespan. If None (default) then end = start
         subsystem (str, optional): Instrument data to search for ('sc' or 'fg')
+        catalog (Catalog, optional): Check for local copies in this file catalog instead of on disk.
+            Keep it current with refresh_catalog
+        workers (int, optional): Downloads in flight at once
+        refresh (bool, optional): Also check local copies against the server, downloading only the
+            ones that changed
+        base_url (str, optional): Server to fetch from, datapath_remote by default
 
     Returns:
         filelist (list): List of string paths to files representing data for the given dates
     """
     end = start if end is None else end
+    filelist = []
     if (type(start) is dt.datetime) and (type(end) is dt.datetime) and (start <= end):
         searchlist = pd.date_range(start=start, end=end).to_pydatetime().tolist()
         remotelist = []
-        locallist = []
+        locallist = set()
+        if catalog is not None:
+            cataloged = set(catalog.query('halley', dt.datetime(start.year, start.month, start.day),
+                                          dt.datetime(end.year, end.month, end.day) + dt.timedelta(days=1), subsystem=subsystem))
         for date in searchlist:
-            year = date.year
-            doy = '{:03}'.format(date.timetuple().tm_yday)
-            try:
-                with open('{0}/{3}/{1}/{2}{1}.TXT'.format(datapath_local, year, doy, subsystem), 'x'):
-                    pass
-                remotelist.append(date)
-            except FileExistsError:
-                locallist.append(date)
-            except FileNotFoundError:
+            if catalog is not None:
+                local = _local_path(date, subsystem) in cataloged
+            else:
+                local = os.path.isfile(_local_path(date, subsystem)) and os.path.getsize(_local_path(date, subsystem)) > 0
+            if local:
+                locallist.add(date)
+            if refresh or not local:
                 remotelist.append(date)
-        locallist = locallist + [date for date in remotelist if fetch_remote(date, subsystem=subsystem)]
-
-        filelist = []
-        for date in locallist:
-            year = date.year
-            doy = '{:03}'.format(date.timetuple().tm_yday)
-            filelist.append('{0}/{3}/{1}/{2}{1}.TXT'.format(datapath_local, year, doy, subsystem))
+        fetched = set(fetch_remote_list(remotelist, subsystem=subsystem, workers=workers, base_url=base_url))
+        # a local copy that couldn't be refreshed is still good
+        filelist = [_local_path(date, subsystem) for date in searchlist if date in fetched or date in locallist]
 
     return filelist
 
 
-def generate_yearly_masterlist(year=2017, subsystem='sc', local=True):
+def generate_yearly_masterlist(year=2017, subsystem='sc', local=True, catalog=None):
     """Generate a python list of available files in a year
 
     Args:
         year (int, optional): Year to discover
         subsystem (str, optional): Subsystem ('sc', 'fg')
         local (bool, optional): Are we checking the local or remote directory
+        catalog (Catalog, optional): Answer from this file catalog instead of walking the data directory
 
     Returns:
         list: long filenames
     """
+    if catalog is not None:
+        return catalog.query('halley', dt.datetime(year, 1, 1), dt.datetime(year + 1, 1, 1), subsystem=subsystem, min_size=0)
     datapath = datapath_local if local else datapath_local
     yearly_masterlist = []
     # scan the year's data folder for all available files
     for root, dirs, files in os.walk(
             '{0}/{1}/{2}'.format(datapath, subsystem, year)):
-        if files != []:
-            for file in files:
-                yearly_masterlist = yearly_masterlist + [root + '/' + file]
+        yearly_masterlist.extend([root + '/' + file for file in files])
     # return full filenames with paths for each file
     return yearly_masterlist
 
 
-def read_fluxgate_list(filelist=''):
+def _read_fg_file(txt_file):
+    """Read a single day of fluxgate data"""
+    df_in = pd.read_csv(txt_file, sep=' ', header=None, usecols=[0, 2, 3, 4], names=['datetime', 'Bx', 'By', 'Bz'],
+                        dtype={'datetime': str, 'Bx': np.float32, 'By': np.float32, 'Bz': np.float32})
+    try:
+        df_in['datetime'] = from_strings(df_in['datetime'].to_numpy())
+    except ValueError:
+        # not ISO 8601, let pandas work the layout out
+        df_in['datetime'] = pd.to_datetime(df_in['datetime']).astype('M8[ns]')
+    return df_in
+
+
+def df_fg_gen(filelist, workers=None):
+    """Yield a dataframe per fluxgate file in start time order, skipping (and reporting) bad files"""
+    return map_files(_read_fg_file, sort_by_start(filelist, start=_start_from_doy), workers)
+
+
+def read_fluxgate_list(filelist='', workers=None):
     """Read in a fluxgate filelist and return a dataframe
 
     Args:
         filelist (str, optional): Python list of full file names to read
+        workers (int, optional): Number of processes to read files with. None reads serially
 
     Returns:
         DataFrame: A pandas dataframe with the following columns:
 
         'datetime', 'Bx', 'By', 'Bz'
     """
-    df_fg = pd.DataFrame()
-    for zip_file in filelist:
-        with open(zip_file) as file:
-            df_in = pd.read_csv(file, sep=' ', header=None, usecols=[0, 2, 3, 4], names=['datetime', 'Bx', 'By', 'Bz'], dtype={'datetime': np.str, 'Bx': np.float32, 'By': np.float32, 'Bz': np.float32})
-            df_fg = df_fg.append(df_in, ignore_index=True)
-    df_fg['datetime'] = pd.to_datetime(df_fg['datetime'])
-    return df_fg
+    return concat_presorted(df_fg_gen(filelist, workers))
 
 
-def read_searchcoil_list(filelist=''):
-    """Read in a fluxgate filelist and return a dataframe
+def _read_sc_file(txt_file):
+    """Read a single day of searchcoil data
+
+    Samples are 0.1 s apart from midnight of the day of year in the file name ({doy}{year}.TXT), so
+    the timestamps are computed and the time column in the file is never parsed.
+    """
+    sc_file_start = dt.datetime.strptime(txt_file[-11:-4], '%j%Y')
+    df_in = pd.read_csv(txt_file, sep=r'\s+', header=None, skiprows=2, usecols=[1, 2, 3], names=['datetime', 'dBx', 'dBy', 'dBz'],
+                        dtype={'dBx': np.float32, 'dBy': np.float32, 'dBz': np.float32})
+    df_in.insert(0, 'datetime', from_cadence(sc_file_start, '100ms', df_in.shape[0]))
+    return df_in
+
+
+def df_sc_gen(filelist, workers=None):
+    """Yield a dataframe per searchcoil file in start time order, skipping (and reporting) bad files"""
+    return map_files(_read_sc_file, sort_by_start(filelist, start=_start_from_doy), workers)
+
+
+def read_searchcoil_list(filelist='', workers=None):
+    """Read in a searchcoil filelist and return a dataframe
 
     Args:
         filelist (str, optional): Python list of full file names to read
+        workers (int, optional): Number of processes to read files with. None reads serially
 
     Returns:
         DataFrame: A pandas dataframe with the following columns:
 
-        'datetime', 'Bx', 'By', 'Bz'
+        'datetime', 'dBx', 'dBy', 'dBz'
     """
-    df_sc = pd.DataFrame()
-    sc_datetimes = []
-    sc_sample_rate = dt.timedelta(seconds=.1)
-    for txt_file in filelist:
-        sc_file_start = dt.datetime.strptime(txt_file[-11:-4], '%j%Y')
-        with open(txt_file) as file:
-            df_in = pd.read_table(file, delim_whitespace=True, skiprows=2, names=['datetime', 'dBx', 'dBy', 'dBz'])
-            df_sc = df_sc.append(df_in, ignore_index=True)
-            sc_in_dates = [sc_file_start + sc_sample_rate * x for x in range(0, df_in.shape[0])]
-            sc_datetimes = sc_datetimes + sc_in_dates
-    df_sc['datetime'] = sc_datetimes
-    return df_sc.astype({'datetime': np.dtype('<M8[ns]'), 'dBx': np.float32, 'dBy': np.float32, 'dBz': np.float32}, copy=True)
+    return concat_presorted(df_sc_gen(filelist, workers))
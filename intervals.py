@@ -0,0 +1,196 @@
+import os
+import numpy as np
+import pandas as pd
+from colstore import write_frame, read_frame, read_meta
+
+# Interval tables IntervalScanner produces. gaps and reboots are derived from runs and segments
+tables = ['runs', 'gaps', 'segments', 'reboots', 'sync']
+
+
+def _runs(times, new_run, first=None, peak=None):
+    """One row per run of samples, a run starting wherever new_run is True (new_run[0] must be)"""
+    starts = np.flatnonzero(new_run)
+    ends = np.r_[starts[1:], len(times)] - 1
+    table = {'start': times[starts], 'end': times[ends], 'samples': ends - starts + 1}
+    for name, values in (first or {}).items():
+        table[name] = values[starts]
+    for name, values in (peak or {}).items():
+        table[name] = np.maximum.reduceat(values, starts)
+    return pd.DataFrame(table)
+
+
+class _RunTable(object):
+    """Accumulates a run table chunk by chunk, holding the last (still open) run back"""
+
+    def __init__(self, peak=()):
+        self.peak = list(peak)
+        self.closed = []
+        self.pending = None
+
+    def update(self, table, continues):
+        if self.pending is not None:
+            if continues:
+                row = table.iloc[:1].copy()
+                row['start'] = self.pending['start'].iloc[0]
+                row['samples'] += self.pending['samples'].iloc[0]
+                for column in table.columns.difference(['start', 'end', 'samples'] + self.peak):
+                    row[column] = self.pending[column].iloc[0]
+                for column in self.peak:
+                    row[column] = max(row[column].iloc[0], self.pending[column].iloc[0])
+                table = pd.concat([row, table.iloc[1:]], ignore_index=True)
+            else:
+                table = pd.concat([self.pending, table], ignore_index=True)
+        self.closed.append(table.iloc[:-1])
+        self.pending = table.iloc[-1:]
+
+    def finish(self, columns):
+        frames = self.closed + ([self.pending] if self.pending is not None else [])
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)[columns]
+
+
+class IntervalScanner(object):
+    """Compact interval tables from a time ordered stream of frames, fed whole or chunk by chunk
+
+    Each update is one vectorized pass over the chunk. Only the last open interval of each table
+    is carried between chunks, so the tables come out the same however the data is chunked.
+
+    Tables (see finish):
+        runs: stretches of data with no step longer than gap ('start', 'end', 'samples')
+        gaps: the holes between runs ('start' last sample before, 'end' first sample after, 'duration')
+        segments: uptime segments, one per boot, needs 'Uptime_secs' ('start', 'end', 'samples',
+            'boot' estimated boot time, 'uptime' highest uptime seen, in seconds)
+        reboots: every segment after the first ('datetime' first sample after the reboot, 'boot',
+            'uptime_before' last uptime before it)
+        sync: stretches with 'UTC_sync_age_secs' above sync_age_max ('start', 'end', 'samples',
+            'max_sync_age' in seconds)
+
+    Args:
+        gap (timedelta or str): Steps longer than this are data gaps
+        sync_age_max (float, optional): GPS sync ages (seconds) above this are anomalies
+    """
+
+    def __init__(self, gap, sync_age_max=3600):
+        self.gap = pd.Timedelta(gap).to_timedelta64()
+        self.sync_age_max = sync_age_max
+        self._runs = _RunTable()
+        self._segments = _RunTable(peak=['uptime'])
+        self._sync = _RunTable(peak=['max_sync_age'])
+        self._last = {}
+
+    def update(self, df_in):
+        """Fold the next time ordered frame into the tables
+
+        Args:
+            df_in (DataFrame): Frame with a 'datetime' column, plus 'Uptime_secs' and 'UTC_sync_age_secs'
+                for the segments, reboots and sync tables
+        """
+        if df_in.empty:
+            return self
+        times = df_in['datetime'].to_numpy(dtype='M8[ns]')
+
+        new_run = np.diff(times, prepend=self._last.get('time', times[0])) > self.gap
+        continues = 'time' in self._last and not new_run[0]
+        new_run[0] = True
+        self._runs.update(_runs(times, new_run), continues)
+        self._last['time'] = times[-1]
+
+        if 'Uptime_secs' in df_in.columns:
+            uptime = df_in['Uptime_secs'].to_numpy(dtype=np.float64)
+            valid = ~np.isnan(uptime)
+            if valid.any():
+                uptime, up_times = uptime[valid], times[valid]
+                new_run = np.diff(uptime, prepend=self._last.get('uptime', uptime[0])) < 0
+                continues = 'uptime' in self._last and not new_run[0]
+                new_run[0] = True
+                boot = up_times - (uptime * 1e9).astype('m8[ns]')
+                self._segments.update(_runs(up_times, new_run, first={'boot': boot}, peak={'uptime': uptime}), continues)
+                self._last['uptime'] = uptime[-1]
+
+        if 'UTC_sync_age_secs' in df_in.columns:
+            age = df_in['UTC_sync_age_secs'].to_numpy(dtype=np.float64)
+            flag = age > self.sync_age_max
+            new_run = flag != np.r_[self._last.get('sync', flag[0]), flag[:-1]]
+            continues = 'sync' in self._last and not new_run[0]
+            new_run[0] = True
+            self._sync.update(_runs(times, new_run, first={'flag': flag}, peak={'max_sync_age': np.nan_to_num(age)}), continues)
+            self._last['sync'] = flag[-1]
+        return self
+
+    def finish(self):
+        """Close the open intervals and return every table
+
+        Returns:
+            dict: DataFrame per table name (see tables). Tables that need a column that was never
+            seen come back empty
+        """
+        runs = self._runs.finish(['start', 'end', 'samples'])
+        gaps = pd.DataFrame({'start': runs['end'].to_numpy()[:-1], 'end': runs['start'].to_numpy()[1:]})
+        gaps['duration'] = gaps['end'] - gaps['start']
+        segments = self._segments.finish(['start', 'end', 'samples', 'boot', 'uptime'])
+        reboots = pd.DataFrame({'datetime': segments['start'].to_numpy()[1:],
+                                'boot': segments['boot'].to_numpy()[1:],
+                                'uptime_before': segments['uptime'].to_numpy()[:-1]})
+        sync = self._sync.finish(['start', 'end', 'samples', 'flag', 'max_sync_age'])
+        sync = sync[sync['flag'].astype(bool)].drop(columns='flag').reset_index(drop=True)
+        return {'runs': runs, 'gaps': gaps, 'segments': segments, 'reboots': reboots, 'sync': sync}
+
+
+def scan(df_in, gap, sync_age_max=3600):
+    """Interval tables for a whole frame in one go (see IntervalScanner)"""
+    return IntervalScanner(gap, sync_age_max).update(df_in).finish()
+
+
+def save_tables(path, interval_tables, meta=None):
+    """Write interval tables to a directory, one column store per table"""
+    for name, table in interval_tables.items():
+        write_frame(os.path.join(path, name), table, meta=meta)
+
+
+def load_table(path, name):
+    """Read one interval table back, None if it was never saved"""
+    if read_meta(os.path.join(path, name)) is None:
+        return None
+    return read_frame(os.path.join(path, name))
+
+
+def coverage(runs, edges, cadence=None):
+    """Fraction of each bin between consecutive edges that is covered by runs
+
+    Each run covers its samples' own cadence as well, [start, end + cadence), so a run of n
+    samples counts for n sample periods rather than n - 1.
+
+    Args:
+        runs (DataFrame): Time ordered, non overlapping runs with 'start' and 'end' (and 'samples')
+        edges (array-like): Bin edges (datetimes)
+        cadence (timedelta or str, optional): Sample period. By default the median over the runs
+            with more than one sample of (end - start) / (samples - 1), zero without 'samples'
+
+    Returns:
+        ndarray: Covered fraction per bin, len(edges) - 1 values between 0 and 1
+    """
+    edges = np.asarray(pd.to_datetime(edges), dtype='M8[ns]')
+    starts = runs['start'].to_numpy(dtype='M8[ns]')
+    ends = runs['end'].to_numpy(dtype='M8[ns]')
+    if len(starts) == 0:
+        return np.zeros(len(edges) - 1)
+    if cadence is None:
+        cadence = 0
+        if 'samples' in runs.columns:
+            samples = runs['samples'].to_numpy(dtype=np.int64)
+            several = samples > 1
+            if several.any():
+                cadence = int(np.median((ends - starts)[several].astype(np.int64) / (samples[several] - 1)))
+    else:
+        cadence = pd.Timedelta(cadence).value
+    # a run's last sample period never reaches past the next run's start
+    ends = ends + np.timedelta64(cadence, 'ns')
+    ends[:-1] = np.minimum(ends[:-1], starts[1:])
+    durations = (ends - starts).astype(np.int64)
+    before = np.r_[0, np.cumsum(durations)[:-1]]
+    # covered time up to each edge
+    slot = np.searchsorted(starts, edges, side='right') - 1
+    inside = np.clip((edges - starts[slot.clip(0)]).astype(np.int64), 0, durations[slot.clip(0)])
+    covered = np.where(slot >= 0, before[slot.clip(0)] + inside, 0)
+    return np.diff(covered) / np.diff(edges).astype(np.int64)
@@ -0,0 +1,213 @@
+import numpy as np
+import pandas as pd
+import concurrent.futures as cf
+import aalpip
+from cleaning import error_value
+import ago
+import deployments
+import dtu
+import halley
+
+# Components each subsystem contributes to the cube, in cube order. Sources that don't record one
+# (AALPIP searchcoils have no dBz) leave it NaN
+components = {'fg': ['Bx', 'By', 'Bz'],
+              'sc': ['dBx', 'dBy', 'dBz']}
+
+# Sources loaded at once. Each streams its own files, workers= parses those in processes as well
+source_workers = 4
+
+
+def _aalpip_frames(system, first, last, subsys, workers):
+    return aalpip.iter_subsys(first, last, system=system, subsys=subsys, chunk='file', workers=workers)
+
+
+def _dtu_frames(station, first, last, subsys, workers):
+    return (dtu.import_subsys(day, day, station=station, subsys=subsys, workers=workers)
+            for day in pd.date_range(first, last).to_pydatetime())
+
+
+def _halley_frames(station, first, last, subsys, workers):
+    gen = {'fg': halley.df_fg_gen, 'sc': halley.df_sc_gen}[subsys]
+    return gen(halley.generate_filelist(first, last, subsystem=subsys), workers)
+
+
+def _ago_frames(station, first, last, subsys, workers):
+    gen = {'fg': ago.df_fg_gen, 'sc': ago.df_sc_gen}[subsys]
+    return gen(ago.generate_filelist(first, last, station=station, subsystem=subsys), workers)
+
+
+# Subsystems each dataset has a loader for
+subsystems = {'aalpip': ('fg', 'sc'),
+              'dtu': ('fg',),
+              'halley': ('fg', 'sc'),
+              'ago': ('fg', 'sc')}
+
+# Per dataset: yields time ordered frames ('datetime' + components) for the days first..last
+loaders = {'aalpip': _aalpip_frames,
+           'dtu': _dtu_frames,
+           'halley': _halley_frames,
+           'ago': _ago_frames}
+
+
+class NetworkCube(object):
+    """Several stations on one uniform time grid
+
+    Attributes:
+        data (ndarray): float32 (station x time x component), each bin the mean of the samples in
+            [time, time + cadence). NaN where a station has no (valid) samples
+        gaps (ndarray): bool (station x time), True where a station has no (valid) samples in any component
+        times (DatetimeIndex): Left edge of each time bin
+        sources (list): (dataset, station) of each station row
+        components (list): Component names
+    """
+
+    def __init__(self, data, gaps, times, sources, components):
+        self.data = data
+        self.gaps = gaps
+        self.times = times
+        self.sources = list(sources)
+        self.components = list(components)
+
+    def frame(self, source):
+        """One station's row as a DataFrame ('datetime' + components), source is (dataset, station) or a row number"""
+        row = source if isinstance(source, (int, np.integer)) else self.sources.index(tuple(source))
+        df_out = pd.DataFrame(np.asarray(self.data[row]), columns=self.components)
+        df_out.insert(0, 'datetime', self.times)
+        return df_out
+
+
+def _bin_frames(frames, data, start, cadence, columns):
+    """Stream frames into one station's (time x component) slice of the cube as running bin means
+
+    Frames come in time order, so a frame can only share bins with the one before it. Only that
+    frame's sample counts are carried along, never counts for the whole row. A bin further back
+    that a frame lands in again is weighted as if it held a single sample. Sensor fill values
+    (<= error_value) count as missing, like NaN.
+    """
+    carry_first = 0
+    carry = np.zeros((0, len(columns)), dtype=np.int64)
+    for df_in in frames:
+        if df_in.empty:
+            continue
+        # NaT and times off the grid fall outside [0, n)
+        bins = (df_in['datetime'].to_numpy(dtype='M8[ns]').view(np.int64) - start) // cadence
+        inside = (bins >= 0) & (bins < data.shape[0])
+        if not inside.any():
+            continue
+        bins = bins[inside]
+        first = int(bins.min())
+        local = bins - first
+        size = int(bins.max() - first) + 1
+        previous = data[first:first + size].astype(np.float64)
+        counts = (~np.isnan(previous)).astype(np.int64)
+        # exact counts where this frame overlaps the last one
+        low, high = max(first, carry_first), min(first + size, carry_first + len(carry))
+        if low < high:
+            counts[low - first:high - first] = carry[low - carry_first:high - carry_first]
+        for j, column in enumerate(columns):
+            if column not in df_in.columns:
+                continue
+            values = df_in[column].to_numpy(dtype=np.float64)[inside]
+            valid = np.isfinite(values) & (values > error_value)
+            n_new = np.bincount(local[valid], minlength=size)
+            sums = np.bincount(local[valid], weights=values[valid], minlength=size)
+            hit = np.flatnonzero(n_new)
+            n_old = counts[hit, j]
+            old = np.where(n_old > 0, previous[hit, j], 0)
+            data[first + hit, j] = (old * n_old + sums[hit]) / (n_old + n_new[hit])
+            counts[:, j] += n_new
+        carry_first, carry = first, counts
+
+
+def _gaps(data, rows=2**22):
+    """True for each time bin of a station's slice with no data in any component, a block at a time"""
+    gaps = np.empty(data.shape[0], dtype=bool)
+    for first in range(0, data.shape[0], rows):
+        gaps[first:first + rows] = np.isnan(data[first:first + rows]).all(axis=1)
+    return gaps
+
+
+def load_cube(sources, start, end=None, cadence='1s', subsys='fg', workers=None, path=None):
+    """Load several stations straight onto one shared time grid
+
+    Sources are loaded concurrently (source_workers at a time). Each one is streamed a file (or a
+    day) at a time and averaged into its row of the cube as it goes, so no per station frame of
+    the whole range is ever built and nothing is merged or resampled afterwards.
+
+    Args:
+        sources (list): (dataset, station) pairs. dataset is one of loaders ('aalpip', 'dtu',
+            'halley', 'ago'), station is the AALPIP system number or the station name ('upn',
+            'AGO4', ...). Halley has a single station, so any station will do
+        start (datetime-like): Start of the grid
+        end (datetime-like, optional): End of the grid (exclusive), one day after start by default
+        cadence (str or timedelta, optional): Grid spacing, e.g. '1s', '100ms', '1min'
+        subsys (str, optional): 'fg' or 'sc'
+        workers (int, optional): Processes each source parses its files with. None reads serially
+        path (str, optional): Memory map the cube to this .npy file instead of holding it in memory
+
+    Returns:
+        NetworkCube: float32 (station x time x component) data with its gap mask and labels. A source
+        that fails is reported and left as all gaps (NaN)
+
+    Raises:
+        ValueError: A source's dataset has no loader for subsys
+    """
+    start = pd.Timestamp(start).as_unit('ns')
+    end = start + pd.Timedelta(days=1) if end is None else pd.Timestamp(end).as_unit('ns')
+    step = pd.Timedelta(cadence).as_unit('ns')
+    times = pd.date_range(start, end, freq=step, inclusive='left')
+    sources = [tuple(source) for source in sources]
+    for dataset, station in sources:
+        if subsys not in subsystems.get(dataset, ()):
+            raise ValueError('No {} loader for {} (source {})'.format(subsys, dataset, (dataset, station)))
+    columns = components[subsys]
+
+    shape = (len(sources), len(times), len(columns))
+    if path is None:
+        data = np.full(shape, np.nan, dtype=np.float32)
+    else:
+        data = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+        data[:] = np.nan
+    gaps = np.ones(shape[:2], dtype=bool)
+
+    first = start.normalize().to_pydatetime()
+    last = (end - pd.Timedelta(1, 'ns')).normalize().to_pydatetime()
+
+    def load(row):
+        dataset, station = sources[row]
+        try:
+            frames = loaders[dataset](station, first, last, subsys, workers)
+            _bin_frames(frames, data[row], start.value, step.value, columns)
+            gaps[row] = _gaps(data[row])
+        except Exception as err:
+            # drop whatever it got through before failing, the row is all gaps
+            print(dataset, station, ' caused an error, ignoring: ', err)
+            data[row] = np.nan
+            gaps[row] = True
+
+    with cf.ThreadPoolExecutor(max_workers=source_workers) as pool:
+        list(pool.map(load, range(len(sources))))
+    if path is not None:
+        data.flush()
+    return NetworkCube(data, gaps, times, sources, columns)
+
+
+def conjugate_sources(time):
+    """(dataset, station) pairs of every AALPIP system deployed at a PG site at time, each followed
+    by its Greenland conjugate (aalpip.conjugates)
+
+    Args:
+        time (datetime-like): When to look the deployments up
+
+    Returns:
+        list: Sources for load_cube, in PG order
+    """
+    pairs = []
+    for system in sorted(deployments.deployments['system'].unique()):
+        site = deployments.site_at(system, time)
+        if site in aalpip.conjugates:
+            pairs.append((site, int(system)))
+    sources = []
+    for site, system in sorted(pairs):
+        sources.extend([('aalpip', system), ('dtu', aalpip.conjugates[site])])
+    return sources
@@ -0,0 +1,187 @@
+import os
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+import aalpip
+from fileio import map_files, sort_by_start
+
+# Contiguous AALPIP searchcoil archive. Each system-year is one raw int16 file of (dBx, dBy)
+# counts, {year}.i16, plus a small segment index, {year}.idx.npy. A segment is a run of
+# evenly spaced samples: start time, cadence, row offset into the counts file and length.
+archive_path = '/data/aal-pip/sc_archive'
+
+sc_cadence = np.timedelta64(100, 'ms')
+
+index_dtype = np.dtype([('start', '<M8[ns]'), ('cadence', '<m8[ns]'), ('offset', '<i8'), ('length', '<i8')])
+
+
+def _paths(system, year, root):
+    base = os.path.join(root, 'sys_{}'.format(system), str(year))
+    return base + '.i16', base + '.idx.npy'
+
+
+def build_archive(system, year, root=None, workers=None, catalog=None):
+    """Decode a system-year of searchcoil files into one contiguous archive
+
+    Files are laid down in start time order. Back to back files (the next one starts exactly
+    where the last one ended) are merged into a single segment. The archive is written to
+    temporary files and renamed into place, so readers never see a half written year.
+
+    Args:
+        system (int): AALPIP system number
+        year (int): Year to convert
+        root (str, optional): Archive directory, archive_path by default
+        workers (int, optional): Number of processes to decode files with. None decodes serially
+        catalog (Catalog, optional): Find files with this file catalog (see aalpip.generate_filelist)
+
+    Returns:
+        DataFrame: The segment index that was written
+    """
+    root = archive_path if root is None else root
+    counts_path, index_path = _paths(system, year, root)
+    os.makedirs(os.path.dirname(counts_path), exist_ok=True)
+
+    filelist = aalpip.generate_filelist(dt.datetime(year, 1, 1), dt.datetime(year, 12, 31), system=system, subsystem='sc', catalog=catalog)
+    filelist = sort_by_start(filelist)
+
+    segments = []
+    offset = 0
+    with open(counts_path + '.tmp', 'wb') as out:
+        for file_start, counts in map_files(aalpip._read_sc_counts, filelist, workers):
+            if counts.shape[0] == 0:
+                continue
+            file_start = np.datetime64(file_start, 'ns')
+            out.write(np.ascontiguousarray(counts, dtype='<i2').tobytes())
+            last = segments[-1] if segments else None
+            if last is not None and last[0] + last[1] * last[3] == file_start and last[1] == sc_cadence:
+                segments[-1] = (last[0], last[1], last[2], last[3] + counts.shape[0])
+            else:
+                segments.append((file_start, sc_cadence, offset, counts.shape[0]))
+            offset += counts.shape[0]
+    index = np.array(segments, dtype=index_dtype)
+    with open(index_path + '.tmp', 'wb') as out:
+        np.save(out, index)
+    os.replace(counts_path + '.tmp', counts_path)
+    os.replace(index_path + '.tmp', index_path)
+    return pd.DataFrame(index)
+
+
+class ScArchive(object):
+    """Memory mapped, read-only view of one system-year of the searchcoil archive
+
+    Several processes opening the same archive share one copy of it in the page cache.
+    """
+
+    def __init__(self, system, year, root=None):
+        root = archive_path if root is None else root
+        counts_path, index_path = _paths(system, year, root)
+        self.index = np.load(index_path)
+        n_rows = int(self.index['offset'][-1] + self.index['length'][-1]) if len(self.index) else 0
+        self.counts = np.memmap(counts_path, dtype='<i2', mode='r', shape=(n_rows, 2)) if n_rows else np.empty((0, 2), dtype='<i2')
+        self._ends = self.index['start'] + self.index['cadence'] * self.index['length']
+
+    @property
+    def segments(self):
+        return pd.DataFrame(self.index)
+
+    def views(self, start, end):
+        """Zero-copy slices of the archive overlapping [start, end)
+
+        Args:
+            start (datetime): Start of the time slice
+            end (datetime): End of the time slice (exclusive)
+
+        Returns:
+            list: (first sample time, cadence, (n, 2) int16 memmap view of raw counts) per segment
+        """
+        start = np.datetime64(pd.Timestamp(start), 'ns')
+        end = np.datetime64(pd.Timestamp(end), 'ns')
+        first = np.searchsorted(self._ends, start, side='right')
+        last = np.searchsorted(self.index['start'], end, side='left')
+        views = []
+        for seg in self.index[first:last]:
+            skip = max(0, -(-(start - seg['start']) // seg['cadence']))
+            stop = min(int(seg['length']), -(-(end - seg['start']) // seg['cadence']))
+            if stop <= skip:
+                continue
+            views.append((seg['start'] + skip * seg['cadence'], seg['cadence'],
+                          self.counts[seg['offset'] + skip:seg['offset'] + stop]))
+        return views
+
+    def read(self, start, end):
+        """Searchcoil data on a regular 10 Hz grid over [start, end), gaps filled with NaN
+
+        Args:
+            start (datetime): Start of the time slice
+            end (datetime): End of the time slice (exclusive)
+
+        Returns:
+            DataFrame: 'datetime', 'dBx', 'dBy' (float32, nT)
+        """
+        grid_start = np.datetime64(pd.Timestamp(start), 'ns')
+        n_rows = max(0, -(-(np.datetime64(pd.Timestamp(end), 'ns') - grid_start) // sc_cadence))
+        values = np.full((n_rows, 2), np.nan, dtype=np.float32)
+        for first_time, cadence, counts in self.views(start, end):
+            row = int(np.rint((first_time - grid_start) / sc_cadence))
+            step = int(np.rint(cadence / sc_cadence)) or 1
+            rows = slice(row, row + step * counts.shape[0], step)
+            n_fit = len(range(*rows.indices(n_rows)))
+            values[rows] = counts[:n_fit] * np.float32(aalpip.sc_scale)
+        return pd.DataFrame({'datetime': grid_start + sc_cadence * np.arange(n_rows),
+                             'dBx': values[:, 0],
+                             'dBy': values[:, 1]})
+
+
+def _open_archive(system, year, root, archives):
+    """ScArchive for a system-year, None if it hasn't been built. archives memoizes them per call"""
+    if year not in archives:
+        try:
+            archives[year] = ScArchive(system, year, root)
+        except FileNotFoundError:
+            archives[year] = None
+    return archives[year]
+
+
+def read_archive(start, end, system=4, root=None):
+    """Searchcoil data for any [start, end) from the archive, spanning years as needed
+
+    Each year's archive is built from the files that start in that year, so the last file of a
+    year can run past midnight on Dec 31. Those samples are served from the previous year's
+    archive.
+
+    Args:
+        start (datetime): Start of the time slice
+        end (datetime): End of the time slice (exclusive)
+        system (int, optional): AALPIP system number
+        root (str, optional): Archive directory, archive_path by default
+
+    Returns:
+        DataFrame: 'datetime', 'dBx', 'dBy' (float32, nT) on a 10 Hz grid, NaN where there's no data
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    frames = []
+    archives = {}
+    for year in range(start.year, end.year + 1):
+        year_start = max(start, pd.Timestamp(year, 1, 1))
+        year_end = min(end, pd.Timestamp(year + 1, 1, 1))
+        if year_end <= year_start:
+            continue
+        archive = _open_archive(system, year, root, archives)
+        if archive is None:
+            print('No searchcoil archive for sys_{} {}, filling with NaN'.format(system, year))
+            n_rows = -(-(year_end - year_start) // pd.Timedelta(sc_cadence))
+            df_year = pd.DataFrame({'datetime': np.datetime64(year_start, 'ns') + sc_cadence * np.arange(n_rows),
+                                    'dBx': np.full(n_rows, np.nan, dtype=np.float32),
+                                    'dBy': np.full(n_rows, np.nan, dtype=np.float32)})
+        else:
+            df_year = archive.read(year_start, year_end)
+        previous = _open_archive(system, year - 1, root, archives)
+        if previous is not None and previous.views(year_start, year_end):
+            # the tail of last year's final file
+            spill = previous.read(year_start, year_end)
+            for column in ('dBx', 'dBy'):
+                df_year[column] = df_year[column].fillna(spill[column])
+        frames.append(df_year)
+    return pd.concat(frames, ignore_index=True)
@@ -1,97 +1,246 @@
+import os
+import sqlite3
 import requests
 import datetime as dt
+import concurrent.futures as cf
 import ai.cdas as cdas
 import numpy as np
+import pandas as pd
+from fetch import session
+from colstore import write_frame, read_frame, read_meta
 
 proton_mass = 1.6726219e-27
 cdas_cache = '/data/cdas/'
 cdas.set_cache(True, directory=cdas_cache)
 
+ccmc_tsyg_url = 'https://ccmc.gsfc.nasa.gov/requests/instant/tsyganenko_results.php'
+ccmc_timeout = 120
+# Memo of every conjugate point CCMC has given us (see ConjugateMemo)
+ccmc_memo_path = os.path.expanduser('~/.cache/mist/ccmc_conj.sqlite')
+# Batch inputs are rounded to these steps before lookup, so near repeats share one request
+ccmc_precision = {'datetime': '1min',
+                  'lat': 0.01,
+                  'lon': 0.01,
+                  'SW_dyn_press': 0.1,
+                  'SW_vel': 1,
+                  'IMF_By': 0.1,
+                  'IMF_Bz': 0.1,
+                  'DST': 1}
 
-def get_ccmc_tsyg_conj(datetime, lat, lon, SW_dyn_press=1, SW_vel=450, IMF_By=0, IMF_Bz=0, DST=1, direction='North-South'):
-    """Determine the conjugate location points for a point on earth
+ccmc_inputs = ['SW_dyn_press', 'SW_vel', 'IMF_By', 'IMF_Bz', 'DST']
+conjugate_fields = ['geo_lat', 'geo_lon', 'dpl_lat', 'dpl_lon']
 
-    Args:
-        datetime (datetime): Description
-        lat (float): Description
-        lon (float): Description
-        SW_dyn_press (int, optional): Description
-        SW_vel (int, optional): Description
-        IMF_By (int, optional): Description
-        IMF_Bz (int, optional): Description
-        DST (int, optional): Description
-        direction (str, optional): Description
 
-    Returns:
-        Dict: Description
-    """
-    class BadDirection(Exception):
-        """Tsyganenko Model Directionality Error"""
-
-        def __init__(self, message, errors):
-            super(BadDirection, self).__init__(message)
-            self.errors = errors
-
-    ccmc_tsyg_url = "https://ccmc.gsfc.nasa.gov/requests/instant/tsyganenko_results.php"
-    payload = {'ts_version': '01',
-               'Year': '2015',
-               'Day': '76',
-               'Hour': '12',
-               'Minute': '00',
-               'Second': '00',
-               'SW dynamic pressure': '1.5',
-               'SW velocity': '310',
-               'IMF By': '2.9',
-               'IMF Bz': '-1.5',
-               'Dst': '9',
-               'DIR': '1',  # 1:N->S, -1:S->N
-               'Geographic Geocentric Latitude': '59.25',
-               'Longitude': '303.85',
-               'Xgsm': '1',
-               'Ygsm': '1',
-               'Zgsm': '1'}
-
-    if direction == 'North-South':
-        payload['DIR'] = '1'
-        if (lat < 0):
-            raise BadDirection('Direction Wrong', 'Lat < 0')
-    if direction == 'South-North':
-        payload['DIR'] = '-1'
-        if (lat > 0):
-            raise BadDirection('Direction Wrong', 'Lat > 0')
-
-    payload['Year'] = str(datetime.year)
-    payload['Day'] = str(datetime.timetuple().tm_yday)
-    payload['Hour'] = str(datetime.hour)
-    payload['Minute'] = str(datetime.minute)
-    payload['Second'] = str(datetime.second)
-
-    payload['Geographic Geocentric Latitude'] = lat
-    payload['Longitude'] = lon
-
-    print(payload)
-
-    response = requests.post(ccmc_tsyg_url, data=payload)
+class BadDirection(Exception):
+    """Tsyganenko Model Directionality Error"""
+
+    def __init__(self, message, errors):
+        super(BadDirection, self).__init__(message)
+        self.errors = errors
 
+
+def _check_direction(lat, direction):
+    if direction == 'North-South' and np.any(np.asarray(lat) < 0):
+        raise BadDirection('Direction Wrong', 'Lat < 0')
+    if direction == 'South-North' and np.any(np.asarray(lat) > 0):
+        raise BadDirection('Direction Wrong', 'Lat > 0')
+
+
+def _ccmc_payload(datetime, lat, lon, SW_dyn_press, SW_vel, IMF_By, IMF_Bz, DST, direction):
+    """Form fields of one CCMC T01 request"""
+    return {'ts_version': '01',
+            'Year': str(datetime.year),
+            'Day': str(datetime.timetuple().tm_yday),
+            'Hour': str(datetime.hour),
+            'Minute': str(datetime.minute),
+            'Second': str(datetime.second),
+            'SW dynamic pressure': str(SW_dyn_press),
+            'SW velocity': str(SW_vel),
+            'IMF By': str(IMF_By),
+            'IMF Bz': str(IMF_Bz),
+            'Dst': str(DST),
+            'DIR': '-1' if direction == 'South-North' else '1',  # 1:N->S, -1:S->N
+            'Geographic Geocentric Latitude': str(lat),
+            'Longitude': str(lon),
+            'Xgsm': '1',
+            'Ygsm': '1',
+            'Zgsm': '1'}
+
+
+def _parse_ccmc(text):
+    """Conjugate point out of a CCMC results page, all zeros and not closed if the trace has none.
+    None if the page has no T01 results to read (an error or maintenance page, a changed layout)"""
+    try:
+        model_results_html = next(line for line in text.splitlines() if 'T01 Run Results' in line).split('<br />')
+    except StopIteration:
+        return None
     try:
-        model_results_html = next(line for line in response.iter_lines(
-        ) if b'T01 Run Results' in line).decode('utf-8').split('<br />')
         conjugate_point_raw = next(model_results_html[i - 1:i + 5] for i in range(
             len(model_results_html)) if 'Conjugate point:' in model_results_html[i])
-    except StopIteration as err:
+    except StopIteration:
         conjugate_point = {'geo_lat': 0.0,
                            'geo_lon': 0.0,
                            'dpl_lat': 0.0,
                            'dpl_lon': 0.0}
         conjugate_point['closed'] = False
-    else:
-        conjugate_point = {'geo_lat': float(conjugate_point_raw[2][conjugate_point_raw[2].find(':') + 1:].lstrip(' ')),
-                           'geo_lon': float(conjugate_point_raw[3][conjugate_point_raw[3].find(':') + 1:].lstrip(' ')),
-                           'dpl_lat': float(conjugate_point_raw[4][conjugate_point_raw[4].find(':') + 1:].lstrip(' ')),
-                           'dpl_lon': float(conjugate_point_raw[5][conjugate_point_raw[5].find(':') + 1:].lstrip(' '))}
-        conjugate_point['closed'] = True
-    finally:
         return conjugate_point
+    try:
+        conjugate_point = dict((key, float(conjugate_point_raw[i][conjugate_point_raw[i].find(':') + 1:].lstrip(' ')))
+                               for i, key in zip(range(2, 6), conjugate_fields))
+    except (IndexError, ValueError):
+        return None
+    conjugate_point['closed'] = True
+    return conjugate_point
+
+
+def get_ccmc_tsyg_conj(datetime, lat, lon, SW_dyn_press=1, SW_vel=450, IMF_By=0, IMF_Bz=0, DST=1, direction='North-South'):
+    """Determine the conjugate location points for a point on earth
+
+    Args:
+        datetime (datetime): Time of the trace
+        lat (float): Geographic geocentric latitude
+        lon (float): Geographic longitude
+        SW_dyn_press (int, optional): Solar wind dynamic pressure (nPa)
+        SW_vel (int, optional): Solar wind velocity (km/s)
+        IMF_By (int, optional): IMF By GSM (nT)
+        IMF_Bz (int, optional): IMF Bz GSM (nT)
+        DST (int, optional): Dst index (nT)
+        direction (str, optional): 'North-South' or 'South-North'
+
+    Returns:
+        Dict: 'geo_lat', 'geo_lon', 'dpl_lat', 'dpl_lon' of the conjugate point and 'closed'
+        (False, with zeros, if the field line doesn't come back down)
+    """
+    _check_direction(lat, direction)
+    response = session().post(ccmc_tsyg_url, data=_ccmc_payload(datetime, lat, lon, SW_dyn_press, SW_vel, IMF_By, IMF_Bz, DST, direction),
+                              timeout=ccmc_timeout)
+    conjugate_point = _parse_ccmc(response.text)
+    if conjugate_point is None:
+        conjugate_point = dict(dict.fromkeys(conjugate_fields, 0.0), closed=False)
+    return conjugate_point
+
+
+class ConjugateMemo(object):
+    """Persistent SQLite memo of CCMC conjugate points, keyed on the quantized request"""
+
+    def __init__(self, path=None):
+        self.path = ccmc_memo_path if path is None else path
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS conj (key TEXT PRIMARY KEY, geo_lat REAL, geo_lon REAL, '
+                                'dpl_lat REAL, dpl_lon REAL, closed INTEGER)')
+
+    def get(self, keys):
+        """Stored points for whichever of keys are known, as {key: point dict}"""
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.connection.execute('SELECT key, {} FROM conj WHERE key IN ({})'.format(', '.join(conjugate_fields + ['closed']),
+                                                                                               ', '.join('?' * len(chunk))), chunk)
+            for row in rows:
+                found[row[0]] = dict(zip(conjugate_fields, row[1:5]), closed=bool(row[5]))
+        return found
+
+    def put(self, points):
+        """Store {key: point dict}"""
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO conj VALUES (?, ?, ?, ?, ?, ?)',
+                                        [(key,) + tuple(point[field] for field in conjugate_fields) + (int(point['closed']),)
+                                         for key, point in points.items()])
+
+    def close(self):
+        self.connection.close()
+
+
+def _quantize(values, step):
+    """Round values to a multiple of step, snapping the float noise off the result"""
+    decimals = max(0, -int(np.floor(np.log10(step)))) + 1
+    # + 0.0 folds -0.0 into 0.0
+    return np.round(np.round(np.asarray(values, dtype=np.float64) / step) * step, decimals) + 0.0
+
+
+def get_ccmc_tsyg_conj_batch(times, lat, lon, SW_dyn_press=1, SW_vel=450, IMF_By=0, IMF_Bz=0, DST=1, direction='North-South',
+                             workers=4, memo=True, precision=None):
+    """Conjugate points for many (time, location, solar wind) inputs at once
+
+    Every argument but direction, workers, memo and precision may be a scalar or an array, and
+    they are broadcast against each other. Inputs are quantized (see ccmc_precision) so nearby
+    requests share an answer. Answers already in the memo are served from it and only the
+    distinct misses go to CCMC, at most workers at a time. Requests that fail, or come back
+    without T01 results (an error page), are NaN and aren't memoized, so a later call retries them.
+
+    Args:
+        times (array-like): Times of the traces
+        lat (array-like): Geographic geocentric latitudes
+        lon (array-like): Geographic longitudes
+        SW_dyn_press, SW_vel, IMF_By, IMF_Bz, DST (array-like, optional): Model inputs, as in get_ccmc_tsyg_conj
+        direction (str, optional): 'North-South' or 'South-North'
+        workers (int, optional): Requests in flight at once
+        memo (bool, str or ConjugateMemo, optional): True (default) uses the memo at ccmc_memo_path,
+            a str is the path of another one, False/None doesn't memoize
+        precision (dict, optional): Overrides for ccmc_precision
+
+    Returns:
+        DataFrame: One row per input with the quantized inputs ('datetime', 'lat', 'lon' and the
+        model inputs) and 'geo_lat', 'geo_lon', 'dpl_lat', 'dpl_lon', 'closed'
+    """
+    _check_direction(lat, direction)
+    steps = dict(ccmc_precision, **(precision or {}))
+    times = np.asarray(pd.to_datetime(np.atleast_1d(times)), dtype='M8[ns]')
+    inputs = dict(zip(['lat', 'lon'] + ccmc_inputs, np.broadcast_arrays(times, lat, lon, SW_dyn_press, SW_vel, IMF_By, IMF_Bz, DST)[1:]))
+    times = np.broadcast_to(times, inputs['lat'].shape)
+    df_out = pd.DataFrame({'datetime': pd.DatetimeIndex(times.ravel()).round(steps['datetime']).to_numpy()})
+    for name, values in inputs.items():
+        df_out[name] = _quantize(values.ravel(), steps[name])
+    if df_out.empty:
+        for column in conjugate_fields:
+            df_out[column] = np.array([], dtype=np.float64)
+        df_out['closed'] = np.array([], dtype=bool)
+        return df_out
+
+    columns = ['datetime', 'lat', 'lon'] + ccmc_inputs
+    keys = (df_out['datetime'].dt.strftime('%Y-%m-%dT%H:%M:%S') + '|' +
+            df_out[columns[1:]].astype(str).agg('|'.join, axis=1) + '|' + direction).to_numpy()
+    unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    opened = memo is True or isinstance(memo, str)
+    memo = ConjugateMemo() if memo is True else ConjugateMemo(memo) if opened else (memo or None)
+    known = memo.get(unique_keys) if memo is not None else {}
+    misses = [(key, row) for key, row in zip(unique_keys, first) if key not in known]
+
+    def request(miss):
+        row = df_out.iloc[miss[1]]
+        payload = _ccmc_payload(row['datetime'].to_pydatetime(), row['lat'], row['lon'], *[row[name] for name in ccmc_inputs], direction)
+        try:
+            response = session().post(ccmc_tsyg_url, data=payload, timeout=ccmc_timeout)
+            response.raise_for_status()
+        except requests.RequestException as err:
+            print('CCMC request failed for', miss[0], ':', err)
+            return None
+        point = _parse_ccmc(response.text)
+        if point is None:
+            print('CCMC gave no T01 results for', miss[0])
+        return point
+
+    fetched = {}
+    if misses:
+        with cf.ThreadPoolExecutor(max_workers=workers) as pool:
+            for (key, _), point in zip(misses, pool.map(request, misses)):
+                if point is not None:
+                    fetched[key] = point
+        if memo is not None and fetched:
+            memo.put(fetched)
+    if opened:
+        memo.close()
+    known.update(fetched)
+
+    failed = dict(dict.fromkeys(conjugate_fields, np.nan), closed=False)
+    points = pd.DataFrame([known.get(key, failed) for key in unique_keys], columns=conjugate_fields + ['closed'])
+    for column in points.columns:
+        df_out[column] = points[column].to_numpy()[inverse]
+    return df_out
 
 
 def get_wind_sw_params(datetime, offline=False):
@@ -193,6 +342,218 @@ def get_omni_sw_params(datetime, offline=False):
     return sw_params
 
 
+# Per-day cache of the CDAWeb data behind the *_range solar wind functions (see _cdas_days)
+sw_cache_path = os.path.expanduser('~/.cache/mist/solar_wind')
+# Days fetched sooner than this after they ended may still be revised (OMNI HRO and WIND stay
+# provisional for weeks), so their cached copies are fetched again once older than sw_cache_recheck
+sw_cache_settle = pd.Timedelta(days=60)
+sw_cache_recheck = pd.Timedelta(days=1)
+
+# (dataset, variables) the *_range functions read
+omni_minutely = ('OMNI_HRO_1MIN', ['BZ_GSM', 'BY_GSM', 'flow_speed', 'Pressure', 'Vx', 'Vy', 'Vz'])
+omni_hourly = ('OMNI2_H0_MRG1HR', ['DST1800'])
+wind_mfi = ('WI_H0_MFI', ['BGSM'])
+wind_plasma = ('WI_PM_3DP', ['P_DENS', 'P_VELS'])
+
+
+def _cdas_frame(data):
+    """cdas.get_data's dict as a frame, its time key renamed to 'datetime'"""
+    time_key = next(key for key, values in data.items() if len(values) and isinstance(values[0], (dt.datetime, np.datetime64)))
+    df_in = pd.DataFrame({'datetime': pd.to_datetime(list(data[time_key])).to_numpy(dtype='M8[ns]')})
+    for key, values in data.items():
+        if key != time_key:
+            values = np.asarray(values)
+            if values.ndim == 1 and values.dtype.kind in 'iuf':
+                df_in[key] = values
+    return df_in
+
+
+def _cdas_get_day(dataset, variables, day):
+    """cdas.get_data for one day, past ai.cdas' own file cache (which never notices a file being revised)"""
+    cache, directory = cdas.AI_CDAS_CACHE, cdas.AI_CDAS_CACHE_DIR
+    cdas.set_cache(False)
+    try:
+        return cdas.get_data('sp_phys', dataset, day.to_pydatetime(), (day + pd.Timedelta(days=1, microseconds=-1)).to_pydatetime(),
+                             variables, progress=False)
+    finally:
+        cdas.set_cache(cache, directory=directory)
+
+
+def _cdas_days(dataset, variables, start, end):
+    """One dataset's data for every day touching [start, end], each day fetched from CDAWeb once
+
+    Days that are fully in the past are kept in a column store under sw_cache_path, along with
+    when they were fetched, and served from disk (so they work offline). A day fetched less than
+    sw_cache_settle after it ended may still be provisional, so it's fetched again once its copy
+    is older than sw_cache_recheck (falling back on the copy if CDAWeb can't be reached). Days
+    CDAWeb has no data for are skipped. Any other error is raised.
+    """
+    frames = []
+    # days are UTC days, so 'now' (and the fetched stamp) is naive UTC as well
+    now = pd.Timestamp.now(tz='UTC').tz_localize(None)
+    for day in pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()):
+        day_end = day + pd.Timedelta(days=1)
+        path = os.path.join(sw_cache_path, dataset, '{:%Y}'.format(day), '{:%Y%m%d}'.format(day))
+        meta = read_meta(path)
+        if meta is not None:
+            # copies from before fetch times were kept count as provisional
+            fetched = pd.Timestamp(meta['meta'].get('fetched', 0))
+            if fetched - day_end >= sw_cache_settle or now - fetched < sw_cache_recheck:
+                frames.append(read_frame(path))
+                continue
+        try:
+            data = _cdas_get_day(dataset, variables, day)
+        except cdas.NoDataError:
+            print(dataset, 'has no data for', day.date())
+            continue
+        except requests.RequestException as err:
+            if meta is None:
+                raise
+            print(dataset, 'could not be refreshed for', day.date(), ', using the cached copy:', err)
+            frames.append(read_frame(path))
+            continue
+        df_day = _cdas_frame(data)
+        if day_end < now:
+            write_frame(path, df_day, meta={'dataset': dataset, 'variables': variables, 'fetched': now.isoformat()})
+        frames.append(df_day)
+    if not frames:
+        return pd.DataFrame({'datetime': np.array([], dtype='M8[ns]')})
+    return pd.concat(frames, ignore_index=True).drop_duplicates('datetime').sort_values('datetime', ignore_index=True)
+
+
+def _windows(sample_times, values, times, before, after, keep=None):
+    """Every sample in [time - before, time + after] for each time, as an (n_times, widest) array
+
+    Samples that don't pass keep (or aren't in a time's window) are NaN, ready for nan-reductions.
+    """
+    lo = np.searchsorted(sample_times, times - before, side='left')
+    hi = np.searchsorted(sample_times, times + after, side='right')
+    width = max(int((hi - lo).max(initial=0)), 1)
+    index = lo[:, None] + np.arange(width)
+    inside = index < hi[:, None]
+    values = np.asarray(values, dtype=np.float64)
+    if keep is not None:
+        values = np.where(keep, values, np.nan)
+    return np.where(inside, np.r_[values, np.nan][np.minimum(index, len(values))], np.nan)
+
+
+def _nearest(sample_times, values, times, tolerance):
+    """Value of the sample nearest each time, NaN if there's none within tolerance"""
+    if len(sample_times) == 0:
+        return np.full(len(times), np.nan)
+    right = np.searchsorted(sample_times, times).clip(1, len(sample_times) - 1) if len(sample_times) > 1 else np.zeros(len(times), dtype=int)
+    left = (right - 1).clip(0)
+    pick = np.where(np.abs(sample_times[left] - times) <= np.abs(sample_times[right] - times), left, right)
+    found = np.asarray(values, dtype=np.float64)[pick]
+    return np.where(np.abs(sample_times[pick] - times) <= tolerance, found, np.nan)
+
+
+def _minutes(times):
+    """Times as datetime64[ns], rounded (floored) to the minute"""
+    return np.asarray(pd.to_datetime(np.atleast_1d(times)), dtype='M8[ns]').astype('M8[m]').astype('M8[ns]')
+
+
+def _nanmedian(windows):
+    with np.errstate(all='ignore'):
+        return np.nanmedian(windows, axis=1) if windows.size else np.full(len(windows), np.nan)
+
+
+def _nanmean(windows):
+    with np.errstate(all='ignore'):
+        return np.nanmean(windows, axis=1) if windows.size else np.full(len(windows), np.nan)
+
+
+def _dst(times):
+    """Hourly DST nearest each time (within 2 hours)"""
+    hours = np.timedelta64(2, 'h')
+    df_dst = _cdas_days(*omni_hourly, times.min() - hours, times.max() + hours)
+    return _nearest(df_dst['datetime'].to_numpy(), df_dst.get('1-H_DST', np.full(len(df_dst), np.nan)), times, hours)
+
+
+def _offline_keys(df_out, vswgse):
+    """Rename to the T01 model input names (the offline=True layout)"""
+    df_out = df_out.rename(columns={'IMF_Bz': 'bzimf', 'IMF_By': 'byimf', 'DST': 'dst', 'SW_dyn_press': 'pdyn'})
+    df_out['vswgse'] = list(np.column_stack(vswgse))
+    return df_out[['bzimf', 'byimf', 'dst', 'pdyn', 'vswgse']]
+
+
+def get_omni_sw_params_range(times, offline=False):
+    """get_omni_sw_params for a whole array of times, fetching each day of OMNI data only once
+
+    Each time is floored to the minute. IMF_By, IMF_Bz and SW_dyn_press are medians over the
+    surrounding hour of 1 minute OMNI (fill values dropped), SW_vel is the valid sample nearest the
+    time (get_omni_sw_params takes the first one in the hour) and DST the nearest hourly value.
+
+    Args:
+        times (array-like): Datetimes to get SW parameters for
+        offline (bool, optional): Use the T01 model input names, as get_omni_sw_params does
+
+    Returns:
+        DataFrame: SW parameters, one row per time (indexed by the floored times):
+            IMF_By, IMF_Bz, SW_dyn_press, SW_vel, DST (or byimf, bzimf, pdyn, dst, vswgse if offline)
+    """
+    times = _minutes(times)
+    half_hour = np.timedelta64(30, 'm')
+    df_min = _cdas_days(*omni_minutely, times.min() - half_hour, times.max() + half_hour)
+    sample_times = df_min['datetime'].to_numpy()
+    column = lambda key: df_min[key].to_numpy(dtype=np.float64) if key in df_min.columns else np.full(len(df_min), np.nan)
+    speed = column('FLOW_SPEED,_GSE')
+
+    def median(key, limit):
+        values = column(key)
+        return _nanmedian(_windows(sample_times, values, times, half_hour, half_hour, keep=values < limit))
+
+    df_out = pd.DataFrame({'IMF_By': median('BY,_GSM', 90),
+                           'IMF_Bz': median('BZ,_GSM', 90),
+                           'SW_dyn_press': median('FLOW_PRESSURE', 90),
+                           'SW_vel': _nearest(sample_times[speed < 2e3], speed[speed < 2e3], times, half_hour),
+                           'DST': _dst(times)}, index=pd.DatetimeIndex(times, name='datetime'))
+    if offline:
+        vswgse = [median(key, 2e3) for key in ('VX_VELOCITY,_GSE', 'VY_VELOCITY,_GSE', 'VZ_VELOCITY,_GSE')]
+        df_out = _offline_keys(df_out.drop(columns='SW_vel'), vswgse)
+    return df_out
+
+
+def get_wind_sw_params_range(times, offline=False):
+    """get_wind_sw_params for a whole array of times, fetching each day of WIND data only once
+
+    Each time is floored to the minute. IMF_By/IMF_Bz are the first MFI sample in the following 2
+    minutes, SW_vel and SW_dyn_press come from the 3DP plasma samples of the following minute and
+    DST is the nearest hourly OMNI value.
+
+    Args:
+        times (array-like): Datetimes to get SW parameters for
+        offline (bool, optional): Use the T01 model input names, as get_wind_sw_params does
+
+    Returns:
+        DataFrame: SW parameters, one row per time (indexed by the floored times):
+            IMF_By, IMF_Bz, SW_vel, SW_dyn_press, DST (or byimf, bzimf, pdyn, dst, vswgse if offline)
+    """
+    times = _minutes(times)
+    zero, one, two = [np.timedelta64(minutes, 'm') for minutes in (0, 1, 2)]
+    df_mfi = _cdas_days(*wind_mfi, times.min(), times.max() + two)
+    df_plm = _cdas_days(*wind_plasma, times.min(), times.max() + one)
+    mfi_times = df_mfi['datetime'].to_numpy()
+    plm_times = df_plm['datetime'].to_numpy()
+    mfi = lambda key: df_mfi[key].to_numpy(dtype=np.float64) if key in df_mfi.columns else np.full(len(df_mfi), np.nan)
+    plm = lambda key: df_plm[key].to_numpy(dtype=np.float64) if key in df_plm.columns else np.full(len(df_plm), np.nan)
+
+    first = lambda values: _windows(mfi_times, values, times, zero, two)[:, 0]
+    vx, density = plm('VXGSE_PROTN_S/C'), plm('DENS_PROTN_S/C')
+    window = lambda values, keep: _windows(plm_times, values, times, zero, one, keep=keep)
+    with np.errstate(invalid='ignore'):
+        df_out = pd.DataFrame({'IMF_By': first(mfi('BY_(GSM)')),
+                               'IMF_Bz': first(mfi('BZ_(GSM)')),
+                               'SW_vel': _nanmedian(window(vx, np.nan_to_num(vx) < 50)),
+                               'SW_dyn_press': proton_mass * 1e3 * _nanmean(window(density, density < 300)) * 1e3 *
+                                               (_nanmean(window(vx, vx < -50)) * 1e3) ** 2 * 1e9,
+                               'DST': _dst(times)}, index=pd.DatetimeIndex(times, name='datetime'))
+    if offline:
+        vswgse = [df_out['SW_vel'].to_numpy()] + [_nanmedian(window(plm(key), None)) for key in ('VYGSE_PROTN_S/C', 'VZGSE_PROTN_S/C')]
+        df_out = _offline_keys(df_out.drop(columns='SW_vel'), vswgse)
+    return df_out
+
+
 if __name__ == '__main__':
     test_date = dt.datetime(2016, 6, 1, 6, 42)
     aal_lat = [-83.58, -84.50, -84.42, -84.81, -83.32, -81.95]
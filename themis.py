@@ -1,55 +1,290 @@
-import wget
-from pathlib import Path
+import os
+import bisect
+import contextlib
+import threading
+import collections
 from datetime import datetime
 from spacepy import pycdf
+import numpy as np
 import pandas as pd
+from fetch import fetch_many
+from timestamps import from_epoch
 
+datapath_local = '/data/themis'
+datapath_remote = 'http://themis.ssl.berkeley.edu/data/themis'
 
+# Open CDF handles kept around between calls, least recently used are closed first
+handle_cache_size = 8
+
+
+# The CDF library keeps global state, so using it from two threads at once crashes the process,
+# even on different files. Every pycdf call in this module (open, read, close) holds this lock
+_cdf_lock = threading.RLock()
+
+# One lock per local file, held while it is checked and downloaded, so two threads never write
+# the same .part file. The second one waits and then finds the first one's download in place
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def _path_lock(path):
+    with _path_locks_guard:
+        return _path_locks.setdefault(str(path), threading.Lock())
+
+
+class _HandleCache(object):
+    """Small LRU of open pycdf.CDF handles, closing each one as it is evicted
+
+    Callers hold _cdf_lock for as long as they use a handle (see _get_themis_cdf), and eviction
+    happens under the same lock, so a handle is never closed while another thread is reading it.
+    """
+
+    def __init__(self):
+        self._handles = collections.OrderedDict()
+
+    def get(self, path, open_missing=True):
+        """The handle for path, opened if need be (None if it isn't open and open_missing is False)"""
+        path = str(path)
+        with _cdf_lock:
+            if path in self._handles:
+                self._handles.move_to_end(path)
+                return self._handles[path]
+            if not open_missing:
+                return None
+            cdf = pycdf.CDF(path)
+            self._handles[path] = cdf
+            while len(self._handles) > max(1, handle_cache_size):
+                _, evicted = self._handles.popitem(last=False)
+                evicted.close()
+            return cdf
+
+    def discard(self, path):
+        """Close and forget one handle (e.g. before the file is replaced)"""
+        with _cdf_lock:
+            cdf = self._handles.pop(str(path), None)
+            if cdf is not None:
+                cdf.close()
+
+    def clear(self):
+        with _cdf_lock:
+            while self._handles:
+                self._handles.popitem()[1].close()
+
+
+_handles = _HandleCache()
+
+
+# Variables a cached file must have before it is trusted, per dataset ({vehicle} is filled in),
+# each with as many records as the first (its epoch). Datasets not listed only have to open
+expected_variables = {'mom': ['{vehicle}_peim_time', '{vehicle}_peim_density', '{vehicle}_peim_ptot',
+                              '{vehicle}_peim_velocity_gse', '{vehicle}_peim_velocity_gsm'],
+                      'fit': ['{vehicle}_fgs_time', '{vehicle}_fgs_gse', '{vehicle}_fgs_gsm']}
+
+
+def _local_path(dt, vehicle, dataset):
+    return '{root}/{vehicle}/l2/{dataset}/{vehicle}_l2_{dataset}_{date}_v01.cdf'.format(root=datapath_local, vehicle=vehicle, dataset=dataset,
+                                                                                        date=dt.strftime('%Y%m%d'))
+
+
+def _remote_url(dt, vehicle, dataset, base_url=None):
+    return '{root}/{vehicle}/l2/{dataset}/{year}/{vehicle}_l2_{dataset}_{date}_v01.cdf'.format(root=datapath_remote if base_url is None else base_url,
+                                                                                             vehicle=vehicle, dataset=dataset, year=dt.year,
+                                                                                             date=dt.strftime('%Y%m%d'))
+
+
+def _valid_cdf(path, vehicle, dataset):
+    """True if path is a CDF that opens and has the dataset's expected variables, all as long as its epoch"""
+    names = [name.format(vehicle=vehicle) for name in expected_variables.get(dataset, [])]
+    try:
+        with _cdf_lock, pycdf.CDF(path) as cdf:
+            if not all(name in cdf for name in names):
+                return False
+            return all(len(cdf[name]) == len(cdf[names[0]]) for name in names)
+    except Exception:
+        return False
+
+
+def fetch_cdfs(start, end=None, vehicles=('the',), datasets=('mom', 'fit'), workers=8, base_url=None):
+    """Make sure the daily CDFs for some days x probes x datasets are in the local cache
+
+    Cached files are checked (they open and have the expected_variables) before they are trusted,
+    and bad ones are downloaded again. Downloads run concurrently over one pooled session, go to a
+    temporary .part file that is only renamed into place once complete, and pick up where they
+    left off if an earlier run was interrupted. A download that doesn't check out is removed.
+    Each file is locked while it is checked and fetched, so a call that asks for a file another
+    thread is already downloading waits for that download and uses it.
+
+    Args:
+        start (datetime): First day
+        end (datetime, optional): Last day (inclusive). If None (default) then end = start
+        vehicles (list, optional): Probes ('tha' ... 'the')
+        datasets (list, optional): Datasets ('mom', 'fit', 'sst', ...)
+        workers (int, optional): Downloads in flight at once
+        base_url (str, optional): Server root, datapath_remote by default
+
+    Returns:
+        dict: Local path per (day, vehicle, dataset), None where the file couldn't be had
+    """
+    end = start if end is None else end
+    keys = [(day.to_pydatetime(), vehicle, dataset)
+            for day in pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize())
+            for vehicle in vehicles for dataset in datasets]
+    with contextlib.ExitStack() as stack:
+        # always taken in the same order, so two overlapping calls can't deadlock
+        for path in sorted(set(_local_path(*key) for key in keys)):
+            stack.enter_context(_path_lock(path))
+        return _fetch_locked(keys, workers, base_url)
+
+
+def _fetch_locked(keys, workers, base_url):
+    """fetch_cdfs for keys, with their path locks held"""
+    paths = {}
+    jobs = []
+    for key in keys:
+        day, vehicle, dataset = key
+        path = _local_path(day, vehicle, dataset)
+        paths[key] = path
+        if os.path.isfile(path) and _valid_cdf(path, vehicle, dataset):
+            continue
+        if os.path.isfile(path):
+            print('Cached file failed its check, downloading again:', path)
+            _handles.discard(path)
+            os.remove(path)
+        jobs.append((key, _remote_url(day, vehicle, dataset, base_url), path))
+
+    results = fetch_many([(url, path) for _, url, path in jobs], workers, conditional=False, resume=True)
+    for (key, url, path), fetched in zip(jobs, results):
+        if fetched and _valid_cdf(path, key[1], key[2]):
+            continue
+        if fetched:
+            print('Downloaded file failed its check, discarding:', url)
+            os.remove(path)
+        else:
+            print('Could not get cdf for', '{}_{}_{},'.format(key[1], key[2], key[0].strftime('%Y%m%d')), 'skipping...')
+        paths[key] = None
+    return paths
+
+
+@contextlib.contextmanager
 def _get_themis_cdf(dt=datetime(2016, 5, 6), vehicle='the', dataset='sst'):
+    """Open CDF for one probe/dataset/day, for a with block that holds _cdf_lock throughout
 
-    date_string = dt.strftime('%Y%m%d')
-    file_path = '/data/themis/{vehicle}/l2/{dataset}/{vehicle}_l2_{dataset}_{date}_v01.cdf'.format(vehicle=vehicle, dataset=dataset, date=date_string)
-    print('Checking for file:', file_path)
-    if not Path(file_path).is_file():
-        # does not exist
-        if not Path(file_path).parent.is_dir():
-            # directory missing, create it
-            try:
-                Path(file_path).parent.mkdir(parents=True)
-            except Exception:
-                pass
-        try:
-            url = 'http://themis.ssl.berkeley.edu/data/themis/{vehicle}/l2/{dataset}/{year}/{vehicle}_l2_{dataset}_{date}_v01.cdf'.format(vehicle=vehicle,
-                                                                                                                                          dataset=dataset,
-                                                                                                                                          date=date_string,
-                                                                                                                                          year=dt.year)
-            print('No local copy, downloading ', url)
-            wget.download(url, file_path)
-            return pycdf.CDF(file_path)
-        except Exception:
-            print('Could not get cdf for', '{}_{}_{},'.format(vehicle, dataset, date_string), 'skipping...')
-            return None
-    else:
-        # exists
-        return pycdf.CDF(file_path)
+    The file is downloaded first if need be. Yields None if it can't be had.
+    """
+    with _cdf_lock:
+        cdf = _handles.get(_local_path(dt, vehicle, dataset), open_missing=False)
+        if cdf is not None:
+            yield cdf
+            return
+    # download without holding the lock, fetch_cdfs takes it to check each file
+    path = fetch_cdfs(dt, vehicles=[vehicle], datasets=[dataset], workers=1)[(pd.Timestamp(dt).normalize().to_pydatetime(), vehicle, dataset)]
+    with _cdf_lock:
+        yield None if path is None else _handles.get(path)
+
+
+class _Records(object):
+    """Sequence view of a CDF variable that reads one record per lookup, so bisect touches only log(n) records"""
+
+    def __init__(self, variable):
+        self.variable = variable
+
+    def __len__(self):
+        return len(self.variable)
+
+    def __getitem__(self, i):
+        return self.variable[i]
+
+
+def _record_range(cdf, time_var, start=None, end=None):
+    """Records of a time ordered (Unix seconds) epoch variable that fall in [start, end)"""
+    records = _Records(cdf[time_var])
+    first = 0 if start is None else bisect.bisect_left(records, pd.Timestamp(start).timestamp())
+    last = len(records) if end is None else bisect.bisect_left(records, pd.Timestamp(end).timestamp(), lo=first)
+    return slice(first, last)
 
 
-def get_themis_dataframes(dt, vehicle='the', coord='gse'):
+def read_variables(cdf, time_var, variables, start=None, end=None):
+    """Read the [start, end) records of some variables that share an epoch variable
+
+    Hold _cdf_lock around the call if other threads may be using pycdf (see _get_themis_cdf).
+
+    Args:
+        cdf (pycdf.CDF): Open CDF
+        time_var (str): Epoch variable, Unix seconds
+        variables (dict): Output column name (or list of names for vector variables) per CDF variable
+        start (datetime, optional): First time to read. None reads from the start of the file
+        end (datetime, optional): Read up to this time. None reads to the end of the file
+
+    Returns:
+        DataFrame: The requested columns on a single DatetimeIndex
+    """
+    records = _record_range(cdf, time_var, start, end)
+    index = pd.DatetimeIndex(from_epoch(cdf[time_var][records], 'unix', 's'))
+    data = {}
+    for variable, columns in variables.items():
+        values = np.asarray(cdf[variable][records])
+        if isinstance(columns, str):
+            data[columns] = values
+        else:
+            for i, column in enumerate(columns):
+                data[column] = values[:, i]
+    return pd.DataFrame(data, index=index)
+
+
+def _read_days(days, vehicle, dataset, time_var, variables, start, end):
+    """read_variables over the daily files of some days"""
+    frames = []
+    for day in days:
+        with _get_themis_cdf(day.to_pydatetime(), vehicle, dataset) as cdf:
+            if cdf is not None:
+                frames.append(read_variables(cdf, time_var, variables, start, end))
+    if not frames:
+        columns = [name for names in variables.values() for name in ([names] if isinstance(names, str) else names)]
+        return pd.DataFrame(np.empty((0, len(columns)), dtype=np.float64), columns=columns, index=pd.DatetimeIndex([], dtype='M8[ns]'))
+    return pd.concat(frames) if len(frames) > 1 else frames[0]
+
+
+def get_themis_dataframes(dt=None, vehicle='the', coord='gse', start=None, end=None):
+    """Ion moments and fluxgate field for a day, or just the [start, end) part of one or more days
+
+    Only the records inside [start, end) are read. Each dataset is read once and its frames share
+    one DatetimeIndex.
+
+    Args:
+        dt (datetime, optional): Day to read in full. Ignored when start is given
+        vehicle (str, optional): Probe ('tha' ... 'the')
+        coord (str, optional): 'gse' or 'gsm'
+        start (datetime, optional): First time to read
+        end (datetime, optional): Read up to this time, the end of start's day by default
+
+    Returns:
+        tuple: DataFrames of ion 'density', ion 'pressure', ion 'Vx', 'Vy', 'Vz' and fluxgate 'Bx', 'By', 'Bz'.
+        Empty (float64 columns) where there's no data
+
+    Raises:
+        ValueError: Neither dt nor start is given
+    """
 
     assert (coord.lower() == 'gse') or (coord.lower() == 'gsm')
+    if dt is None and start is None:
+        raise ValueError('get_themis_dataframes needs a day (dt) or a start time')
+    if start is None:
+        # the whole file, whatever it holds
+        days = [pd.Timestamp(dt)]
+    else:
+        start = pd.Timestamp(start)
+        end = start.normalize() + pd.Timedelta(days=1) if end is None else pd.Timestamp(end)
+        days = pd.date_range(start.normalize(), end - pd.Timedelta(1, 'ns'), freq='D')
 
     # Collect the moments data first (ions)
-    mom_cdf = _get_themis_cdf(dt, vehicle, 'mom')
-    dti = pd.to_datetime(mom_cdf['{}_peim_time'.format(vehicle)][:], unit='s')
-    df_ion_density = pd.DataFrame(data=mom_cdf['{}_peim_density'.format(vehicle)][:], index=dti, columns=['density'])
-    df_ion_pressure = pd.DataFrame(data=mom_cdf['{}_peim_ptot'.format(vehicle)][:], index=dti, columns=['pressure'])
-    df_ion_velocity = pd.DataFrame(data=mom_cdf['{}_peim_velocity_{}'.format(vehicle, coord)][:], index=dti, columns=['Vx', 'Vy', 'Vz'])
-
-    fit_cdf = _get_themis_cdf(dt, vehicle, 'fit')
-    dti = pd.to_datetime(fit_cdf['{}_fgs_time'.format(vehicle)][:], unit='s')
-    df_fgs = pd.DataFrame(data=fit_cdf['{}_fgs_{}'.format(vehicle, coord)][:], index=dti, columns=['Bx', 'By', 'Bz'])
+    df_mom = _read_days(days, vehicle, 'mom', '{}_peim_time'.format(vehicle),
+                        {'{}_peim_density'.format(vehicle): 'density',
+                         '{}_peim_ptot'.format(vehicle): 'pressure',
+                         '{}_peim_velocity_{}'.format(vehicle, coord): ['Vx', 'Vy', 'Vz']}, start, end)
+    df_fgs = _read_days(days, vehicle, 'fit', '{}_fgs_time'.format(vehicle),
+                        {'{}_fgs_{}'.format(vehicle, coord): ['Bx', 'By', 'Bz']}, start, end)
 
-    return df_ion_density, df_ion_pressure, df_ion_velocity, df_fgs
+    return df_mom[['density']], df_mom[['pressure']], df_mom[['Vx', 'Vy', 'Vz']], df_fgs
 
 
 if __name__ == '__main__':
@@ -0,0 +1,197 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Vectorized datetime64[ns] builders shared by the dataset readers. Everything here works on
+# whole arrays at once and never goes through Python datetime objects
+
+# Named epochs for from_epoch
+epochs = {'unix': np.datetime64('1970-01-01', 'ns'),
+          'mjd': np.datetime64('1858-11-17', 'ns'),
+          'j2000': np.datetime64('2000-01-01T12:00', 'ns')}
+
+# Nanoseconds per from_epoch unit
+units = {'D': 86400 * 10**9, 'h': 3600 * 10**9, 'm': 60 * 10**9, 's': 10**9, 'ms': 10**6, 'us': 10**3, 'ns': 1}
+
+# strptime directives the fixed width string parser understands, with their widths (%f takes
+# whatever digits are left, so it has to come last)
+_widths = {'Y': 4, 'm': 2, 'd': 2, 'H': 2, 'M': 2, 'S': 2, 'j': 3, 'f': None}
+
+
+def from_components(years, months, days, hours=0, minutes=0, seconds=0):
+    """Build datetime64[ns] from Y/M/D/h/m/s arrays arithmetically (no string parsing)
+
+    Args:
+        years, months, days (array-like): Integer date parts
+        hours, minutes (array-like, optional): Integer time parts
+        seconds (array-like, optional): Seconds, fractions allowed (rounded to the nearest ns)
+
+    Returns:
+        ndarray: datetime64[ns]
+    """
+    dates = ((np.asarray(years, dtype=np.int64) - 1970) * 12 + np.asarray(months, dtype=np.int64) - 1).astype('M8[M]').astype('M8[ns]')
+    nanoseconds = ((np.asarray(days, dtype=np.int64) - 1) * 86400 +
+                   np.asarray(hours, dtype=np.int64) * 3600 +
+                   np.asarray(minutes, dtype=np.int64) * 60) * 10**9 + np.rint(np.asarray(seconds, dtype=np.float64) * 1e9).astype(np.int64)
+    return dates + nanoseconds.astype('m8[ns]')
+
+
+def from_cadence(start, cadence, n):
+    """Timestamps for n evenly spaced samples from a file start time
+
+    Args:
+        start (datetime-like): Time of the first sample
+        cadence (timedelta, str or timedelta64): Sample spacing, e.g. '100ms'
+        n (int): Number of samples
+
+    Returns:
+        ndarray: datetime64[ns]
+    """
+    start = pd.Timestamp(start).as_unit('ns').value
+    step = pd.Timedelta(cadence).as_unit('ns').value
+    return np.arange(start, start + step * n, step, dtype=np.int64)[:n].view('M8[ns]')
+
+
+def from_epoch(values, epoch='unix', unit='s', resolution=None):
+    """Timestamps from numbers counted from an epoch (Unix seconds, MJD days, ...)
+
+    Fractions are split off before scaling, so float MJDs keep their full resolution. NaNs come
+    out as NaT.
+
+    Args:
+        values (array-like): Counts since the epoch
+        epoch (str or datetime-like, optional): 'unix', 'mjd', 'j2000' or any time
+        unit (str, optional): Unit of values, one of units ('D', 'h', 'm', 's', 'ms', 'us', 'ns')
+        resolution (str, optional): Round to this unit (e.g. 'us' for float MJDs, whose last digits
+            are float64 noise)
+
+    Returns:
+        ndarray: datetime64[ns]
+    """
+    origin = epochs[epoch] if isinstance(epoch, str) and epoch in epochs else np.datetime64(pd.Timestamp(epoch).to_datetime64(), 'ns')
+    scale = units[unit]
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu':
+        return origin + (values.astype(np.int64) * scale).astype('m8[ns]')
+    values = values.astype(np.float64)
+    missing = np.isnan(values)
+    whole = np.floor(np.where(missing, 0, values))
+    fraction = (np.where(missing, 0, values) - whole) * scale
+    if resolution is not None:
+        fraction = np.rint(fraction / units[resolution]) * units[resolution]
+    nanoseconds = whole.astype(np.int64) * scale + np.rint(fraction).astype(np.int64)
+    times = origin + nanoseconds.astype('m8[ns]')
+    times[missing] = np.datetime64('NaT')
+    return times
+
+
+def _tokens(format):
+    """Split a strptime format into (directive, literal) tokens, None if it isn't fixed width"""
+    tokens = []
+    for directive, literal in re.findall(r'%(.)|([^%]+)', format):
+        if directive and directive not in _widths:
+            return None
+        tokens.append((directive, literal))
+    if any(directive == 'f' for directive, _ in tokens[:-1]):
+        return None
+    return tokens
+
+
+def _iso_format(first):
+    """The strptime format a single ISO 8601 timestamp is written in, None if it's not a plain one"""
+    match = re.fullmatch(r'\d{4}-\d\d-\d\d(?:([T ])\d\d:\d\d(?::\d\d(\.\d+)?)?)?', first)
+    if match is None:
+        return None
+    format = '%Y-%m-%d'
+    if match.group(1):
+        format += match.group(1) + ('%H:%M:%S' if len(first) >= 19 else '%H:%M')
+    return format + ('.%f' if match.group(2) else '')
+
+
+def _parse_fixed(strings, format):
+    """Parse equal length ASCII strings as a byte matrix, None if any of them don't fit format"""
+    tokens = _tokens(format)
+    if tokens is None:
+        return None
+    strings = np.asarray(strings, dtype=object)
+    width = len(str(strings[0]))
+    fixed = sum(len(literal) if literal else _widths[directive] or 0 for directive, literal in tokens)
+    fraction = width - fixed if tokens[-1][0] == 'f' else 0
+    if width != fixed + fraction or (tokens[-1][0] == 'f' and not 0 < fraction <= 9):
+        return None
+    try:
+        if (np.fromiter(map(len, strings), dtype=np.int64, count=len(strings)) != width).any():
+            return None
+        raw = ''.join(strings.tolist()).encode('ascii')
+    except (TypeError, UnicodeEncodeError):
+        return None
+    # one row per character position, so each position is a contiguous run. Subtracting '0' wraps
+    # anything below it round to >= 208, so a single > 9 test finds every non digit
+    digits = np.ascontiguousarray(np.frombuffer(raw, dtype=np.uint8).reshape(len(strings), width).T) - np.uint8(ord('0'))
+
+    fields = {}
+    column = 0
+    for directive, literal in tokens:
+        if literal:
+            for offset, char in enumerate(literal.encode()):
+                if (digits[column + offset] != np.uint8((char - ord('0')) % 256)).any():
+                    return None
+            column += len(literal)
+            continue
+        size = fraction if directive == 'f' else _widths[directive]
+        if (digits[column:column + size] > 9).any():
+            return None
+        value = digits[column].astype(np.int64)
+        for row in digits[column + 1:column + size]:
+            value = value * 10 + row
+        fields[directive] = value
+        column += size
+
+    n = len(strings)
+    zeros = np.zeros(n, dtype=np.int64)
+    years = fields.get('Y', zeros + 1900)
+    if 'j' in fields:
+        months, days = zeros + 1, fields['j']
+        if ((days < 1) | (days > 366)).any():
+            return None
+    else:
+        months, days = fields.get('m', zeros + 1), fields.get('d', zeros + 1)
+        if ((months < 1) | (months > 12) | (days < 1) | (days > 31)).any():
+            return None
+    hours, minutes, seconds = fields.get('H', zeros), fields.get('M', zeros), fields.get('S', zeros)
+    if ((hours > 23) | (minutes > 59) | (seconds > 59)).any():
+        return None
+    times = from_components(years, months, days, hours, minutes, seconds)
+    # days past the end of their month (Feb 30th, day 366 of a common year) roll over, reject them
+    if (times.astype('M8[Y]').astype(np.int64) + 1970 != years).any() or \
+            ('j' not in fields and ((times.astype('M8[M]').astype(np.int64) % 12) + 1 != months).any()):
+        return None
+    if 'f' in fields:
+        times = times + (fields['f'] * 10 ** (9 - fraction)).astype('m8[ns]')
+    return times
+
+
+def from_strings(strings, format=None):
+    """Timestamps from strings in one fixed format
+
+    Strings that all have the same length and only use %Y %m %d %H %M %S %j %f (with %f last) are
+    parsed as a byte matrix, digits straight to integers. Anything else (ragged widths, other
+    directives, missing values, offsets) goes through pd.to_datetime with the same format, so the
+    result is the same either way and bad input still raises ValueError.
+
+    Args:
+        strings (array-like): Timestamp strings
+        format (str, optional): strptime format. None is ISO 8601 (the layout is taken from the
+            first string)
+
+    Returns:
+        ndarray: datetime64[ns]
+    """
+    strings = np.asarray(strings, dtype=object)
+    if len(strings) == 0:
+        return np.array([], dtype='M8[ns]')
+    fixed = _iso_format(str(strings[0])) if format is None else format
+    times = None if fixed is None else _parse_fixed(strings, fixed)
+    if times is None:
+        times = np.asarray(pd.to_datetime(strings, format='ISO8601' if format is None else format), dtype='M8[ns]')
+    return times
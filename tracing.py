@@ -0,0 +1,331 @@
+import warnings
+import numpy as np
+import pandas as pd
+import concurrent.futures as cf
+
+# Offline field line tracing for conjugate points, the local stand-in for
+# shared.get_ccmc_tsyg_conj. Every starting point is stepped at once (vectorized RK4), so whole
+# station chains over years of times can be traced in one go without touching the network.
+#
+# The internal field is the IGRF dipole. The default model='dipole' is only that, a pure dipole
+# and not Tsyganenko: the solar wind enters just through the aberration of the GSM frame (vswgse),
+# and pdyn, dst, byimf and bzimf are ignored (with a warning). With model='t01' the Tsyganenko 2001
+# external field is added, which needs the optional geopack package. geopack evaluates T01 one point at a time, so
+# that mode is much slower (spot checks and modest batches, spread over processes with workers=).
+try:
+    from geopack import t01 as _t01
+except Exception:
+    # missing, or unable to load its IGRF coefficients
+    _t01 = None
+
+# IGRF dipole coefficients (g10, g11, h11) in nT at each epoch, and their secular variation after
+# the last one. Interpolated linearly in between, as IGRF is
+igrf_dipole = pd.DataFrame({'g10': [-29619.4, -29554.63, -29496.57, -29441.46, -29403.41, -29350.0],
+                            'g11': [-1728.2, -1669.05, -1586.42, -1501.77, -1451.37, -1410.3],
+                            'h11': [5186.1, 5077.99, 4944.26, 4795.99, 4653.35, 4545.5]},
+                           index=[2000, 2005, 2010, 2015, 2020, 2025])
+igrf_dipole_sv = {'g10': 12.6, 'g11': 10.0, 'h11': -21.5}
+
+# Inputs only the T01 external field uses, model='dipole' ignores them
+t01_only_params = ('pdyn', 'dst', 'byimf', 'bzimf')
+
+# T01 inputs used where params doesn't give them (geopack's own defaults for the solar wind velocity)
+default_params = {'pdyn': 2.0, 'dst': 0.0, 'byimf': 0.0, 'bzimf': 0.0, 'vswgse': [-400.0, 0.0, 0.0]}
+
+# Earth's orbital speed (km/s), added to the solar wind Y velocity for the aberration
+earth_orbital_speed = 29.78
+
+# GSM X (Re) beyond which T01 isn't valid. Steps never exceed max_step, so the RK stages stay well
+# short of the x = -20 Re where geopack refuses to evaluate it
+t01_tail_limit = -15.0
+
+conjugate_fields = ['geo_lat', 'geo_lon', 'dpl_lat', 'dpl_lon']
+
+
+def _unit(vectors):
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def _dipole_coefficients(times):
+    """(g10, g11, h11) per time from igrf_dipole"""
+    years = pd.DatetimeIndex(times)
+    years = (years.year + (years.dayofyear - 1) / 365.25).to_numpy(dtype=np.float64)
+    epochs = igrf_dipole.index.to_numpy(dtype=np.float64)
+    coefficients = []
+    for name in ('g10', 'g11', 'h11'):
+        values = np.interp(years, epochs, igrf_dipole[name].to_numpy())
+        after = years > epochs[-1]
+        values[after] += igrf_dipole_sv[name] * (years[after] - epochs[-1])
+        coefficients.append(values)
+    return coefficients
+
+
+def _sun(times):
+    """Greenwich sidereal time, the sun direction (GEI) and the obliquity, geopack's low precision SUN"""
+    times = pd.DatetimeIndex(times)
+    seconds = (times - times.normalize()).total_seconds().to_numpy()
+    fday = seconds / 86400
+    year = times.year.to_numpy()
+    dj = 365 * (year - 1900) + (year - 1901) // 4 + times.dayofyear.to_numpy() - 1 + fday - 0.5
+    t = dj / 36525
+    vl = np.mod(279.696678 + 0.9856473354 * dj, 360)
+    gst = np.radians(np.mod(279.690983 + 0.9856473354 * dj + 360 * fday + 180, 360))
+    g = np.radians(np.mod(358.475845 + 0.985600267 * dj, 360))
+    slong = np.radians(vl + (1.91946 - 0.004789 * t) * np.sin(g) + 0.020094 * np.sin(2 * g))
+    obliq = np.radians(23.45229 - 0.0130125 * t)
+    slp = slong - np.radians(0.005686)
+    sind = np.sin(obliq) * np.sin(slp)
+    cosd = np.sqrt(1 - sind ** 2)
+    sdec = np.arctan(sind / cosd)
+    srasn = np.pi - np.arctan2(np.cos(obliq) / np.sin(obliq) * sind / cosd, -np.cos(slp) / cosd)
+    sun = np.stack([np.cos(srasn) * np.cos(sdec), np.sin(srasn) * np.cos(sdec), np.sin(sdec)], axis=-1)
+    return gst, sun, obliq
+
+
+def _frames(times, vswgse):
+    """GEO to GSM rotation matrices, dipole tilts, GEO dipole axes and dipole moments per time
+
+    X is the aberrated sun direction (against the solar wind, as geopack's recalc does with a
+    solar wind velocity), Y is perpendicular to the dipole axis and Z completes the set.
+    """
+    g10, g11, h11 = _dipole_coefficients(times)
+    moment = np.sqrt(g10 ** 2 + g11 ** 2 + h11 ** 2)
+    # unit vector of the northern dipole pole in GEO
+    axis = np.stack([-g11 / moment, -h11 / moment, -g10 / moment], axis=-1)
+
+    gst, sun, obliq = _sun(times)
+    cos_gst, sin_gst = np.cos(gst), np.sin(gst)
+    zeros, ones = np.zeros_like(gst), np.ones_like(gst)
+    geo_to_gei = np.stack([np.stack([cos_gst, -sin_gst, zeros], axis=-1),
+                           np.stack([sin_gst, cos_gst, zeros], axis=-1),
+                           np.stack([zeros, zeros, ones], axis=-1)], axis=-2)
+
+    # GSE axes in GEI, to put the solar wind velocity in GEI
+    ecliptic_pole = np.stack([zeros, -np.sin(obliq), np.cos(obliq)], axis=-1)
+    y_gse = _unit(np.cross(ecliptic_pole, sun))
+    velocity = vswgse + np.array([0.0, earth_orbital_speed, 0.0])
+    x_gsm = _unit(-(velocity[:, :1] * sun + velocity[:, 1:2] * y_gse + velocity[:, 2:] * ecliptic_pole))
+
+    axis_gei = np.einsum('nij,nj->ni', geo_to_gei, axis)
+    y_gsm = _unit(np.cross(axis_gei, x_gsm))
+    z_gsm = np.cross(x_gsm, y_gsm)
+    gei_to_gsm = np.stack([x_gsm, y_gsm, z_gsm], axis=-2)
+    tilt = np.arcsin(np.clip(np.einsum('ni,ni->n', axis_gei, x_gsm), -1, 1))
+    return gei_to_gsm @ geo_to_gei, tilt, axis, moment
+
+
+def _cartesian(lat, lon, radius=1.0):
+    lat, lon = np.radians(lat), np.radians(lon)
+    return radius * np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def _lat_lon(vectors):
+    """(lat, lon) in degrees, lon from 0 to 360"""
+    vectors = _unit(vectors)
+    return np.degrees(np.arcsin(np.clip(vectors[:, 2], -1, 1))), np.mod(np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0])), 360)
+
+
+def _param_names(params):
+    """Names of the inputs params gives (see _params_table for the forms it takes)"""
+    if params is None:
+        return set()
+    if isinstance(params, pd.DataFrame):
+        return set(params.columns)
+    if isinstance(params, (list, tuple)):
+        return set(name for entry in params for name in entry)
+    return set(params)
+
+
+def _params_table(params, n):
+    """Model inputs as arrays: pdyn, dst, byimf, bzimf (n,) and vswgse (n, 3)
+
+    params may be None, one dict (scalars or arrays), a list of dicts or a DataFrame (e.g. from
+    shared.get_omni_sw_params_range(..., offline=True)).
+    """
+    if params is None:
+        params = {}
+    if isinstance(params, pd.DataFrame):
+        params = dict((name, params[name].to_numpy()) for name in params.columns)
+    elif isinstance(params, (list, tuple)):
+        params = dict((name, [entry.get(name, default_params[name]) for entry in params]) for name in default_params)
+    table = {}
+    for name in ('pdyn', 'dst', 'byimf', 'bzimf'):
+        table[name] = np.broadcast_to(np.asarray(params.get(name, default_params[name]), dtype=np.float64), (n,))
+    vswgse = params.get('vswgse', default_params['vswgse'])
+    if np.ndim(vswgse[0]) == 1:
+        # one velocity per point (a column of 3-arrays from the offline frames)
+        vswgse = np.stack([np.asarray(velocity, dtype=np.float64) for velocity in vswgse])
+    table['vswgse'] = np.broadcast_to(np.asarray(vswgse, dtype=np.float64), (n, 3))
+    for name, values in table.items():
+        # nan inputs (missing solar wind data) fall back to the defaults
+        table[name] = np.where(np.isnan(values), default_params[name], values)
+    return table
+
+
+def _t01_block(parmods, tilts, positions):
+    """T01 (GSM, nT) at a block of points, module level so a process pool can run it"""
+    field = np.empty_like(positions)
+    for i, (parmod, tilt, position) in enumerate(zip(parmods, tilts, positions)):
+        field[i] = _t01.t01(parmod, tilt, *position)
+    return field
+
+
+def _external_field(positions, tilt, table, rows, pool=None, blocks=1):
+    """T01 external field (GSM, nT) at positions, all of them in one batch
+
+    geopack's T01 only takes one point at a time, so the batch is split into blocks that run in
+    pool's worker processes (or in this one without a pool).
+    """
+    parmods = np.zeros((len(rows), 10))
+    for i, name in enumerate(('pdyn', 'dst', 'byimf', 'bzimf')):
+        parmods[:, i] = table[name][rows]
+    if pool is None or len(rows) < 2:
+        return _t01_block(parmods, tilt[rows], positions)
+    parts = [np.array_split(values, min(blocks, len(rows))) for values in (parmods, tilt[rows], positions)]
+    return np.concatenate(list(pool.map(_t01_block, *parts)))
+
+
+def _field(positions, dipoles, moment, tilt, table, rows, model, pool=None, blocks=1):
+    """Total field (GSM, nT) at positions. dipoles are the GSM dipole moment directions"""
+    r = np.linalg.norm(positions, axis=-1, keepdims=True)
+    unit = positions / r
+    field = moment[:, None] * (3 * np.sum(dipoles * unit, axis=-1, keepdims=True) * unit - dipoles) / r ** 3
+    if model == 't01':
+        field = field + _external_field(positions, tilt, table, rows, pool, blocks)
+    return field
+
+
+def trace_conjugates(times, lat, lon, params=None, model='dipole', step=0.03, max_step=0.5, max_radius=60.0, max_steps=20000,
+                     chunk_size=100000, workers=None):
+    """Conjugate points of many (time, lat, lon) starting points, traced along the model field
+
+    Each point starts on the surface (r = 1 Re) and is traced outward along its field line until
+    it comes back down (closed) or leaves max_radius (open). All the points in a chunk are stepped
+    together with RK4, each with a step proportional to its distance from the Earth.
+
+    The default model='dipole' is a pure dipole, not Tsyganenko. Of params it only uses vswgse (the
+    aberration of the GSM frame) and warns that it ignores the others if they're given.
+
+    Only the dipole model is vectorized, and it traces thousands of points a second. T01 comes from
+    geopack one point at a time (about a second or two per conjugate point), so it's for spot
+    checks and modest batches. Each RK stage evaluates it for all the active points as one batch,
+    spread over workers processes.
+
+    Args:
+        times (array-like): Times of the traces
+        lat (array-like): Geographic geocentric latitudes
+        lon (array-like): Geographic longitudes
+        params (dict, list or DataFrame, optional): T01 inputs named as the offline=True solar wind
+            helpers name them ('pdyn', 'dst', 'byimf', 'bzimf', 'vswgse'). One dict (scalars or
+            arrays), one dict per point, or a frame with a row per point. Missing ones use default_params
+        model (str, optional): 'dipole' (default, pure dipole) or 't01' (Tsyganenko 2001, needs geopack)
+        step (float, optional): Step length as a fraction of the distance from the Earth's center
+        max_step (float, optional): Longest step, in Re
+        max_radius (float, optional): Field lines reaching this far (Re) are open
+        max_steps (int, optional): Give up (open) after this many steps
+        chunk_size (int, optional): Points traced together
+        workers (int, optional): Processes to evaluate T01 with. None evaluates it in this process
+
+    Returns:
+        DataFrame: One row per point, 'geo_lat', 'geo_lon', 'dpl_lat', 'dpl_lon' of the conjugate
+        point and 'closed'. Like get_ccmc_tsyg_conj, open field lines come back as zeros with
+        closed False
+    """
+    if model not in ('dipole', 't01'):
+        raise ValueError('Unknown field model: {}'.format(model))
+    if model == 't01' and _t01 is None:
+        raise ImportError('The t01 model needs the geopack package (with its IGRF coefficients)')
+    ignored = sorted(_param_names(params) & set(t01_only_params))
+    if model == 'dipole' and ignored:
+        warnings.warn("model='dipole' ignores {} (only vswgse is used), pass model='t01' to trace with them".format(', '.join(ignored)),
+                      stacklevel=2)
+    times = np.asarray(pd.to_datetime(np.atleast_1d(times)), dtype='M8[ns]')
+    times, lat, lon = [np.ravel(values) for values in np.broadcast_arrays(times, lat, lon)]
+    table = _params_table(params, len(times))
+
+    df_out = pd.DataFrame(0.0, index=range(len(times)), columns=conjugate_fields)
+    df_out['closed'] = False
+    pool = cf.ProcessPoolExecutor(max_workers=workers) if model == 't01' and workers is not None and workers > 1 else None
+    try:
+        for first in range(0, len(times), chunk_size):
+            _trace_chunk(np.arange(first, min(first + chunk_size, len(times))), times, lat, lon, table, model, step, max_step,
+                         max_radius, max_steps, pool, 4 * (workers or 1), df_out)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return df_out
+
+
+def _trace_chunk(rows, times, lat, lon, table, model, step, max_step, max_radius, max_steps, pool, blocks, df_out):
+    """trace_conjugates for one chunk of rows, filling them in on df_out"""
+    chunk = dict((name, values[rows]) for name, values in table.items())
+    geo_to_gsm, tilt, axis, moment = _frames(times[rows], chunk['vswgse'])
+    # the Earth's dipole moment points at the southern pole
+    dipoles = -np.einsum('nij,nj->ni', geo_to_gsm, axis)
+    positions = np.einsum('nij,nj->ni', geo_to_gsm, _cartesian(lat[rows], lon[rows]))
+
+    def field(at, active):
+        return _field(at, dipoles[active], moment[active], tilt, chunk, active, model, pool, blocks)
+
+    def direction(at, active):
+        return _unit(field(at, active))
+
+    # head outward, whichever hemisphere the point is in
+    sign = np.sign(np.sum(field(positions, np.arange(len(rows))) * positions, axis=-1))
+    ends = np.full_like(positions, np.nan)
+    active = np.arange(len(rows))
+    for _ in range(max_steps):
+        if not len(active):
+            break
+        here = positions[active]
+        r = np.linalg.norm(here, axis=-1, keepdims=True)
+        h = np.minimum(step * r, max_step) * sign[active, None]
+        k1 = direction(here, active)
+        k2 = direction(here + h / 2 * k1, active)
+        k3 = direction(here + h / 2 * k2, active)
+        k4 = direction(here + h * k3, active)
+        moved = here + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        r_moved = np.linalg.norm(moved, axis=-1, keepdims=True)
+
+        landed = r_moved[:, 0] <= 1
+        # where the step crossed the surface, by linear interpolation
+        fraction = (r[landed] - 1) / (r[landed] - r_moved[landed])
+        ends[active[landed]] = _unit(here[landed] + fraction * (moved[landed] - here[landed]))
+        lost = r_moved[:, 0] >= max_radius
+        if model == 't01':
+            # T01 is only valid sunward of t01_tail_limit, lines that get further down the tail are open
+            lost |= moved[:, 0] < t01_tail_limit
+        positions[active] = moved
+        active = active[~(landed | lost)]
+
+    closed = ~np.isnan(ends[:, 0])
+    ends_geo = np.einsum('nji,nj->ni', geo_to_gsm[closed], ends[closed])
+    geo_lat, geo_lon = _lat_lon(ends_geo)
+    # dipole (MAG) frame: Z along the dipole axis, Y perpendicular to it and the GEO Z axis
+    z_mag = axis[closed]
+    y_mag = _unit(np.cross(np.array([0.0, 0.0, 1.0]), z_mag))
+    x_mag = np.cross(y_mag, z_mag)
+    dpl_lat, dpl_lon = _lat_lon(np.stack([np.sum(ends_geo * x_mag, axis=-1), np.sum(ends_geo * y_mag, axis=-1),
+                                          np.sum(ends_geo * z_mag, axis=-1)], axis=-1))
+    closed_rows = rows[closed]
+    df_out.loc[closed_rows, 'geo_lat'] = geo_lat
+    df_out.loc[closed_rows, 'geo_lon'] = geo_lon
+    df_out.loc[closed_rows, 'dpl_lat'] = dpl_lat
+    df_out.loc[closed_rows, 'dpl_lon'] = dpl_lon
+    df_out.loc[closed_rows, 'closed'] = True
+
+
+def get_tsyg_conj(datetime, lat, lon, model='dipole', **params):
+    """Conjugate point of a single point on earth, traced offline (see trace_conjugates)
+
+    Takes the output of the solar wind helpers with offline=True as keyword arguments, e.g.
+    get_tsyg_conj(time, lat, lon, model='t01', **shared.get_omni_sw_params(time, offline=True))
+    The default model='dipole' is a pure dipole that ignores all of them but vswgse (and warns so).
+
+    Returns:
+        Dict: 'geo_lat', 'geo_lon', 'dpl_lat', 'dpl_lon' and 'closed', as get_ccmc_tsyg_conj returns
+    """
+    point = trace_conjugates(datetime, lat, lon, params=params, model=model).iloc[0]
+    conjugate = dict((name, float(point[name])) for name in conjugate_fields)
+    conjugate['closed'] = bool(point['closed'])
+    return conjugate